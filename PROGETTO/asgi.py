@@ -2,6 +2,9 @@
 ASGI config for PROGETTO project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with an ASGI server (e.g. ``uvicorn PROGETTO.asgi:application``) to
+enable the Server-Sent Events stream of the kitchen order feed; under WSGI the
+gestione_ordine page falls back to long-polling.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -43,6 +43,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'gestione.strumentazione.StrumentazioneMiddleware',  # Primo: misura anche gli altri middleware
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -56,14 +57,22 @@ ROOT_URLCONF = 'PROGETTO.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'gestione.strumentazione.DjangoTemplatesMisurati',  # DjangoTemplates con il tempo di render
         'DIRS': [os.path.join(BASE_DIR,"templates")],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'gestione.context_processors.frammenti',
+            ],
+            # Template compilati una volta per processo (in sviluppo
+            # l'autoreload svuota la cache quando un template cambia)
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
             ],
         },
     },
@@ -75,14 +84,101 @@ WSGI_APPLICATION = 'PROGETTO.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DATABASE_ENGINE=postgresql passa a PostgreSQL (richiede psycopg) con le
+# variabili POSTGRES_*; altrimenti SQLite con il profilo di produzione.
+
+DATABASE_ENGINE = os.environ.get('DATABASE_ENGINE', 'sqlite')
+CONN_MAX_AGE = int(os.environ.get('CONN_MAX_AGE', 60))  # Connessioni riusate tra le richieste (secondi)
+
+if DATABASE_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'mcunimore'),
+            'USER': os.environ.get('POSTGRES_USER', 'mcunimore'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            'CONN_MAX_AGE': CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+        }
     }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'CONN_MAX_AGE': CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                # Le transazioni prendono subito il lock di scrittura: senza,
+                # una transazione che legge e poi scrive fallisce con
+                # "database is locked" senza attendere il timeout. Vale per
+                # ogni atomic() perche' nell'applicazione tutte scrivono; le
+                # pagine in sola lettura non aprono transazioni (niente
+                # ATOMIC_REQUESTS) e con WAL non aspettano gli scrittori.
+                # Aspettano solo le pagine di modifica dell'admin, che
+                # Django apre comunque in atomic().
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': 5,  # Secondi di attesa sui lock (busy_timeout) prima dell'errore
+            },
+        }
+    }
+
+# Applicati a ogni connessione SQLite (gestione/database.py); l'attesa sui
+# lock e' OPTIONS['timeout'] di DATABASES
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',  # Sicuro con WAL: fsync ai checkpoint
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -20000,  # Negativo: in KiB (20 MB per connessione)
+    'temp_store': 'MEMORY',
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# In produzione con piu' processi serve una cache condivisa (REDIS_URL),
+# altrimenti ogni processo tiene la propria copia del catalogo.
+
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        },
+        'sessioni': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+            'KEY_PREFIX': 'sessioni',
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'mcunimore',
+        },
+        'sessioni': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'mcunimore-sessioni',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        },
+    }
+
+
+# Sessioni e messaggi
+# SESSIONI sceglie dove vivono le sessioni: 'cached_db' (predefinito: letture
+# dalla cache, scritture anche su django_session), 'cache' (solo cache: con
+# LocMem le sessioni si perdono al riavvio), 'signed_cookies' o 'db'.
+# I messaggi usano sempre cookie firmati e non toccano la sessione.
+
+SESSIONI = os.environ.get('SESSIONI', 'cached_db')
+SESSION_ENGINE = f'django.contrib.sessions.backends.{SESSIONI}'
+SESSION_CACHE_ALIAS = 'sessioni'  # Separata dalla cache del catalogo
+MESSAGE_STORAGE = 'django.contrib.messages.storage.cookie.CookieStorage'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -124,9 +220,89 @@ STATICFILES_DIRS = [
     BASE_DIR / "static",  # Percorso alla cartella static
 ]
 
+# collectstatic copia qui i file con l'hash del contenuto nel nome e le
+# varianti .gz/.br (gestione/statici.py)
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'gestione.statici.ManifestPrecompressoStorage',
+    },
+}
+
+# Senza un web server davanti, Django serve STATIC_ROOT con le varianti
+# precompresse e Cache-Control immutable
+SERVI_STATICI = os.environ.get('SERVI_STATICI', '1') == '1'
+
 
 LOGIN_URL = '/login/'  # Percorso corretto della tua pagina di login
 
+ORDINI_PER_PAGINA = 50  # Dimensione delle pagine di orders e gestione_ordine
+
+# Mappa e ricerca dei fast food vicini
+MAPPA_CENTRO = (41.9028, 12.4964)  # Centro iniziale della mappa (Roma)
+MAPPA_PUNTI_INIZIALI = 50  # Fast food inclusi nella pagina della mappa
+CHECKOUT_FAST_FOOD = 20  # Fast food vicini al cliente proposti in cima alla scelta nel carrello
+FAST_FOOD_MAX_RISULTATI = 200  # Limite di risultati delle API nearby e bbox
+
+# Feed live degli ordini per gestione_ordine (secondi)
+FEED_ORDINI_INTERVALLO = 2  # Intervallo tra due controlli del database
+FEED_ORDINI_LONG_POLL = 25  # Attesa massima di una richiesta long-poll
+FEED_ORDINI_DURATA_SSE = 300  # Durata di uno stream SSE prima della riconnessione
+FEED_ORDINI_ASSESTAMENTO = 1  # Secondi di ritardo del feed: attesa delle scritture concorrenti
+
+# Varianti delle immagini dei prodotti (gestione/immagini.py, richiede Pillow)
+IMMAGINI_CACHE_DIR = BASE_DIR / 'cache_immagini'  # Cache su disco indirizzata dal contenuto
+IMMAGINI_CACHE_MAX_BYTES = 256 * 1024 * 1024  # Oltre, si eliminano le varianti usate meno di recente
+IMMAGINI_PULIZIA_INTERVALLO = 300  # Secondi minimi tra due pulizie della cache durante le richieste
+IMMAGINI_LARGHEZZE = (160, 320, 640)  # Larghezze offerte nello srcset
+IMMAGINI_QUALITA_WEBP = 80
+
+# Frammenti statici di base.html e map.html in cache (secondi, 0 li disattiva)
+FRAMMENTI_CACHE_TIMEOUT = int(os.environ.get('FRAMMENTI_CACHE_TIMEOUT', 3600))
+
+# Coda degli ordini (gestione/coda.py): con CODA_ORDINI=1 il checkout accoda
+# l'ordine e risponde subito, gli ordini li crea run_order_workers, che deve
+# girare accanto al server (vedi README). Senza, l'ordine viene creato subito
+CODA_ORDINI = os.environ.get('CODA_ORDINI', '0') == '1'
+CODA_ORDINI_TENTATIVI = 5  # Poi il comando resta scartato (dead letter)
+CODA_ORDINI_ATTESA = 2  # Secondi prima del primo nuovo tentativo, raddoppia ogni volta
+CODA_ORDINI_LAVORAZIONE_MAX = 300  # Secondi dopo cui una lavorazione interrotta torna in coda
+CODA_ORDINI_SCARTATI_GIORNI = 7  # Per quanti giorni il cliente vede i checkout scartati in orders.html
+
+# Coupon: per quanto restano nel database dopo la scadenza prima che
+# sweep_coupons li elimini (la scadenza si sceglie con mint_coupons --valid-days)
+COUPON_CONSERVA_GIORNI = int(os.environ.get('COUPON_CONSERVA_GIORNI', 30))
+
+# Ordini consegnati piu' vecchi di cosi' (giorni) vengono spostati in
+# ArchivedOrder da archive_orders
+ARCHIVIO_ORDINI_GIORNI = int(os.environ.get('ARCHIVIO_ORDINI_GIORNI', 90))
+
+# Dashboard delle vendite (metrics/vendite/): periodo predefinito e massimo in giorni
+VENDITE_GIORNI_PREDEFINITI = 31
+VENDITE_GIORNI_MAX = 366
+
+# Strumentazione delle richieste (gestione/strumentazione.py)
+# Header Server-Timing con tempi totali, SQL e template: espone dettagli
+# interni a chiunque, quindi solo con STRUMENTAZIONE_SERVER_TIMING=1
+STRUMENTAZIONE_SERVER_TIMING = os.environ.get('STRUMENTAZIONE_SERVER_TIMING', '0') == '1'
+RICHIESTA_LENTA_MS = 500  # Oltre questa durata la richiesta finisce nel log con le sue query
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'gestione.richieste_lente': {'handlers': ['console'], 'level': 'WARNING', 'propagate': False},
+        'gestione.coda': {'handlers': ['console'], 'level': 'WARNING', 'propagate': False},
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
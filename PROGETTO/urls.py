@@ -15,7 +15,8 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path
+from django.conf import settings
+from django.urls import path, re_path
 from PROGETTO import views
 from django.contrib.auth.views import LogoutView
 
@@ -29,15 +30,39 @@ urlpatterns = [
     path('prodotti/', views.prodotti_view, name='prodotti'),
     path('add_to_cart/<int:product_id>/', views.add_to_cart, name='add_to_cart'),
     path('remove_from_cart/<int:cart_item_id>/', views.remove_from_cart, name='remove_from_cart'),
+    path('api/carrello/', views.carrello_api, name='carrello_api'),
+    path('api/carrello/aggiungi/', views.carrello_api_aggiungi, name='carrello_api_aggiungi'),
+    path('api/carrello/rimuovi/', views.carrello_api_rimuovi, name='carrello_api_rimuovi'),
+    path('api/carrello/quantita/', views.carrello_api_quantita, name='carrello_api_quantita'),
+    path('api/carrello/batch/', views.carrello_api_batch, name='carrello_api_batch'),  # N modifiche, una transazione
     path('orders/', views.orders_view, name='orders'),
+    path('orders/export/', views.export_miei_ordini, name='export_miei_ordini'),
     path('ristoratore/login/', views.ristoratore_login, name='ristoratore_login'),
     path('gestione_ordine/', views.gestione_ordine, name='gestione_ordine'),  # Nuovo percorso per la gestione ordini
+    path('gestione_ordine/export/', views.export_ordini, name='export_ordini'),
+    path('gestione_ordine/feed/', views.ordini_feed_stream, name='ordini_feed_stream'),  # Stream SSE (ASGI)
+    path('gestione_ordine/feed/poll/', views.ordini_feed_poll, name='ordini_feed_poll'),  # Long-poll (WSGI)
     path('update_order_status/<int:order_id>/', views.update_order_status, name='update_order_status'),
+    path('gestione_ordine/stato/', views.transizione_ordini, name='transizione_ordini'),  # Cambio di stato di piu' ordini
     path('coupon/', views.coupon_page, name='coupon_page'),
     path('reveal_coupon/<int:coupon_id>/', views.reveal_coupon, name='reveal_coupon'),  # Aggiungi questa linea
     path('apply_coupon/', views.apply_coupon, name='apply_coupon'),
     path('map/', views.map_view, name='map'),  # Aggiungi questa linea
+    path('api/fastfood/nearby', views.fast_food_nearby, name='fast_food_nearby'),
+    path('api/fastfood/bbox', views.fast_food_bbox, name='fast_food_bbox'),
+    path(
+        'immagini/prodotti/<int:product_id>/<slug:digest>/<int:larghezza>.<str:formato>',
+        views.immagine_prodotto, name='immagine_prodotto',
+    ),  # Varianti ridimensionate / WebP
+    path('metrics/rotte/', views.metriche_rotte, name='metriche_rotte'),  # Istogrammi per rotta (staff)
+    path('metrics/coda/', views.metriche_coda, name='metriche_coda'),  # Profondita' della coda degli ordini (staff)
+    path('metrics/vendite/', views.dashboard_vendite, name='dashboard_vendite'),  # Vendite dal rollup (staff)
     path('create_order/', views.create_order, name='create_order'),
 ]
 
-
+if settings.SERVI_STATICI:
+    # File statici con hash e varianti precompresse (in sviluppo runserver
+    # li serve prima dai finder)
+    urlpatterns.append(
+        re_path(rf"^{settings.STATIC_URL.strip('/')}/(?P<percorso>.+)$", views.file_statico, name='file_statico'),
+    )
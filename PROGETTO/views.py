@@ -1,17 +1,40 @@
+import asyncio
+import time
+from datetime import date
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, Http404, HttpResponseBadRequest, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from gestione.models import Product, Cart, CartItem
 from gestione.models import User, Order, FastFood, Coupon 
-import pytz
-import random
-import string
 from django.views.decorators.csrf import csrf_exempt
+from django.db import IntegrityError, transaction
+from django.db.models import Sum
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from gestione.models import Coupon
+from gestione.catalogo import griglia_catalogo
+from gestione.prezzi import prezzo_carrello
+from gestione.carrello import aggiungi_prodotto, applica_modifiche, rimuovi_riga, valida_modifiche
+from gestione.ordini import crea_ordine
+from gestione import coda
+from gestione.stati import cambia_stato, stati_di_arrivo
+from gestione import vendite
+from gestione import ricerca
+from gestione.feed import cursore_iniziale, delta_ordini, ordini_modificati
+from gestione.paginazione import pagina_keyset, pagina_keyset_unione
+from gestione.archivio import ordini_utente
+from gestione.coupon import conia_coupon, coupon_validi, riscatta_coupon
+from gestione.export import FORMATI as FORMATI_EXPORT, esporta, ordini_da_esportare
+from gestione.spaziale import fast_food_nel_riquadro, fast_food_vicini
+from gestione import immagini
+from gestione.statici import CACHE_IMMUTABILE, risposta_file_statico
+from gestione.strumentazione import istogrammi
 import json
 
 def homepage(request):
@@ -22,18 +45,23 @@ def register(request):
         username = request.POST.get('username')
         password = request.POST.get('password')
 
-        # Salva i dati nel database con password hashata
-        user = User(username=username)
-        user.set_password(password)  # Hasha la password
-        user.save()
+        if not username:
+            return render(request, 'register.html', {'error': 'Il nome utente è obbligatorio.'})
 
-        # Crea un carrello per il nuovo utente
-        Cart.objects.get_or_create(user=user)
-
-        # Autentica e logga l'utente
-        user = authenticate(request, username=username, password=password)
-        if user is not None:
-            login(request, user)
+        try:
+            with transaction.atomic():
+                # Salva i dati nel database con password hashata (un solo hash).
+                # Carrello e coupon vengono creati dal segnale post_save nella
+                # stessa transazione.
+                user = User(username=username)
+                user.set_password(password)  # Hasha la password
+                user.save()
+
+                # La password e' appena stata impostata: si logga l'utente
+                # direttamente, senza ricalcolarne l'hash con authenticate()
+                login(request, user, backend='django.contrib.auth.backends.ModelBackend')
+        except IntegrityError:
+            return render(request, 'register.html', {'error': 'Nome utente già in uso.'})
 
         return redirect('homepage')
 
@@ -59,50 +87,49 @@ def logout_view(request):
     return redirect('homepage')
 
 def cart_view(request):
-    cart = Cart.objects.get(user=request.user)
-    cart_items = CartItem.objects.filter(cart=cart)
-    total_price = sum(item.product.price * item.quantity for item in cart_items)
+    cart = Cart.objects.select_related('coupon').get(user=request.user)
+    prezzo = prezzo_carrello(cart)  # Subtotale, sconto e totale con una sola query sulle righe
 
-    if cart.coupon:
-        discount = (total_price * cart.coupon.discount) / 100
-        total_price -= discount
-
-    fast_foods = FastFood.objects.all()  # Recupera tutti i fast food dal database
+    # Tutti i fast food restano selezionabili; con la geolocalizzazione la
+    # pagina mette in cima i CHECKOUT_FAST_FOOD piu' vicini al cliente
+    fast_foods = FastFood.objects.only('id', 'name').order_by('name', 'id')
 
     context = {
-        'cart_items': cart_items,
-        'total_price': total_price,
+        'cart_items': prezzo.items,
+        'total_price': prezzo.totale,
+        'prezzo': prezzo,
         'fast_foods': fast_foods,  # Passa i fast food al template
+        'nearby': {'url': reverse('fast_food_nearby'), 'k': settings.CHECKOUT_FAST_FOOD},
     }
     return render(request, 'cart.html', context)
 
 @login_required
 def prodotti_view(request):
-    products = Product.objects.all()
     if request.method == 'POST':
         product_id = request.POST.get('product_id')
-        product = get_object_or_404(Product, id=product_id)
-        cart, created = Cart.objects.get_or_create(user=request.user)
-        # Aggiungi il prodotto al carrello
-        cart.total_price += product.price  # Aggiorna il prezzo totale
-        cart.save()
+        product = get_object_or_404(Product.objects.only('id'), id=product_id)
+        cart, created = Cart.objects.only('id').get_or_create(user=request.user)
+        # Aggiungi il prodotto al carrello (riga e totale aggiornati insieme)
+        aggiungi_prodotto(cart.id, product.id)
         return redirect('prodotti')  # Ricarica la pagina dei prodotti
-    return render(request, 'prodotti.html', {'products': products})
+    # La griglia dei prodotti arriva gia' renderizzata dalla cache del catalogo
+    cart, created = Cart.objects.select_related('coupon').get_or_create(user=request.user)
+    context = {
+        'griglia_prodotti': griglia_catalogo(),
+        'articoli_carrello': CartItem.objects.filter(cart_id=cart.id).aggregate(n=Sum('quantity'))['n'] or 0,
+        'totale_carrello': cart.calculate_discounted_price(),
+        'carrello_config': {'batch_url': reverse('carrello_api_batch'), 'attesa_ms': 300},
+    }
+    return render(request, 'prodotti.html', context)
 
 @login_required
 def add_to_cart(request, product_id):
-    product = get_object_or_404(Product, id=product_id)
-    cart, created = Cart.objects.get_or_create(user=request.user)
-
-    # Controlla se il prodotto è già nel carrello
-    cart_item, item_created = CartItem.objects.get_or_create(cart=cart, product=product)
-    if not item_created:
-        cart_item.quantity += 1  # Incrementa la quantità se il prodotto è già presente
-    cart_item.save()
+    product = get_object_or_404(Product.objects.only('id', 'name'), id=product_id)
+    cart, created = Cart.objects.only('id').get_or_create(user=request.user)
 
-    # Aggiorna il prezzo totale del carrello
-    cart.total_price += product.price
-    cart.save()
+    # Incrementa la quantità (o crea la riga) e ricalcola il totale con
+    # UPDATE atomici, così due richieste concorrenti non si sovrascrivono
+    aggiungi_prodotto(cart.id, product.id)
 
     # Aggiungi un messaggio di conferma
     messages.success(request, f"Il prodotto '{product.name}' è stato aggiunto al carrello!")
@@ -111,44 +138,259 @@ def add_to_cart(request, product_id):
 
 @login_required
 def remove_from_cart(request, cart_item_id):
-    cart_item = get_object_or_404(CartItem, id=cart_item_id, cart__user=request.user)
-    cart_item.cart.total_price -= cart_item.product.price * cart_item.quantity
-    cart_item.cart.save()
-    cart_item.delete()
-    messages.success(request, f"Il prodotto '{cart_item.product.name}' è stato rimosso dal carrello.")
+    cart_item = get_object_or_404(
+        CartItem.objects.select_related('product').only('id', 'cart_id', 'product__name'),
+        id=cart_item_id, cart__user=request.user,
+    )
+    # Elimina la riga e ricalcola il totale nella stessa transazione
+    if rimuovi_riga(cart_item.cart_id, cart_item.id):
+        messages.success(request, f"Il prodotto '{cart_item.product.name}' è stato rimosso dal carrello.")
     return redirect('cart')
 
+def _riepilogo_carrello(cart_id):
+    cart = Cart.objects.select_related('coupon').get(id=cart_id)
+    return JsonResponse({'carrello': prezzo_carrello(cart).come_dict()})
+
+def _modifica_carrello(request, operazioni):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Metodo non consentito.'}, status=405)
+    try:
+        modifiche = valida_modifiche(operazioni(json.loads(request.body or b'{}')))
+    except (ValueError, TypeError, AttributeError) as errore:  # JSONDecodeError e' un ValueError
+        return JsonResponse({'error': str(errore) or 'Richiesta non valida.'}, status=400)
+    cart, created = Cart.objects.only('id').get_or_create(user=request.user)
+    # Tutte le modifiche e il ricalcolo del totale in una sola transazione
+    applica_modifiche(cart.id, modifiche)
+    return _riepilogo_carrello(cart.id)
+
+@login_required
+def carrello_api(request):
+    # GET /api/carrello/ : riepilogo del carrello (righe, sconto, totale)
+    cart, created = Cart.objects.only('id').get_or_create(user=request.user)
+    return _riepilogo_carrello(cart.id)
+
+@login_required
+def carrello_api_aggiungi(request):
+    # POST {"product_id": 3, "quantita": 1}
+    return _modifica_carrello(request, lambda dati: [dict(dati, azione='aggiungi')])
+
+@login_required
+def carrello_api_rimuovi(request):
+    # POST {"product_id": 3}
+    return _modifica_carrello(request, lambda dati: [dict(dati, azione='rimuovi')])
+
+@login_required
+def carrello_api_quantita(request):
+    # POST {"product_id": 3, "quantita": 2} (0 rimuove la riga)
+    return _modifica_carrello(request, lambda dati: [dict(dati, azione='quantita')])
+
+@login_required
+def carrello_api_batch(request):
+    # POST {"operazioni": [{"azione": "aggiungi", "product_id": 3, "quantita": 2}, ...]}
+    return _modifica_carrello(request, lambda dati: dati.get('operazioni'))
+
 def orders_view(request):
     if not request.user.is_authenticated:
         return redirect('login')  # Reindirizza al login se non autenticato
 
-    # Recupera gli ordini dell'utente
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')
+    # Recupera una pagina degli ordini dell'utente, attivi e archiviati
+    # (l'orario viene convertito nel fuso di TIME_ZONE direttamente dal
+    # filtro date del template)
+    orders, cursore_successivo = pagina_keyset_unione(
+        ordini_utente(request.user),
+        request.GET.get('cursore'),
+        settings.ORDINI_PER_PAGINA,
+    )
 
-    # Converte l'orario in UTC+2
-    timezone_utc2 = pytz.timezone('Europe/Rome')
-    for order in orders:
-        order.created_at = order.created_at.astimezone(timezone_utc2)
+    context = {
+        'orders': orders,
+        'pagina_successiva': url_pagina(request, 'cursore', cursore_successivo) if cursore_successivo else None,
+        'prima_pagina': url_pagina(request, 'cursore', None) if 'cursore' in request.GET else None,
+        'ordini_in_sospeso': coda.in_sospeso(request.user) if settings.CODA_ORDINI else 0,
+        'ordini_scartati': coda.scartati(request.user) if settings.CODA_ORDINI else [],
+    }
+    return render(request, 'orders.html', context)
+
+def _parametri_export(request):
+    # Formato e intervallo di date (YYYY-MM-DD, estremi inclusi) dalla query string
+    formato = request.GET.get('formato', 'csv')
+    if formato not in FORMATI_EXPORT:
+        raise ValueError(f"Formato non supportato: {formato}")
+    dal = date.fromisoformat(request.GET['dal']) if request.GET.get('dal') else None
+    al = date.fromisoformat(request.GET['al']) if request.GET.get('al') else None
+    return formato, dal, al
+
+def _parametro_fast_food(request):
+    # Id del fast food dalla query string, None se assente
+    valore = request.GET.get('fast_food')
+    if not valore:
+        return None
+    try:
+        return int(valore)
+    except ValueError:
+        raise ValueError(f"Fast food non valido: {valore}")
+
+def _risposta_export(ordini, formato, nome_file):
+    response = StreamingHttpResponse(esporta(ordini, formato), content_type=FORMATI_EXPORT[formato])
+    response['Content-Disposition'] = f'attachment; filename="{nome_file}.{formato}"'
+    return response
+
+@login_required
+def export_miei_ordini(request):
+    try:
+        formato, dal, al = _parametri_export(request)
+    except ValueError as errore:
+        return HttpResponseBadRequest(str(errore))
+    ordini = ordini_da_esportare(user=request.user, dal=dal, al=al)
+    return _risposta_export(ordini, formato, 'ordini')
 
-    return render(request, 'orders.html', {'orders': orders})
+@login_required
+def export_ordini(request):
+    # Export per i gestori: tutti gli ordini, filtrabili per fast food e periodo
+    if not (request.user.is_ristoratore or request.user.is_staff):
+        return HttpResponseForbidden()
+    try:
+        formato, dal, al = _parametri_export(request)
+        fast_food_id = _parametro_fast_food(request)
+    except ValueError as errore:
+        return HttpResponseBadRequest(str(errore))
+    ordini = ordini_da_esportare(fast_food_id=fast_food_id, dal=dal, al=al)
+    return _risposta_export(ordini, formato, 'ordini_fast_food')
+
+def url_pagina(request, parametro, cursore):
+    # Mantiene i filtri correnti cambiando solo il cursore indicato;
+    # senza cursore torna alla prima pagina
+    query = request.GET.copy()
+    if cursore is None:
+        query.pop(parametro, None)
+    else:
+        query[parametro] = cursore
+    return f"?{query.urlencode()}"
 
 def gestione_ordine(request):
     fast_foods = FastFood.objects.all()
     selected_fast_food = None
-    orders = []
+    ordini_in_loco = []
+    ordini_delivery = []
+    pagina_in_loco = None
+    pagina_delivery = None
+    status = request.GET.get('status')
+    if status not in dict(Order.STATUS_CHOICES):
+        status = None
+    testo_ricerca = request.GET.get('q', '').strip()
+
+    feed_cursore = None
+    feed_config = None
 
     if 'fast_food' in request.GET:
         fast_food_id = request.GET.get('fast_food')
         selected_fast_food = get_object_or_404(FastFood, id=fast_food_id)
-        orders = Order.objects.filter(fast_food=selected_fast_food).order_by('-created_at')
+        orders = Order.objects.filter(fast_food=selected_fast_food)
+        if status:
+            orders = orders.filter(status=status)
+        if testo_ricerca:
+            # Articoli e indirizzo di consegna dall'indice full-text
+            orders = ricerca.filtra(orders, testo_ricerca)
+
+        # Una query paginata per tipo di ordine, filtrata dal database
+        ordini_in_loco, successivo = pagina_keyset(
+            orders.filter(tipo_di_ordine='in_loco'),
+            request.GET.get('cursore_in_loco'),
+            settings.ORDINI_PER_PAGINA,
+        )
+        pagina_in_loco = url_pagina(request, 'cursore_in_loco', successivo) if successivo else None
+        ordini_delivery, successivo = pagina_keyset(
+            orders.filter(tipo_di_ordine='delivery'),
+            request.GET.get('cursore_delivery'),
+            settings.ORDINI_PER_PAGINA,
+        )
+        pagina_delivery = url_pagina(request, 'cursore_delivery', successivo) if successivo else None
+
+    # Il feed live aggiorna solo la prima pagina non filtrata
+    primo_caricamento = not any(request.GET.get(p) for p in ('status', 'q', 'cursore_in_loco', 'cursore_delivery'))
+    if selected_fast_food and primo_caricamento:
+        # Il feed live parte dall'ultimo ordine modificato mostrato nella pagina
+        feed_cursore = cursore_iniziale(selected_fast_food.id)
+        query = f"?fast_food={selected_fast_food.id}"
+        feed_config = {
+            'cursore': feed_cursore,
+            'sse': isinstance(request, ASGIRequest),  # Lo stream SSE richiede ASGI
+            'stream_url': reverse('ordini_feed_stream') + query,
+            'poll_url': reverse('ordini_feed_poll') + query,
+        }
 
     context = {
         'fast_foods': fast_foods,
         'selected_fast_food': selected_fast_food.name if selected_fast_food else "Tutti",
-        'orders': orders,
+        'selected_fast_food_id': selected_fast_food.id if selected_fast_food else None,
+        'status_choices': Order.STATUS_CHOICES,
+        'stati_di_arrivo': stati_di_arrivo(),  # Il form in blocco non offre ORDINE RICEVUTO
+        'selected_status': status,
+        'testo_ricerca': testo_ricerca,
+        'ordini_in_loco': ordini_in_loco,
+        'ordini_delivery': ordini_delivery,
+        'pagina_in_loco': pagina_in_loco,
+        'pagina_delivery': pagina_delivery,
+        'feed_cursore': feed_cursore,
+        'feed_config': feed_config,
     }
     return render(request, 'gestione_ordine.html', context)
 
+async def ordini_feed_stream(request):
+    # Server-Sent Events: disponibile solo quando il sito gira sotto ASGI
+    user = await request.auser()
+    if not (user.is_authenticated and user.is_ristoratore):
+        return HttpResponseForbidden()
+    try:
+        fast_food_id = _parametro_fast_food(request)
+    except ValueError as errore:
+        return HttpResponseBadRequest(str(errore))
+    if fast_food_id is None or not await FastFood.objects.filter(id=fast_food_id).aexists():
+        raise Http404
+    # Alla riconnessione il browser rimanda l'ultimo id ricevuto
+    cursore = request.headers.get('Last-Event-ID') or request.GET.get('cursore')
+
+    @sync_to_async
+    def prossimo_delta(cursore):
+        ordini, cursore = ordini_modificati(fast_food_id, cursore)
+        return delta_ordini(ordini, request), cursore
+
+    async def eventi(cursore):
+        fine = time.monotonic() + settings.FEED_ORDINI_DURATA_SSE
+        yield f"retry: {settings.FEED_ORDINI_INTERVALLO * 1000}\n\n"
+        while time.monotonic() < fine:
+            delta, cursore = await prossimo_delta(cursore)
+            if delta:
+                dati = json.dumps({'cursore': cursore, 'ordini': delta})
+                yield f"id: {cursore}\nevent: ordini\ndata: {dati}\n\n"
+            else:
+                yield ": keepalive\n\n"
+            await asyncio.sleep(settings.FEED_ORDINI_INTERVALLO)
+
+    response = StreamingHttpResponse(eventi(cursore), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Evita il buffering di nginx
+    return response
+
+@login_required
+def ordini_feed_poll(request):
+    # Long-poll per WSGI: risponde appena ci sono modifiche o allo scadere dell'attesa
+    if not request.user.is_ristoratore:
+        return HttpResponseForbidden()
+    try:
+        fast_food_id = _parametro_fast_food(request)
+    except ValueError as errore:
+        return HttpResponseBadRequest(str(errore))
+    fast_food = get_object_or_404(FastFood, id=fast_food_id)
+    cursore = request.GET.get('cursore')
+    fine = time.monotonic() + settings.FEED_ORDINI_LONG_POLL
+    while True:
+        ordini, cursore = ordini_modificati(fast_food.id, cursore)
+        if ordini or time.monotonic() >= fine:
+            break
+        time.sleep(settings.FEED_ORDINI_INTERVALLO)
+    return JsonResponse({'cursore': cursore, 'ordini': delta_ordini(ordini, request)})
+
 def ristoratore_login(request):
     if request.method == 'POST':
         username = request.POST.get('username')
@@ -165,17 +407,61 @@ def ristoratore_login(request):
 
 @login_required
 def update_order_status(request, order_id):
+    if not request.user.is_ristoratore:
+        return HttpResponseForbidden()
     if request.method == 'POST':
-        order = get_object_or_404(Order, id=order_id)
         new_status = request.POST.get('status')
-        order.status = new_status
-        order.save()
-        messages.success(request, f"Lo stato dell'ordine è stato aggiornato a '{new_status}'.")
+        try:
+            aggiornati, saltati = cambia_stato([order_id], new_status)
+        except ValueError as errore:
+            messages.error(request, str(errore))
+            return redirect('gestione_ordine')
+        if aggiornati:
+            messages.success(request, f"Lo stato dell'ordine è stato aggiornato a '{new_status}'.")
+        else:
+            messages.error(request, f"L'ordine non esiste o non può passare a '{new_status}'.")
         return redirect('gestione_ordine')  # Reindirizza alla pagina di gestione ordini
 
+@login_required
+def transizione_ordini(request):
+    # POST {"ordini": [1, 2, 3], "status": "IN PREPARAZIONE", "fast_food": 4}
+    # (JSON) oppure il form della pagina di gestione ordini
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Metodo non consentito.'}, status=405)
+    if not request.user.is_ristoratore:
+        return HttpResponseForbidden()
+    json_richiesto = request.content_type == 'application/json'
+    try:
+        if json_richiesto:
+            dati = json.loads(request.body or b'{}')
+            order_ids, new_status, fast_food_id = dati.get('ordini'), dati.get('status'), dati.get('fast_food')
+        else:
+            order_ids, new_status = request.POST.getlist('ordini'), request.POST.get('status')
+            fast_food_id = request.POST.get('fast_food') or None
+        # Un solo UPDATE per tutti gli ordini selezionati
+        aggiornati, saltati = cambia_stato(
+            order_ids, new_status, int(fast_food_id) if fast_food_id is not None else None
+        )
+    except (ValueError, TypeError, AttributeError) as errore:  # JSONDecodeError e' un ValueError
+        if json_richiesto:
+            return JsonResponse({'error': str(errore) or 'Richiesta non valida.'}, status=400)
+        messages.error(request, str(errore) or 'Richiesta non valida.')
+        aggiornati, saltati = None, None
+
+    if json_richiesto:
+        return JsonResponse({'status': new_status, 'aggiornati': aggiornati, 'saltati': saltati})
+    if aggiornati:
+        messages.success(request, f"{len(aggiornati)} ordini aggiornati a '{new_status}'.")
+    if saltati:
+        messages.error(request, f"Ordini saltati (stato non compatibile o non trovati): {', '.join(map(str, saltati))}.")
+    destinazione = reverse('gestione_ordine')
+    if fast_food_id:
+        destinazione += f"?fast_food={fast_food_id}"
+    return redirect(destinazione)
+
 @login_required
 def coupon_page(request):
-    coupons = Coupon.objects.filter(user=request.user, is_active=True)  # Mostra solo i coupon attivi
+    coupons = coupon_validi(request.user)  # Mostra solo i coupon attivi e non scaduti
     context = {
         'coupons': coupons,
     }
@@ -193,18 +479,8 @@ def reveal_coupon(request, coupon_id):
 @receiver(post_save, sender=User)
 def generate_coupons_and_cart_for_user(sender, instance, created, **kwargs):
     if created:  # Esegui solo quando l'utente viene creato
-        # Genera sempre 5 coupon
-        for _ in range(5):
-            code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=10))  # Codice casuale
-            discount = random.randint(5, 12)  # Sconto casuale tra il 5% e il 12%
-            description = f"Coupon con {discount}% di sconto"
-            Coupon.objects.create(
-                user=instance,
-                code=code,
-                discount=discount,
-                description=description,
-                is_active=True
-            )
+        # Genera sempre 5 coupon (sconto casuale tra il 5% e il 12%) con un solo inserimento
+        conia_coupon([instance.id], per_utente=5)
         # Crea un carrello per il nuovo utente
         Cart.objects.create(user=instance)
 
@@ -212,35 +488,100 @@ def generate_coupons_and_cart_for_user(sender, instance, created, **kwargs):
 def apply_coupon(request):
     if request.method == 'POST':
         coupon_code = request.POST.get('coupon_code')
-        cart = Cart.objects.get(user=request.user)
+        cart = Cart.objects.only('id').get(user=request.user)
 
-        try:
-            coupon = Coupon.objects.get(code=coupon_code, user=request.user, is_active=True)
-            cart.coupon = coupon  # Associa il coupon al carrello
-            cart.save()
-
-            # Disattiva il coupon dopo l'applicazione
-            coupon.is_active = False
-            coupon.save()
-
-            messages.success(request, f"Il coupon '{coupon.code}' è stato applicato con successo!")
-        except Coupon.DoesNotExist:
-            messages.error(request, "Il codice del coupon non è valido o il coupon è già stato utilizzato.")
+        # Disattiva il coupon e lo associa al carrello in una sola transazione
+        if riscatta_coupon(request.user, cart.id, coupon_code):
+            messages.success(request, f"Il coupon '{coupon_code}' è stato applicato con successo!")
+        else:
+            messages.error(request, "Il codice del coupon non è valido, è scaduto o è già stato utilizzato.")
 
         return redirect('cart')  # Reindirizza alla pagina del carrello
 
 def map_view(request):
-    fast_foods = FastFood.objects.all()
-    points = [
-        {
-            "lat": fast_food.latitudine,
-            "lng": fast_food.longitudine,
-            "name": fast_food.name,
-            "address": fast_food.address
-        }
-        for fast_food in fast_foods
-    ]
-    return render(request, 'map.html', {'points': json.dumps(points), 'fast_foods': fast_foods})
+    # Solo i fast food piu' vicini al centro iniziale della mappa: gli altri
+    # vengono caricati dall'API del riquadro quando la mappa si sposta
+    lat, lng = settings.MAPPA_CENTRO
+    points = fast_food_vicini(lat, lng, settings.MAPPA_PUNTI_INIZIALI)
+    mappa_config = {
+        'centro': [lat, lng],
+        'bbox_url': reverse('fast_food_bbox'),
+    }
+    return render(request, 'map.html', {'points': json.dumps(points), 'fast_foods': points, 'mappa_config': mappa_config})
+
+def _coordinata(request, nome, limite):
+    valore = float(request.GET[nome])
+    if not -limite <= valore <= limite:
+        raise ValueError(nome)
+    return valore
+
+def _numero_risultati(request, predefinito):
+    return max(1, min(int(request.GET.get('k', predefinito)), settings.FAST_FOOD_MAX_RISULTATI))
+
+def fast_food_nearby(request):
+    # /api/fastfood/nearby?lat=&lng=&k= : i k fast food piu' vicini (KD-tree in memoria)
+    try:
+        lat = _coordinata(request, 'lat', 90)
+        lng = _coordinata(request, 'lng', 180)
+        k = _numero_risultati(request, 10)
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'Parametri lat, lng e k non validi.'}, status=400)
+    return JsonResponse({'fast_food': fast_food_vicini(lat, lng, k)})
+
+def fast_food_bbox(request):
+    # /api/fastfood/bbox?bbox=ovest,sud,est,nord : i fast food visibili nella mappa
+    try:
+        ovest, sud, est, nord = (float(valore) for valore in request.GET['bbox'].split(','))
+        if not (-90 <= sud <= nord <= 90 and -180 <= ovest <= 180 and -180 <= est <= 180):
+            raise ValueError('bbox')
+        k = _numero_risultati(request, settings.FAST_FOOD_MAX_RISULTATI)
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'Parametro bbox non valido (ovest,sud,est,nord).'}, status=400)
+    return JsonResponse({'fast_food': fast_food_nel_riquadro(sud, ovest, nord, est, k)})
+
+def immagine_prodotto(request, product_id, digest, larghezza, formato):
+    # Il digest dell'immagine originale e' nell'URL: la risposta non cambia mai
+    product = get_object_or_404(Product.objects.only('id', 'image_name'), id=product_id)
+    percorso = immagini.variante(product, larghezza, formato, digest)
+    if percorso is None:
+        raise Http404
+    response = FileResponse(open(percorso, 'rb'), content_type=immagini.FORMATI[formato])
+    response['Cache-Control'] = CACHE_IMMUTABILE
+    return response
+
+def file_statico(request, percorso):
+    # STATIC_ROOT dopo collectstatic: varianti .br/.gz e cache immutabile per i nomi con hash
+    return risposta_file_statico(request, percorso)
+
+@login_required
+def metriche_rotte(request):
+    # Durate per rotta raccolte dal middleware di strumentazione (solo staff)
+    if not request.user.is_staff:
+        return HttpResponseForbidden()
+    return JsonResponse(istogrammi.riepilogo())
+
+@login_required
+def dashboard_vendite(request):
+    # Ordini e incassi per fast food, periodo e tipo, dal rollup (solo staff)
+    if not request.user.is_staff:
+        return HttpResponseForbidden()
+    try:
+        _, dal, al = _parametri_export(request)
+        dal, al = vendite.periodo(dal, al)  # Mai tutte le celle: periodo limitato
+        righe = vendite.riepilogo(
+            fast_food_id=_parametro_fast_food(request), dal=dal, al=al,
+            granularita=request.GET.get('granularita', 'giorno'),
+        )
+    except ValueError as errore:
+        return HttpResponseBadRequest(str(errore))
+    return JsonResponse({'vendite': righe})
+
+@login_required
+def metriche_coda(request):
+    # Profondita' della coda degli ordini (solo staff)
+    if not request.user.is_staff:
+        return HttpResponseForbidden()
+    return JsonResponse(coda.profondita())
 
 @login_required
 def create_order(request):
@@ -261,32 +602,35 @@ def create_order(request):
 
         fast_food = FastFood.objects.get(id=fast_food_id) if fast_food_id else None
 
-        # Recupera il carrello dell'utente
-        cart = Cart.objects.get(user=request.user)
-        cart_items = CartItem.objects.filter(cart=cart)
-        total_price = sum(item.product.price * item.quantity for item in cart_items)
-
-        # Applica il coupon se presente
-        if cart.coupon:
-            discount = (total_price * cart.coupon.discount) / 100
-            total_price -= discount
-
-        # Crea l'ordine
-        order = Order.objects.create(
-            user=request.user,
-            total_price=total_price,
-            items=", ".join([f"{item.quantity}x {item.product.name}" for item in cart_items]),
-            tipo_di_ordine=order_type,
-            fast_food=fast_food,
-            delivery_address=address if order_type == 'delivery' else None,
-            delivery_city=city if order_type == 'delivery' else None
-        )
-
-        # Svuota il carrello
-        cart_items.delete()
-        cart.total_price = 0
-        cart.coupon = None
-        cart.save()
+        campi = {
+            'tipo_di_ordine': order_type,
+            'fast_food': fast_food,
+            'delivery_address': address if order_type == 'delivery' else None,
+            'delivery_city': city if order_type == 'delivery' else None,
+        }
+        if settings.CODA_ORDINI:
+            # Un solo INSERT: l'ordine lo creano i worker (run_order_workers)
+            try:
+                coda.accoda_ordine(request.user, **campi)
+            except ValueError as errore:
+                messages.error(request, str(errore))
+                return redirect('cart')
+            messages.success(request, "Ordine ricevuto! Comparirà tra i tuoi ordini appena il fast food lo prende in carico.")
+            return redirect('orders')
+
+        # Recupera il carrello dell'utente e calcola il prezzo (coupon incluso)
+        cart = Cart.objects.select_related('coupon').get(user=request.user)
+        prezzo = prezzo_carrello(cart)
+
+        with transaction.atomic():
+            # Crea l'ordine con le sue righe
+            crea_ordine(request.user, prezzo, **campi)
+
+            # Svuota il carrello
+            CartItem.objects.filter(cart=cart).delete()
+            cart.total_price = 0
+            cart.coupon = None
+            cart.save()
 
         messages.success(request, "Ordine effettuato con successo!")
         return redirect('orders')
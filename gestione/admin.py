@@ -1,6 +1,12 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import Product, Order, User, FastFood, Coupon
+from django.db import transaction
+from django.db.models import Q
+from django.urls import reverse
+from django.utils.html import format_html
+
+from . import ricerca, vendite
+from .models import Product, Order, OrderLine, User, FastFood, Coupon, ArchivedOrder
 
 class CustomUserAdmin(UserAdmin):
     fieldsets = UserAdmin.fieldsets + (
@@ -10,27 +16,92 @@ class CustomUserAdmin(UserAdmin):
 
 admin.site.register(User, CustomUserAdmin)
 
-admin.site.register(Product)
+@admin.register(Product)
+class ProductAdmin(admin.ModelAdmin):
+    list_display = ('name', 'price')
+    search_fields = ('name',)
+    search_help_text = "Cerca nel nome del prodotto."
+
+    def get_search_results(self, request, queryset, search_term):
+        # Indice full-text invece di LIKE '%...%' su tutta la tabella
+        return ricerca.filtra(queryset, search_term), False
 
 admin.site.register(FastFood)
 
+class OrderLineInline(admin.TabularInline):
+    model = OrderLine
+    extra = 0
+    fields = ('product', 'product_name', 'quantity', 'unit_price')
+    readonly_fields = fields
+    can_delete = False
+
 class OrderAdmin(admin.ModelAdmin):
     list_display = ('user', 'created_at', 'total_price', 'status', 'tipo_di_ordine')
     list_filter = ('status', 'tipo_di_ordine', 'created_at')
-    search_fields = ('user__username', 'items')
+    search_fields = ('user__username', 'items', 'delivery_address', 'delivery_city')
+    search_help_text = "Cerca per utente, articoli o indirizzo di consegna."
+    inlines = [OrderLineInline]
     ordering = ('-created_at',)
-    readonly_fields = ('created_at', 'user', 'total_price', 'items')
+    # Lo stato si cambia solo dalla gestione ordini (stati.cambia_stato), che
+    # controlla le transizioni e aggiorna feed e rollup delle vendite
+    exclude = ('status',)
+    readonly_fields = ('created_at', 'user', 'total_price', 'items', 'stato')
+
+    @admin.display(description='Stato')
+    def stato(self, obj):
+        url = reverse('gestione_ordine')
+        if obj.fast_food_id:
+            url += f'?fast_food={obj.fast_food_id}'
+        return format_html('{} (<a href="{}">cambia dalla gestione ordini</a>)', obj.get_status_display(), url)
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            vendite.togli_ordini([obj.id])
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            vendite.togli_ordini(queryset.values_list('id', flat=True))
+            super().delete_queryset(request, queryset)
 
-    # Rendi il campo `status` modificabile
-    def get_readonly_fields(self, request, obj=None):
-        if request.user.is_superuser:
-            return self.readonly_fields
-        return self.readonly_fields + ('status',)
+    def get_search_results(self, request, queryset, search_term):
+        # Articoli e indirizzo dall'indice full-text; gli utenti con una
+        # sottoquery sulla tabella utenti, poi l'indice degli ordini per utente
+        def utenti(termine):
+            return Q(user_id__in=User.objects.filter(username__icontains=termine).values('id'))
+
+        return ricerca.filtra(queryset, search_term, utenti), False
 
 admin.site.register(Order, OrderAdmin)
 
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    # Solo consultazione: gli ordini archiviati arrivano da archive_orders
+    list_display = ('id', 'user', 'created_at', 'total_price', 'tipo_di_ordine', 'fast_food')
+    list_filter = ('tipo_di_ordine',)
+    search_fields = ('user__username',)
+    ordering = ('-created_at',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 @admin.register(Coupon)
 class CouponAdmin(admin.ModelAdmin):
     list_display = ('code', 'discount', 'description', 'is_active')
     list_filter = ('is_active',)
     search_fields = ('code', 'description')
+    search_help_text = "Un codice (anche solo l'inizio) o parte della descrizione."
+
+    def get_search_results(self, request, queryset, search_term):
+        # Inizio del codice come intervallo sull'indice univoco di code; se
+        # nessun codice corrisponde, la ricerca completa su codice e descrizione
+        codice = search_term.strip().upper()
+        if not codice:
+            return queryset, False
+        per_codice = queryset.filter(code__gte=codice, code__lt=codice + '\U0010ffff')
+        if per_codice.exists():
+            return per_codice, False
+        return super().get_search_results(request, queryset, search_term)
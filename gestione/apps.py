@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class GestioneConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'gestione'
+
+    def ready(self):
+        from . import signals  # noqa: F401  Registra i receiver dei segnali
@@ -0,0 +1,58 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ArchivedOrder, Order
+
+CAMPI_ORDINE = (
+    'id', 'user_id', 'created_at', 'updated_at', 'total_price', 'items', 'status',
+    'tipo_di_ordine', 'fast_food_id', 'delivery_address', 'delivery_city',
+)
+
+
+def limite_archiviazione(giorni):
+    return timezone.now() - timedelta(days=giorni)
+
+
+def da_archiviare(prima_del):
+    """Ordini consegnati creati prima di prima_del, dal piu' vecchio."""
+    return Order.objects.filter(status='CONSEGNATO', created_at__lt=prima_del).order_by('created_at', 'id')
+
+
+def archivia_blocco(prima_del, dimensione):
+    """
+    Sposta in ArchivedOrder fino a dimensione ordini consegnati, righe
+    comprese, in una sola transazione breve: ogni blocco e' completo o non
+    e' avvenuto, quindi il comando si puo' interrompere e rilanciare.
+    Restituisce il numero di ordini archiviati.
+    """
+    with transaction.atomic():
+        ordini = list(da_archiviare(prima_del).prefetch_related('lines')[:dimensione])
+        if not ordini:
+            return 0
+        ArchivedOrder.objects.bulk_create([
+            ArchivedOrder(
+                **{campo: getattr(order, campo) for campo in CAMPI_ORDINE},
+                righe=[
+                    {
+                        'product_id': line.product_id,
+                        'product_name': line.product_name,
+                        'quantity': line.quantity,
+                        'unit_price': str(line.unit_price),
+                    }
+                    for line in order.lines.all()
+                ],
+            )
+            for order in ordini
+        ])
+        Order.objects.filter(id__in=[order.id for order in ordini]).delete()
+    return len(ordini)
+
+
+def ordini_utente(user):
+    """Gli ordini del cliente nelle due tabelle, per pagina_keyset_unione."""
+    return [
+        Order.objects.filter(user=user).select_related('fast_food'),
+        ArchivedOrder.objects.filter(user=user).select_related('fast_food'),
+    ]
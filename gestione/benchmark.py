@@ -0,0 +1,369 @@
+import json
+import logging
+import random
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from decimal import Decimal
+
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+
+@contextmanager
+def database_di_prova(nome=None):
+    """
+    Crea un database di test (con le migrazioni applicate) per i benchmark,
+    cosi' i dati di prova non finiscono nel database reale.
+    Con nome si usa un file invece del database in memoria.
+    """
+    setup_test_environment()
+    # Le richieste lente sono attese sotto carico: niente log durante la misura
+    logging.getLogger('gestione.richieste_lente').disabled = True
+    if nome:
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = nome
+    originale = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(originale, verbosity=0)
+        teardown_test_environment()
+        logging.getLogger('gestione.richieste_lente').disabled = False
+
+
+def percentile(valori, p):
+    if not valori:
+        return 0.0
+    if len(valori) == 1:
+        return valori[0]
+    return statistics.quantiles(valori, n=100, method='inclusive')[p - 1]
+
+
+def riepilogo(valori):
+    return {
+        'p50': percentile(valori, 50),
+        'p95': percentile(valori, 95),
+        'p99': percentile(valori, 99),
+        'media': statistics.fmean(valori) if valori else 0.0,
+    }
+
+
+# Istruzioni di controllo delle transazioni, escluse dal conteggio delle query
+CONTROLLO_TRANSAZIONI = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+
+def conta_query(captured_queries):
+    return sum(1 for query in captured_queries if not query['sql'].startswith(CONTROLLO_TRANSAZIONI))
+
+
+# Benchmark delle rotte -------------------------------------------------
+
+PASSWORD_BENCH = 'Bench-pass-123'
+
+
+def popola_dati(clienti, ordini_per_cliente=200, prodotti=30, fast_food=50, seme=0):
+    """
+    Dataset realistico per il benchmark: un cliente e un ristoratore per
+    client simulato, catalogo, fast food sparsi in Italia e uno storico
+    di ordini (con le righe) per ogni cliente.
+    """
+    from .models import FastFood, Order, OrderLine, Product, User
+
+    casuale = random.Random(seme)
+    catalogo = Product.objects.bulk_create(
+        Product(name=f"Prodotto {i}", price=Decimal(casuale.randint(150, 1500)) / 100, image_name='prodotto_1.png')
+        for i in range(prodotti)
+    )
+    negozi = []
+    for i in range(fast_food):
+        negozio = FastFood(
+            name=f"Fast food {i}", address=f"Via Bench {i}",
+            latitudine=casuale.uniform(37.0, 46.5), longitudine=casuale.uniform(7.0, 18.0),
+        )
+        negozio.save()  # save(): il segnale calcola il geohash
+        negozi.append(negozio)
+
+    utenti, ristoratori = [], []
+    for i in range(clienti):
+        utenti.append(User.objects.create_user(username=f'bench_cliente{i}', password=PASSWORD_BENCH))
+        ristoratori.append(User.objects.create_user(
+            username=f'bench_ristoratore{i}', password=PASSWORD_BENCH, is_ristoratore=True,
+        ))
+
+    for utente in utenti:
+        ordini = Order.objects.bulk_create(
+            Order(
+                user=utente, total_price=0, items='',
+                tipo_di_ordine=casuale.choice(['delivery', 'in_loco']),
+                status=casuale.choice(Order.STATUS_CHOICES)[0],
+                fast_food=casuale.choice(negozi),
+                delivery_address='Via Roma 1', delivery_city='Modena',
+            )
+            for _ in range(ordini_per_cliente)
+        )
+        righe = []
+        for ordine in ordini:
+            for prodotto in casuale.sample(catalogo, 2):
+                righe.append(OrderLine(
+                    order=ordine, product=prodotto, product_name=prodotto.name,
+                    quantity=casuale.randint(1, 3), unit_price=prodotto.price,
+                ))
+        OrderLine.objects.bulk_create(righe, batch_size=500)
+    return {
+        'utenti': utenti,
+        'ristoratori': ristoratori,
+        'prodotti': [prodotto.id for prodotto in catalogo],
+        'fast_food': [negozio.id for negozio in negozi],
+    }
+
+
+@dataclass
+class Rotta:
+    """
+    Come chiamare una rotta di PROGETTO/urls.py. percorso e dati ricevono
+    il contesto del client simulato; prepara viene eseguita prima di ogni
+    richiesta, fuori dalla misura.
+    """
+    nome: str
+    percorso: object
+    metodo: str = 'get'
+    ruolo: str = 'cliente'
+    dati: object = None
+    json: bool = False
+    prepara: object = None
+
+
+def _riga_da_rimuovere(ctx):
+    from .carrello import aggiungi_prodotto
+    from .models import CartItem
+
+    aggiungi_prodotto(ctx.cart_id, ctx.prodotto())
+    ctx.stato['riga'] = CartItem.objects.filter(cart_id=ctx.cart_id).values_list('id', flat=True).first()
+
+
+def _coupon_da_applicare(ctx):
+    from .coupon import conia_coupon
+    from .models import Coupon
+
+    conia_coupon([ctx.utente.id])
+    ctx.stato['coupon'] = Coupon.objects.filter(user=ctx.utente, is_active=True).latest('id')
+
+
+def _carrello_pieno(ctx):
+    from .carrello import aggiungi_prodotto
+
+    aggiungi_prodotto(ctx.cart_id, ctx.prodotto(), 2)
+
+
+def _url_immagine(product_id):
+    from .immagini import url_variante
+    from .models import Product
+
+    return url_variante(Product.objects.get(id=product_id), 320, 'webp')
+
+
+ROTTE = [
+    Rotta('homepage', lambda ctx: '/', ruolo='anonimo'),
+    Rotta('register', lambda ctx: '/register/', 'post', ruolo='anonimo',
+          dati=lambda ctx: {'username': f'bench_nuovo{ctx.indice}_{ctx.contatore}', 'password': PASSWORD_BENCH}),
+    Rotta('login', lambda ctx: '/login/', 'post', ruolo='anonimo',
+          dati=lambda ctx: {'username': ctx.utente.username, 'password': PASSWORD_BENCH}),
+    Rotta('logout', lambda ctx: '/logout/', prepara=lambda ctx: ctx.client.force_login(ctx.utente)),
+    Rotta('cart', lambda ctx: '/cart/'),
+    Rotta('prodotti', lambda ctx: '/prodotti/'),
+    Rotta('add_to_cart', lambda ctx: f'/add_to_cart/{ctx.prodotto()}/'),
+    Rotta('remove_from_cart', lambda ctx: f"/remove_from_cart/{ctx.stato['riga']}/", prepara=_riga_da_rimuovere),
+    Rotta('carrello_api', lambda ctx: '/api/carrello/'),
+    Rotta('carrello_api_aggiungi', lambda ctx: '/api/carrello/aggiungi/', 'post', json=True,
+          dati=lambda ctx: {'product_id': ctx.prodotto()}),
+    Rotta('carrello_api_rimuovi', lambda ctx: '/api/carrello/rimuovi/', 'post', json=True,
+          dati=lambda ctx: {'product_id': ctx.prodotto()}),
+    Rotta('carrello_api_quantita', lambda ctx: '/api/carrello/quantita/', 'post', json=True,
+          dati=lambda ctx: {'product_id': ctx.prodotto(), 'quantita': 3}),
+    Rotta('carrello_api_batch', lambda ctx: '/api/carrello/batch/', 'post', json=True,
+          dati=lambda ctx: {'operazioni': [
+              {'azione': 'aggiungi', 'product_id': ctx.prodotto(), 'quantita': 1} for _ in range(5)
+          ]}),
+    Rotta('orders', lambda ctx: '/orders/'),
+    # Il CSV (predefinito) e' coperto da export_ordini: qui il formato NDJSON
+    Rotta('export_miei_ordini', lambda ctx: '/orders/export/?formato=ndjson'),
+    Rotta('ristoratore_login', lambda ctx: '/ristoratore/login/', 'post', ruolo='anonimo',
+          dati=lambda ctx: {'username': ctx.ristoratore.username, 'password': PASSWORD_BENCH}),
+    Rotta('gestione_ordine', lambda ctx: f'/gestione_ordine/?fast_food={ctx.fast_food()}', ruolo='ristoratore'),
+    Rotta('export_ordini', lambda ctx: f'/gestione_ordine/export/?fast_food={ctx.fast_food()}', ruolo='ristoratore'),
+    # Senza cursore, su un fast food con ordini, il long-poll risponde subito
+    Rotta('ordini_feed_poll', lambda ctx: f'/gestione_ordine/feed/poll/?fast_food={ctx.fast_food_con_ordini()}',
+          ruolo='ristoratore'),
+    Rotta('update_order_status', lambda ctx: f'/update_order_status/{ctx.ordine()}/', 'post', ruolo='ristoratore',
+          dati=lambda ctx: {'status': 'IN PREPARAZIONE'}),
+    Rotta('transizione_ordini', lambda ctx: '/gestione_ordine/stato/', 'post', ruolo='ristoratore', json=True,
+          dati=lambda ctx: {'ordini': [ctx.ordine() for _ in range(20)], 'status': 'IN PREPARAZIONE'}),
+    Rotta('coupon_page', lambda ctx: '/coupon/'),
+    Rotta('reveal_coupon', lambda ctx: f"/reveal_coupon/{ctx.stato['coupon'].id}/", 'post', prepara=_coupon_da_applicare),
+    Rotta('apply_coupon', lambda ctx: '/apply_coupon/', 'post', prepara=_coupon_da_applicare,
+          dati=lambda ctx: {'coupon_code': ctx.stato['coupon'].code}),
+    Rotta('map', lambda ctx: '/map/', ruolo='anonimo'),
+    Rotta('immagine_prodotto', lambda ctx: _url_immagine(ctx.prodotto()), ruolo='anonimo'),
+    Rotta('fast_food_nearby', lambda ctx: '/api/fastfood/nearby?lat=44.65&lng=10.93&k=10', ruolo='anonimo'),
+    Rotta('fast_food_bbox', lambda ctx: '/api/fastfood/bbox?bbox=9.0,43.0,13.0,46.0', ruolo='anonimo'),
+    Rotta('create_order', lambda ctx: '/create_order/', 'post', prepara=_carrello_pieno,
+          dati=lambda ctx: {'order_type': 'delivery', 'address': 'Via Roma 1', 'city': 'Modena'}),
+]
+
+# Rotte senza nome (admin) o non misurabili con richieste brevi
+ROTTE_ESCLUSE = {
+    'ordini_feed_stream': "stream SSE di lunga durata, misurato tramite ordini_feed_poll",
+    'metriche_rotte': "diagnostica riservata allo staff",
+    'metriche_coda': "diagnostica riservata allo staff",
+    'dashboard_vendite': "riservata allo staff, legge solo il rollup",
+    'file_statico': "richiede collectstatic; misurato dal web server in produzione",
+}
+
+
+def rotte_non_coperte():
+    """Nomi delle rotte di urls.py senza uno scenario di benchmark."""
+    from django.urls import URLPattern, get_resolver
+
+    nomi = {
+        pattern.name for pattern in get_resolver().url_patterns
+        if isinstance(pattern, URLPattern) and pattern.name
+    }
+    return sorted(nomi - {rotta.nome for rotta in ROTTE} - set(ROTTE_ESCLUSE))
+
+
+class ContestoClient:
+    """Stato di un client simulato: il suo utente, il suo carrello, i dati di prova."""
+
+    def __init__(self, indice, dati, seme=0):
+        from .models import Cart, Order
+
+        self.indice = indice
+        self.utente = dati['utenti'][indice]
+        self.ristoratore = dati['ristoratori'][indice]
+        self.cart_id = Cart.objects.get(user=self.utente).id
+        self._prodotti = dati['prodotti']
+        self._fast_food = dati['fast_food']
+        ordini = list(Order.objects.filter(user=self.utente).values_list('id', 'fast_food_id'))
+        self._ordini = [order_id for order_id, _ in ordini]
+        self._fast_food_ordini = sorted({fast_food_id for _, fast_food_id in ordini}) or self._fast_food
+        self._casuale = random.Random(seme + indice)
+        self.client = None
+        self.contatore = 0
+        self.stato = {}
+
+    def prodotto(self):
+        return self._casuale.choice(self._prodotti)
+
+    def fast_food(self):
+        return self._casuale.choice(self._fast_food)
+
+    def fast_food_con_ordini(self):
+        return self._casuale.choice(self._fast_food_ordini)
+
+    def ordine(self):
+        return self._casuale.choice(self._ordini)
+
+    def nuovo_client(self, ruolo):
+        from django.test import Client
+
+        self.client = Client()
+        if ruolo == 'cliente':
+            self.client.force_login(self.utente)
+        elif ruolo == 'ristoratore':
+            self.client.force_login(self.ristoratore)
+
+
+def _richiesta(rotta, ctx):
+    """Esegue una richiesta; restituisce (ms, query, status) o solleva l'errore."""
+    from django.test.utils import CaptureQueriesContext
+
+    ctx.contatore += 1
+    if rotta.prepara:
+        rotta.prepara(ctx)
+    percorso = rotta.percorso(ctx)
+    dati = rotta.dati(ctx) if rotta.dati else None
+    argomenti = {'content_type': 'application/json'} if rotta.json else {}
+    if rotta.json:
+        dati = json.dumps(dati)
+    with CaptureQueriesContext(connection) as ctx_query:
+        inizio = time.perf_counter()
+        risposta = getattr(ctx.client, rotta.metodo)(percorso, dati, **argomenti)
+        if risposta.streaming:
+            b''.join(risposta.streaming_content)
+        durata = (time.perf_counter() - inizio) * 1000
+    return durata, conta_query(ctx_query.captured_queries), risposta.status_code
+
+
+def misura_rotta(rotta, contesti, richieste):
+    """
+    Ogni contesto esegue richieste chiamate alla rotta, tutti in parallelo
+    (un thread per client simulato). Restituisce le statistiche della rotta.
+    """
+    durate, query, status, errori = [], [], {}, []
+    lock = threading.Lock()
+
+    def client_simulato(ctx):
+        try:
+            ctx.nuovo_client(rotta.ruolo)
+            for _ in range(richieste):
+                try:
+                    durata, n_query, codice = _richiesta(rotta, ctx)
+                except Exception as errore:
+                    with lock:
+                        errori.append(repr(errore))
+                    continue
+                with lock:
+                    durate.append(durata)
+                    query.append(n_query)
+                    status[codice] = status.get(codice, 0) + 1
+        finally:
+            if len(contesti) > 1:
+                connection.close()
+
+    inizio = time.perf_counter()
+    if len(contesti) == 1:
+        client_simulato(contesti[0])
+    else:
+        threads = [threading.Thread(target=client_simulato, args=(ctx,)) for ctx in contesti]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    durata = time.perf_counter() - inizio
+
+    risultato = {key: round(valore, 3) for key, valore in riepilogo(durate).items()}
+    risultato.update({
+        'richieste': len(durate),
+        'throughput': round(len(durate) / durata, 1) if durata else 0.0,
+        'query_media': round(statistics.fmean(query), 2) if query else 0.0,
+        'query_max': max(query, default=0),
+        'status': {str(codice): n for codice, n in sorted(status.items())},
+        'errori': len(errori) + sum(n for codice, n in status.items() if codice >= 500),
+    })
+    if errori:
+        risultato['primo_errore'] = errori[0]
+    return risultato
+
+
+def confronta(base, attuale, soglia=20.0, soglia_ms=1.0):
+    """
+    Regressioni di attuale rispetto alla baseline: p95 peggiorato oltre
+    soglia (percento) e oltre soglia_ms (per ignorare il rumore delle rotte
+    velocissime), query medie aumentate o nuovi errori.
+    """
+    regressioni = []
+    for nome, misura in sorted(attuale.items()):
+        riferimento = base.get(nome)
+        if riferimento is None:
+            continue
+        prima, dopo = riferimento['p95'], misura['p95']
+        if dopo - prima > soglia_ms and dopo > prima * (1 + soglia / 100):
+            regressioni.append(f"{nome}: p95 {prima:.1f}ms -> {dopo:.1f}ms")
+        if misura['query_media'] > riferimento['query_media'] + 0.5:
+            regressioni.append(f"{nome}: query {riferimento['query_media']} -> {misura['query_media']}")
+        if misura['errori'] > riferimento['errori']:
+            regressioni.append(f"{nome}: errori {riferimento['errori']} -> {misura['errori']}")
+    return regressioni
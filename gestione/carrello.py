@@ -0,0 +1,149 @@
+import random
+import time
+
+from django.db import IntegrityError, OperationalError, transaction
+from django.db.models import DecimalField, F, OuterRef, PositiveIntegerField, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Least
+
+from .models import Cart, CartItem, Product
+
+# Tentativi quando SQLite segnala il database bloccato da un'altra scrittura
+TENTATIVI = 10
+ATTESA_TENTATIVO = 0.02
+ATTESA_MASSIMA = 0.5
+
+# Limiti delle modifiche inviate dall'API del carrello
+MAX_MODIFICHE = 50
+MAX_QUANTITA = 99
+
+
+def con_riprova(operazione):
+    """
+    Esegue operazione in una transazione breve, ripetendola se il database
+    e' bloccato da una scrittura concorrente.
+    """
+    for tentativo in range(TENTATIVI):
+        try:
+            with transaction.atomic():
+                return operazione()
+        except OperationalError as errore:
+            if 'locked' not in str(errore) or tentativo == TENTATIVI - 1:
+                raise
+            # Attesa crescente e casuale, per non ripartire tutti insieme
+            time.sleep(random.uniform(0, min(ATTESA_MASSIMA, ATTESA_TENTATIVO * 2 ** tentativo)))
+
+
+def ricalcola_totale(cart_id):
+    """
+    Aggiorna Cart.total_price con un solo UPDATE che somma le righe nel
+    database: il totale non puo' divergere dalle righe del carrello.
+    """
+    totale = (
+        CartItem.objects.filter(cart_id=OuterRef('pk'))
+        .values('cart_id')
+        .annotate(totale=Sum(F('quantity') * F('product__price'), output_field=DecimalField(max_digits=12, decimal_places=2)))
+        .values('totale')
+    )
+    Cart.objects.filter(pk=cart_id).update(
+        total_price=Coalesce(Subquery(totale), Value(0), output_field=DecimalField(max_digits=10, decimal_places=2))
+    )
+
+
+def _incrementata(quantita):
+    # Le aggiunte ripetute si fermano a MAX_QUANTITA, come le quantita' impostate
+    return Least(F('quantity') + quantita, Value(MAX_QUANTITA), output_field=PositiveIntegerField())
+
+
+def _aggiungi(cart_id, product_id, quantita):
+    aggiornate = CartItem.objects.filter(cart_id=cart_id, product_id=product_id).update(
+        quantity=_incrementata(quantita)
+    )
+    if not aggiornate:
+        try:
+            with transaction.atomic():
+                CartItem.objects.create(cart_id=cart_id, product_id=product_id, quantity=min(quantita, MAX_QUANTITA))
+        except IntegrityError:
+            # Un'altra richiesta ha appena creato la riga: si incrementa quella
+            CartItem.objects.filter(cart_id=cart_id, product_id=product_id).update(
+                quantity=_incrementata(quantita)
+            )
+
+
+def _imposta(cart_id, product_id, quantita):
+    if quantita <= 0:
+        _elimina(cart_id, product_id=product_id)
+        return
+    aggiornate = CartItem.objects.filter(cart_id=cart_id, product_id=product_id).update(quantity=quantita)
+    if not aggiornate:
+        try:
+            with transaction.atomic():
+                CartItem.objects.create(cart_id=cart_id, product_id=product_id, quantity=quantita)
+        except IntegrityError:
+            CartItem.objects.filter(cart_id=cart_id, product_id=product_id).update(quantity=quantita)
+
+
+def _elimina(cart_id, **filtro):
+    eliminate, _ = CartItem.objects.filter(cart_id=cart_id, **filtro).delete()
+    return bool(eliminate)
+
+
+# Modifiche applicabili a una riga: (cart_id, product_id, quantita)
+AZIONI = {
+    'aggiungi': _aggiungi,
+    'quantita': _imposta,
+    'rimuovi': lambda cart_id, product_id, quantita: _elimina(cart_id, product_id=product_id),
+}
+
+
+def valida_modifiche(operazioni):
+    """
+    Converte le operazioni ricevute in JSON ({azione, product_id, quantita})
+    in tuple per applica_modifiche. Solleva ValueError se un'operazione non
+    e' valida o se un prodotto non esiste (un'unica query per tutti).
+    """
+    if not isinstance(operazioni, list) or not 0 < len(operazioni) <= MAX_MODIFICHE:
+        raise ValueError(f"Servono da 1 a {MAX_MODIFICHE} operazioni.")
+    modifiche = []
+    for operazione in operazioni:
+        if not isinstance(operazione, dict) or operazione.get('azione') not in AZIONI:
+            raise ValueError("Azione non valida.")
+        try:
+            product_id = int(operazione.get('product_id'))
+            quantita = int(operazione.get('quantita', 1))
+        except (TypeError, ValueError):
+            raise ValueError("product_id e quantita devono essere numeri interi.")
+        if operazione['azione'] == 'aggiungi' and quantita < 1:
+            raise ValueError("La quantita' da aggiungere deve essere positiva.")
+        modifiche.append((operazione['azione'], product_id, max(0, min(quantita, MAX_QUANTITA))))
+    richiesti = {product_id for _, product_id, _ in modifiche}
+    if Product.objects.filter(id__in=richiesti).count() != len(richiesti):
+        raise ValueError("Prodotto inesistente.")
+    return modifiche
+
+
+def applica_modifiche(cart_id, modifiche):
+    """
+    Applica una lista di (azione, product_id, quantita) in una sola
+    transazione, ricalcolando il totale una volta alla fine.
+    """
+    def operazione():
+        for azione, product_id, quantita in modifiche:
+            AZIONI[azione](cart_id, product_id, quantita)
+        ricalcola_totale(cart_id)
+
+    con_riprova(operazione)
+
+
+def aggiungi_prodotto(cart_id, product_id, quantita=1):
+    applica_modifiche(cart_id, [('aggiungi', product_id, quantita)])
+
+
+def rimuovi_riga(cart_id, cart_item_id):
+    """Elimina la riga del carrello; restituisce False se non esiste piu'."""
+    def operazione():
+        eliminata = _elimina(cart_id, id=cart_item_id)
+        if eliminata:
+            ricalcola_totale(cart_id)
+        return eliminata
+
+    return con_riprova(operazione)
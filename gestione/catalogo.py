@@ -0,0 +1,96 @@
+import time
+
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+from .models import Product
+
+# Chiavi della cache del catalogo: la versione corrente viene cambiata ad ogni
+# modifica di un prodotto, cosi' gli snapshot vecchi non vengono piu' letti
+# e scadono da soli.
+VERSIONE_KEY = 'catalogo:versione'
+PRODOTTI_KEY = 'catalogo:prodotti:{versione}'
+GRIGLIA_KEY = 'catalogo:griglia:{versione}'
+HIT_KEY = 'catalogo:hit'
+MISS_KEY = 'catalogo:miss'
+
+# Gli snapshot restano validi finche' la versione non cambia, il timeout serve
+# solo a liberare la memoria delle versioni abbandonate.
+SNAPSHOT_TIMEOUT = 60 * 60 * 24
+
+
+def _nuova_versione():
+    # Una versione basata sul tempo non torna mai indietro, anche se la chiave
+    # della versione viene espulsa dalla cache.
+    return time.time_ns()
+
+
+def versione_catalogo():
+    versione = cache.get(VERSIONE_KEY)
+    if versione is None:
+        cache.add(VERSIONE_KEY, _nuova_versione(), None)
+        versione = cache.get(VERSIONE_KEY)
+    return versione
+
+
+def invalida_catalogo():
+    cache.set(VERSIONE_KEY, _nuova_versione(), None)
+
+
+def _conta(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Il contatore non esiste ancora (o e' stato espulso)
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def _leggi(key, costruisci):
+    valore = cache.get(key)
+    if valore is not None:
+        _conta(HIT_KEY)
+        return valore
+    _conta(MISS_KEY)
+    valore = costruisci()
+    cache.set(key, valore, SNAPSHOT_TIMEOUT)
+    return valore
+
+
+def prodotti_catalogo(versione=None):
+    """Restituisce lo snapshot (tupla) dei prodotti per la versione corrente."""
+    versione = versione or versione_catalogo()
+    return _leggi(
+        PRODOTTI_KEY.format(versione=versione),
+        lambda: tuple(Product.objects.order_by('id')),
+    )
+
+
+def griglia_catalogo():
+    """Restituisce il frammento HTML della griglia prodotti gia' renderizzato."""
+    versione = versione_catalogo()
+    return _leggi(
+        GRIGLIA_KEY.format(versione=versione),
+        lambda: render_to_string('prodotti_griglia.html', {
+            'products': prodotti_catalogo(versione),
+        }),
+    )
+
+
+def scalda_catalogo():
+    """Popola la cache con snapshot e frammento della versione corrente."""
+    versione = versione_catalogo()
+    prodotti = prodotti_catalogo(versione)
+    griglia_catalogo()
+    return versione, len(prodotti)
+
+
+def statistiche_catalogo():
+    hit = cache.get(HIT_KEY) or 0
+    miss = cache.get(MISS_KEY) or 0
+    return {
+        'versione': cache.get(VERSIONE_KEY),
+        'hit': hit,
+        'miss': miss,
+        'hit_ratio': hit / (hit + miss) if hit + miss else 0.0,
+    }
@@ -0,0 +1,267 @@
+import hashlib
+import json
+import logging
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Case, Count, F, Min, PositiveIntegerField, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .carrello import con_riprova, ricalcola_totale
+from .models import Cart, CartItem, FastFood, Product, QueuedOrder
+from .ordini import crea_ordine
+from .prezzi import PrezzoCarrello, prezzo_carrello
+
+logger = logging.getLogger('gestione.coda')
+
+DIMENSIONE_BLOCCO = 20  # Comandi prelevati da un worker per transazione
+
+
+class ComandoNonValido(Exception):
+    """Errore che un nuovo tentativo non puo' risolvere: il comando viene scartato subito."""
+
+
+class LavorazionePersa(Exception):
+    """La lavorazione e' scaduta e il comando e' stato ripreso da un altro worker."""
+
+
+# Checkout ---------------------------------------------------------------
+
+def accoda_ordine(user, tipo_di_ordine, fast_food=None, delivery_address=None, delivery_city=None):
+    """
+    Fotografa il carrello dell'utente (righe, prezzi, coupon) e lo accoda
+    come comando d'ordine con un solo INSERT. Lo stesso carrello inviato
+    due volte mentre il primo comando e' in sospeso non viene riaccodato.
+    Restituisce (comando, nuovo); solleva ValueError se il carrello e' vuoto.
+    """
+    cart = Cart.objects.select_related('coupon').get(user=user)
+    prezzo = prezzo_carrello(cart)
+    if prezzo.vuoto:
+        raise ValueError("Il carrello è vuoto.")
+    comando = {
+        'righe': [
+            {
+                'item_id': item.id,
+                'product_id': item.product_id,
+                'nome': item.product.name,
+                'quantita': item.quantity,
+                'prezzo': str(item.product.price),
+            }
+            for item in prezzo.items
+        ],
+        'coupon_id': prezzo.coupon.id if prezzo.coupon else None,
+        'totale': str(prezzo.totale),
+        'campi': {
+            'tipo_di_ordine': tipo_di_ordine,
+            'fast_food_id': fast_food.id if fast_food else None,
+            'delivery_address': delivery_address,
+            'delivery_city': delivery_city,
+        },
+    }
+    chiave = hashlib.sha256(json.dumps([cart.id, comando], sort_keys=True).encode()).hexdigest()
+
+    def inserisci():
+        try:
+            with transaction.atomic():
+                return QueuedOrder.objects.create(
+                    user=user, cart=cart, comando=comando, chiave=chiave, disponibile_dal=timezone.now(),
+                ), True
+        except IntegrityError:
+            # Doppio invio: il comando e' gia' in coda
+            return QueuedOrder.objects.get(user=user, chiave=chiave, stato__in=QueuedOrder.IN_SOSPESO), False
+
+    return con_riprova(inserisci)
+
+
+def in_sospeso(user):
+    """Numero di ordini dell'utente accodati ma non ancora creati."""
+    return QueuedOrder.objects.filter(user=user, stato__in=QueuedOrder.IN_SOSPESO).count()
+
+
+def scartati(user, limite=5):
+    """
+    Checkout dell'utente scartati negli ultimi CODA_ORDINI_SCARTATI_GIORNI
+    giorni, con articoli, totale e motivo da mostrargli: l'ordine non e'
+    stato creato e il cliente deve saperlo.
+    """
+    dal = timezone.now() - timedelta(days=settings.CODA_ORDINI_SCARTATI_GIORNI)
+    comandi = (
+        QueuedOrder.objects.filter(user=user, stato=QueuedOrder.SCARTATO, updated_at__gte=dal)
+        .order_by('-updated_at')[:limite]
+    )
+    return [
+        {
+            'created_at': comando.created_at,
+            'items': ', '.join(f"{riga['quantita']}x {riga['nome']}" for riga in comando.comando['righe']),
+            'totale': Decimal(comando.comando['totale']),
+            'motivo': _motivo(comando.errore),
+        }
+        for comando in comandi
+    ]
+
+
+def _motivo(errore):
+    # Gli errori di ComandoNonValido sono scritti per il cliente, gli altri no
+    prefisso = f"{ComandoNonValido.__name__}: "
+    if errore.startswith(prefisso):
+        return errore[len(prefisso):]
+    return "Non è stato possibile completare l'ordine, riprova."
+
+
+# Worker -----------------------------------------------------------------
+
+def preleva(limite=DIMENSIONE_BLOCCO):
+    """
+    Prende in lavorazione fino a limite comandi pronti, nell'ordine di
+    arrivo. Le lavorazioni ferme da oltre CODA_ORDINI_LAVORAZIONE_MAX
+    secondi (worker interrotto) tornano prima in coda.
+    """
+    adesso = timezone.now()
+    with transaction.atomic():
+        QueuedOrder.objects.filter(
+            stato=QueuedOrder.IN_LAVORAZIONE,
+            preso_il__lt=adesso - timedelta(seconds=settings.CODA_ORDINI_LAVORAZIONE_MAX),
+        ).update(stato=QueuedOrder.IN_CODA, disponibile_dal=adesso, updated_at=adesso)
+        pronti = QueuedOrder.objects.filter(stato=QueuedOrder.IN_CODA, disponibile_dal__lte=adesso)
+        if connection.features.has_select_for_update_skip_locked:
+            # PostgreSQL: worker concorrenti prendono comandi diversi senza attendersi
+            pronti = pronti.select_for_update(skip_locked=True)
+        ids = list(pronti.order_by('disponibile_dal', 'id').values_list('id', flat=True)[:limite])
+        if not ids:
+            return []
+        QueuedOrder.objects.filter(id__in=ids, stato=QueuedOrder.IN_CODA).update(
+            stato=QueuedOrder.IN_LAVORAZIONE, preso_il=adesso, tentativi=F('tentativi') + 1, updated_at=adesso,
+        )
+    return list(
+        QueuedOrder.objects.filter(id__in=ids, stato=QueuedOrder.IN_LAVORAZIONE, preso_il=adesso)
+        .select_related('user').order_by('id')
+    )
+
+
+def _prezzo_da_comando(comando):
+    righe = comando['righe']
+    esistenti = set(Product.objects.filter(id__in=[riga['product_id'] for riga in righe]).values_list('id', flat=True))
+    mancanti = [riga['nome'] for riga in righe if riga['product_id'] not in esistenti]
+    if mancanti:
+        raise ComandoNonValido(f"Prodotti non più disponibili: {', '.join(mancanti)}")
+    # Prezzi e nomi sono quelli visti dal cliente al checkout
+    items = [
+        CartItem(
+            product=Product(id=riga['product_id'], name=riga['nome'], price=Decimal(riga['prezzo'])),
+            quantity=riga['quantita'],
+        )
+        for riga in righe
+    ]
+    return PrezzoCarrello(items=items, totale=Decimal(comando['totale']))
+
+
+def _svuota_carrello(cart_id, comando):
+    """
+    Toglie dal carrello solo quanto e' stato ordinato: gli articoli aggiunti
+    dopo il checkout restano. Il coupon viene tolto se e' ancora quello usato.
+    """
+    righe = comando['righe']
+    CartItem.objects.filter(cart_id=cart_id, id__in=[riga['item_id'] for riga in righe]).update(quantity=Case(
+        *[
+            When(id=riga['item_id'], then=Greatest(F('quantity') - riga['quantita'], Value(0), output_field=PositiveIntegerField()))
+            for riga in righe
+        ],
+        default=F('quantity'),
+        output_field=PositiveIntegerField(),
+    ))
+    CartItem.objects.filter(cart_id=cart_id, quantity=0).delete()
+    if comando['coupon_id']:
+        Cart.objects.filter(id=cart_id, coupon_id=comando['coupon_id']).update(coupon=None)
+    ricalcola_totale(cart_id)
+
+
+def elabora(comando):
+    """
+    Crea l'ordine del comando e svuota il carrello nella stessa transazione
+    in cui il comando viene segnato come completato: se il worker si ferma
+    a meta' non resta ne' un ordine senza comando ne' un comando senza ordine.
+    """
+    campi = dict(comando.comando['campi'])
+    fast_food_id = campi.pop('fast_food_id')
+    if fast_food_id is not None and not FastFood.objects.filter(id=fast_food_id).exists():
+        raise ComandoNonValido("Il fast food scelto non esiste più.")
+    prezzo = _prezzo_da_comando(comando.comando)
+    with transaction.atomic():
+        order = crea_ordine(comando.user, prezzo, fast_food_id=fast_food_id, **campi)
+        if comando.cart_id:
+            _svuota_carrello(comando.cart_id, comando.comando)
+        completati = QueuedOrder.objects.filter(
+            id=comando.id, stato=QueuedOrder.IN_LAVORAZIONE, preso_il=comando.preso_il,
+        ).update(stato=QueuedOrder.COMPLETATO, order=order, errore='', updated_at=timezone.now())
+        if not completati:
+            # Lavorazione scaduta e ripresa da un altro worker: annulla tutto
+            raise LavorazionePersa(comando.id)
+    return order
+
+
+def _fallito(comando, errore):
+    definitivo = isinstance(errore, ComandoNonValido) or comando.tentativi >= settings.CODA_ORDINI_TENTATIVI
+    adesso = timezone.now()
+    aggiornamento = {'errore': f"{type(errore).__name__}: {errore}", 'updated_at': adesso}
+    if definitivo:
+        aggiornamento['stato'] = QueuedOrder.SCARTATO
+        logger.error("Comando %s scartato dopo %s tentativi: %s", comando.id, comando.tentativi, errore)
+    else:
+        aggiornamento['stato'] = QueuedOrder.IN_CODA
+        aggiornamento['disponibile_dal'] = adesso + timedelta(
+            seconds=settings.CODA_ORDINI_ATTESA * 2 ** (comando.tentativi - 1)
+        )
+        logger.warning("Comando %s fallito (tentativo %s), riprovo: %s", comando.id, comando.tentativi, errore)
+    QueuedOrder.objects.filter(id=comando.id, stato=QueuedOrder.IN_LAVORAZIONE, preso_il=comando.preso_il).update(
+        **aggiornamento
+    )
+    return definitivo
+
+
+def elabora_coda(limite=DIMENSIONE_BLOCCO, blocchi=None):
+    """
+    Preleva ed elabora blocchi di comandi finche' la coda ha comandi pronti
+    (o per al massimo blocchi blocchi). Restituisce i conteggi del giro.
+    """
+    risultato = {'completati': 0, 'ritentati': 0, 'scartati': 0}
+    while blocchi is None or blocchi > 0:
+        comandi = con_riprova(lambda: preleva(limite))
+        if not comandi:
+            break
+        for comando in comandi:
+            try:
+                con_riprova(lambda: elabora(comando))
+            except LavorazionePersa:
+                continue
+            except Exception as errore:
+                risultato['scartati' if _fallito(comando, errore) else 'ritentati'] += 1
+            else:
+                risultato['completati'] += 1
+        if blocchi is not None:
+            blocchi -= 1
+    return risultato
+
+
+# Metriche ---------------------------------------------------------------
+
+def profondita():
+    """
+    Comandi per stato (esclusi i completati), eta' del comando piu' vecchio
+    in attesa e numero di comandi scartati da controllare.
+    """
+    righe = (
+        QueuedOrder.objects.exclude(stato=QueuedOrder.COMPLETATO)
+        .values('stato').annotate(n=Count('id'), piu_vecchio=Min('created_at')).order_by()
+    )
+    stati = {riga['stato']: riga for riga in righe}
+    conteggio = lambda stato: stati[stato]['n'] if stato in stati else 0
+    in_coda = stati.get(QueuedOrder.IN_CODA)
+    return {
+        'in_coda': conteggio(QueuedOrder.IN_CODA),
+        'in_lavorazione': conteggio(QueuedOrder.IN_LAVORAZIONE),
+        'scartati': conteggio(QueuedOrder.SCARTATO),
+        'attesa_max_s': round((timezone.now() - in_coda['piu_vecchio']).total_seconds(), 1) if in_coda else 0.0,
+    }
@@ -0,0 +1,28 @@
+import os
+from functools import lru_cache
+
+from django.conf import settings
+
+
+@lru_cache(maxsize=None)
+def versione_template():
+    """
+    Versione dei template (ultima modifica dei file in TEMPLATES DIRS):
+    entra nelle chiavi dei frammenti in cache, cosi' dopo un deploy non
+    si servono frammenti renderizzati con i template vecchi.
+    """
+    ultima = 0
+    for configurazione in settings.TEMPLATES:
+        for cartella in configurazione.get('DIRS', []):
+            for radice, _, nomi in os.walk(cartella):
+                for nome in nomi:
+                    ultima = max(ultima, os.stat(os.path.join(radice, nome)).st_mtime_ns)
+    return str(ultima)
+
+
+def frammenti(request):
+    """Parametri di {% cache %} per i frammenti statici di base.html e map.html."""
+    return {
+        'frammenti_timeout': settings.FRAMMENTI_CACHE_TIMEOUT,
+        'frammenti_versione': versione_template(),
+    }
@@ -0,0 +1,144 @@
+import random
+import string
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q, Subquery
+from django.utils import timezone
+
+from .carrello import con_riprova
+from .models import Cart, Coupon
+
+CARATTERI_CODICE = string.ascii_uppercase + string.digits
+LUNGHEZZA_CODICE = 10
+SCONTO_MIN = 5
+SCONTO_MAX = 12
+
+# Dimensione dei blocchi di codici controllati e inseriti insieme (resta
+# sotto il limite di parametri per query di SQLite)
+BATCH_SIZE = 500
+TENTATIVI_INSERIMENTO = 3
+
+_random = random.SystemRandom()
+
+
+def genera_codice():
+    return ''.join(_random.choices(CARATTERI_CODICE, k=LUNGHEZZA_CODICE))
+
+
+def codici_unici(quanti):
+    """Genera codici non presenti nel database, con una query per blocco di BATCH_SIZE candidati."""
+    codici = set()
+    while len(codici) < quanti:
+        candidati = list({genera_codice() for _ in range(quanti - len(codici))} - codici)
+        for inizio in range(0, len(candidati), BATCH_SIZE):
+            blocco = candidati[inizio:inizio + BATCH_SIZE]
+            esistenti = set(
+                Coupon.objects.filter(code__in=blocco).values_list('code', flat=True)
+            )
+            codici.update(codice for codice in blocco if codice not in esistenti)
+    return list(codici)
+
+
+def scadenza(validita_giorni=None):
+    """Scadenza dei coupon creati ora; None (non scadono) se la validita' non e' indicata."""
+    return timezone.now() + timedelta(days=validita_giorni) if validita_giorni else None
+
+
+def _inserisci(user_ids, per_utente, sconto_min, sconto_max, descrizione, validita_giorni):
+    codici = iter(codici_unici(len(user_ids) * per_utente))
+    expires_at = scadenza(validita_giorni)
+    coupons = []
+    for user_id in user_ids:
+        for _ in range(per_utente):
+            discount = _random.randint(sconto_min, sconto_max)
+            coupons.append(Coupon(
+                user_id=user_id,
+                code=next(codici),
+                discount=discount,
+                description=descrizione or f"Coupon con {discount}% di sconto",
+                is_active=True,
+                expires_at=expires_at,
+            ))
+    Coupon.objects.bulk_create(coupons, batch_size=BATCH_SIZE)
+    return len(coupons)
+
+
+def conia_coupon(user_ids, per_utente=1, sconto_min=SCONTO_MIN, sconto_max=SCONTO_MAX, descrizione=None,
+                 validita_giorni=None):
+    """
+    Crea per_utente coupon per ogni utente con un bulk_create, validi per
+    validita_giorni giorni (None: non scadono, come quelli di benvenuto).
+    I codici sono controllati prima dell'inserimento; se un altro processo
+    inserisce lo stesso codice nel frattempo il blocco viene rigenerato.
+    Restituisce il numero di coupon creati.
+    """
+    user_ids = list(user_ids)
+    if not user_ids or per_utente < 1:
+        return 0
+    for tentativo in range(TENTATIVI_INSERIMENTO):
+        try:
+            with transaction.atomic():
+                return _inserisci(user_ids, per_utente, sconto_min, sconto_max, descrizione, validita_giorni)
+        except IntegrityError:
+            if tentativo == TENTATIVI_INSERIMENTO - 1:
+                raise
+
+
+def _non_scaduto(adesso):
+    return Q(expires_at__isnull=True) | Q(expires_at__gt=adesso)
+
+
+def coupon_validi(user):
+    """Coupon dell'utente ancora utilizzabili: attivi e non scaduti."""
+    return Coupon.objects.filter(_non_scaduto(timezone.now()), user=user, is_active=True)
+
+
+def riscatta_coupon(user, cart_id, codice):
+    """
+    Applica il coupon al carrello: un UPDATE condizionato lo disattiva solo
+    se e' ancora attivo, non scaduto e dell'utente, poi il carrello lo
+    riceve, nella stessa transazione. Due richieste concorrenti con lo
+    stesso codice non possono riuscire entrambe.
+    Il coupon riscattato scade subito: anche quelli senza scadenza vengono
+    eliminati da sweep_coupons quando nessun carrello li usa piu'.
+    Restituisce True se il coupon e' stato applicato.
+    """
+    def riscatta():
+        adesso = timezone.now()
+        riscattati = Coupon.objects.filter(
+            _non_scaduto(adesso), code=codice, user=user, is_active=True,
+        ).update(is_active=False, expires_at=adesso)
+        if riscattati:
+            Cart.objects.filter(id=cart_id).update(
+                coupon=Subquery(Coupon.objects.filter(code=codice).values('id')[:1])
+            )
+        return bool(riscattati)
+
+    return con_riprova(riscatta)
+
+
+def disattiva_scaduti(dimensione):
+    """Disattiva un blocco di coupon scaduti; restituisce quanti."""
+    adesso = timezone.now()
+    ids = list(
+        Coupon.objects.filter(is_active=True, expires_at__lt=adesso).values_list('id', flat=True)[:dimensione]
+    )
+    if not ids:
+        return 0
+    return Coupon.objects.filter(id__in=ids, is_active=True).update(is_active=False)
+
+
+def elimina_scaduti(prima_del, dimensione):
+    """
+    Elimina un blocco di coupon scaduti prima di prima_del. Quelli ancora
+    applicati a un carrello restano, per non togliere lo sconto.
+    """
+    ids = list(
+        Coupon.objects.filter(expires_at__lt=prima_del, is_active=False, cart__isnull=True)
+        .values_list('id', flat=True)[:dimensione]
+    )
+    if not ids:
+        return 0
+    with transaction.atomic():
+        return Coupon.objects.filter(id__in=ids).delete()[1].get('gestione.Coupon', 0)
@@ -0,0 +1,14 @@
+from django.conf import settings
+
+
+def configura_sqlite(sender, connection, **kwargs):
+    """
+    Applica SQLITE_PRAGMAS a ogni nuova connessione SQLite: WAL (i lettori
+    non bloccano lo scrittore e viceversa), fsync solo ai checkpoint, mmap
+    e cache. L'attesa sui lock arriva da OPTIONS['timeout'].
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for nome, valore in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f'PRAGMA {nome} = {valore}')
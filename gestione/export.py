@@ -0,0 +1,109 @@
+import csv
+import heapq
+import json
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+
+from .models import ArchivedOrder, Order
+
+COLONNE = (
+    'id', 'created_at', 'user', 'fast_food', 'tipo_di_ordine', 'status',
+    'total_price', 'items', 'delivery_address', 'delivery_city',
+)
+CAMPI = (
+    'id', 'created_at', 'user__username', 'fast_food__name', 'tipo_di_ordine', 'status',
+    'total_price', 'items', 'delivery_address', 'delivery_city',
+)
+CHUNK_SIZE = 2000
+FORMATI = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def intervallo_date(dal=None, al=None):
+    """Converte due date locali (estremi inclusi) in istanti aware [inizio, fine)."""
+    inizio = timezone.make_aware(datetime.combine(dal, time.min)) if dal else None
+    fine = timezone.make_aware(datetime.combine(al + timedelta(days=1), time.min)) if al else None
+    return inizio, fine
+
+
+def ordini_da_esportare(fast_food_id=None, user=None, dal=None, al=None):
+    """
+    Righe da esportare dagli ordini attivi e da quelli archiviati: una
+    query per tabella, unite in ordine di creazione da esporta().
+    """
+    querysets = []
+    for modello in (Order, ArchivedOrder):
+        ordini = modello.objects.all()
+        if fast_food_id:
+            ordini = ordini.filter(fast_food_id=fast_food_id)
+        if user is not None:
+            ordini = ordini.filter(user=user)
+        inizio, fine = intervallo_date(dal, al)
+        if inizio:
+            ordini = ordini.filter(created_at__gte=inizio)
+        if fine:
+            ordini = ordini.filter(created_at__lt=fine)
+        querysets.append(ordini.order_by('created_at', 'id').values_list(*CAMPI))
+    return querysets
+
+
+class ConvertitoreFuso:
+    """
+    Converte istanti UTC nel fuso locale calcolando l'offset una sola volta
+    per ogni ora UTC: i cambi d'ora legale cadono sempre allo scoccare
+    dell'ora, quindi l'offset e' costante all'interno dell'ora.
+    """
+
+    def __init__(self, tz=None):
+        self.tz = tz or timezone.get_current_timezone()
+        self._offset = {}
+
+    def __call__(self, istante):
+        ora = istante.replace(minute=0, second=0, microsecond=0)
+        offset = self._offset.get(ora)
+        if offset is None:
+            offset = self._offset[ora] = ora.astimezone(self.tz).utcoffset()
+        locale = (istante + offset).replace(tzinfo=None)
+        minuti = int(offset.total_seconds()) // 60
+        segno = '+' if minuti >= 0 else '-'
+        return f"{locale.isoformat()}{segno}{abs(minuti) // 60:02d}:{abs(minuti) % 60:02d}"
+
+
+def _righe(ordini):
+    converti = ConvertitoreFuso()
+    # Le tabelle sono lette in streaming e unite per (created_at, id)
+    unite = heapq.merge(
+        *(queryset.iterator(chunk_size=CHUNK_SIZE) for queryset in ordini),
+        key=lambda riga: (riga[1], riga[0]),
+    )
+    for riga in unite:
+        riga = list(riga)
+        riga[1] = converti(riga[1])
+        riga[6] = str(riga[6])
+        yield riga
+
+
+class _Eco:
+    """Buffer fittizio: csv.writer scrive una riga e la restituisce."""
+
+    def write(self, valore):
+        return valore
+
+
+def esporta_csv(ordini):
+    writer = csv.writer(_Eco())
+    yield writer.writerow(COLONNE)
+    for riga in _righe(ordini):
+        yield writer.writerow(riga)
+
+
+def esporta_ndjson(ordini):
+    for riga in _righe(ordini):
+        yield json.dumps(dict(zip(COLONNE, riga))) + '\n'
+
+
+def esporta(ordini, formato):
+    return esporta_csv(ordini) if formato == 'csv' else esporta_ndjson(ordini)
@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import Q
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import Order
+from .paginazione import codifica_cursore, decodifica_cursore
+
+# Numero massimo di ordini inviati in un singolo delta
+LIMITE_DELTA = 100
+
+
+def _assestati(ordini):
+    # Un ordine salvato poco fa puo' avere accanto una scrittura concorrente
+    # con updated_at precedente non ancora committata: il feed lo invia solo
+    # dopo FEED_ORDINI_ASSESTAMENTO secondi, cosi' il cursore non la scavalca
+    limite = timezone.now() - timedelta(seconds=settings.FEED_ORDINI_ASSESTAMENTO)
+    return ordini.filter(updated_at__lte=limite)
+
+
+def cursore_iniziale(fast_food_id):
+    # Gli ordini piu' recenti della pagina arrivano di nuovo dal feed: sostituire una riga e' innocuo
+    ultimo = (
+        _assestati(Order.objects.filter(fast_food_id=fast_food_id))
+        .order_by('-updated_at', '-id')
+        .values_list('updated_at', 'id')
+        .first()
+    )
+    if ultimo is None:
+        return codifica_cursore(datetime.now(dt_timezone.utc), 0)
+    return codifica_cursore(*ultimo)
+
+
+def ordini_modificati(fast_food_id, cursore, limite=LIMITE_DELTA):
+    """
+    Ordini del fast food creati o modificati dopo il cursore, in ordine di
+    modifica, e il nuovo cursore da usare per la richiesta successiva.
+    Vede solo le modifiche che aggiornano updated_at (vedi Order.updated_at).
+    """
+    ordini = _assestati(Order.objects.filter(fast_food_id=fast_food_id))
+    posizione = decodifica_cursore(cursore)
+    if posizione is not None:
+        updated_at, order_id = posizione
+        ordini = ordini.filter(
+            Q(updated_at__gte=updated_at),
+            Q(updated_at__gt=updated_at) | Q(id__gt=order_id),
+        )
+    ordini = list(ordini.order_by('updated_at', 'id')[:limite])
+    if ordini:
+        cursore = codifica_cursore(ordini[-1].updated_at, ordini[-1].id)
+    return ordini, cursore
+
+
+def delta_ordini(ordini, request=None):
+    """Righe HTML gia' renderizzate, pronte per essere sostituite nella pagina."""
+    return [
+        {
+            'id': order.id,
+            'tipo': order.tipo_di_ordine,
+            'html': render_to_string('gestione_ordine_riga.html', {'order': order}, request=request),
+        }
+        for order in ordini
+    ]
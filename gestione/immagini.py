@@ -0,0 +1,201 @@
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.cache import cache
+from django.urls import reverse
+
+from .catalogo import invalida_catalogo
+
+try:
+    from PIL import Image
+except ImportError:  # Dipendenza opzionale: senza Pillow si usa l'immagine originale
+    Image = None
+
+FORMATI = {
+    'webp': 'image/webp',
+    'png': 'image/png',
+}
+LUNGHEZZA_DIGEST = 16
+TOCCO_LRU = 600  # Secondi: un hit aggiorna l'mtime al massimo ogni 10 minuti
+DIGEST_KEY = 'immagini:digest:{percorso}'
+
+_digest = {}
+_lock_pulizia = threading.Lock()
+_ultima_pulizia = 0.0
+
+
+def disponibile():
+    return Image is not None
+
+
+def sorgente(product):
+    """Percorso assoluto dell'immagine originale del prodotto, o None."""
+    if not product.image_name:
+        return None
+    return finders.find(product.image_name)
+
+
+def digest_sorgente(percorso):
+    """
+    Hash del contenuto dell'immagine originale: fa parte del nome delle
+    varianti, che cambiano da sole quando cambia l'immagine (o image_name).
+    Ricalcolato solo se il file cambia.
+    """
+    stat = os.stat(percorso)
+    chiave = (percorso, stat.st_mtime_ns, stat.st_size)
+    digest = _digest.get(chiave)
+    if digest is None:
+        with open(percorso, 'rb') as file:
+            digest = hashlib.sha256(file.read()).hexdigest()[:LUNGHEZZA_DIGEST]
+        _digest[chiave] = digest
+        _controlla_cambio(percorso, digest)
+    return digest
+
+
+def _controlla_cambio(percorso, digest):
+    # L'ultimo digest visto e' in cache, condiviso tra i processi: se il file
+    # e' cambiato la griglia del catalogo in cache ha URL con il digest vecchio
+    chiave = DIGEST_KEY.format(percorso=hashlib.sha1(percorso.encode()).hexdigest())
+    precedente = cache.get(chiave)
+    if precedente != digest:
+        cache.set(chiave, digest, None)
+        if precedente is not None:
+            invalida_catalogo()
+
+
+def _percorso_variante(digest, larghezza, formato):
+    # Due livelli di cartelle per non avere migliaia di file in una directory
+    return os.path.join(settings.IMMAGINI_CACHE_DIR, digest[:2], f'{digest}-{larghezza}.{formato}')
+
+
+def _genera(percorso_sorgente, larghezza, formato):
+    with Image.open(percorso_sorgente) as immagine:
+        tavolozza = immagine.mode == 'P'
+        immagine = immagine.convert('RGBA' if immagine.mode in ('P', 'LA', 'RGBA') or 'transparency' in immagine.info else 'RGB')
+        if immagine.width > larghezza:
+            altezza = round(immagine.height * larghezza / immagine.width)
+            immagine = immagine.resize((larghezza, altezza), Image.LANCZOS)
+        buffer = io.BytesIO()
+        if formato == 'webp':
+            immagine.save(buffer, 'WEBP', quality=settings.IMMAGINI_QUALITA_WEBP)
+        else:
+            if tavolozza:
+                # Un originale a tavolozza resta a tavolozza: PNG molto piu' piccolo
+                immagine = immagine.quantize(256, method=Image.Quantize.FASTOCTREE)
+            immagine.save(buffer, 'PNG', optimize=True)
+        return buffer.getvalue()
+
+
+def variante(product, larghezza, formato, digest=None):
+    """
+    Percorso su disco della variante richiesta, generata al primo accesso.
+    Restituisce None se il prodotto non ha immagine, se la larghezza o il
+    formato non sono previsti o se digest non e' quello dell'immagine attuale.
+    """
+    if larghezza not in settings.IMMAGINI_LARGHEZZE or formato not in FORMATI or not disponibile():
+        return None
+    percorso_sorgente = sorgente(product)
+    if percorso_sorgente is None:
+        return None
+    attuale = digest_sorgente(percorso_sorgente)
+    if digest is not None and digest != attuale:
+        return None
+
+    percorso = _percorso_variante(attuale, larghezza, formato)
+    try:
+        if time.time() - os.path.getmtime(percorso) > TOCCO_LRU:
+            os.utime(percorso)  # Usata di recente: l'LRU la tiene
+        return percorso
+    except FileNotFoundError:
+        pass
+
+    contenuto = _genera(percorso_sorgente, larghezza, formato)
+    os.makedirs(os.path.dirname(percorso), exist_ok=True)
+    # Scrittura atomica: una richiesta concorrente non legge mai un file a meta'
+    fd, temporaneo = tempfile.mkstemp(dir=os.path.dirname(percorso), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as file:
+        file.write(contenuto)
+    os.replace(temporaneo, percorso)
+    pulizia_periodica()
+    return percorso
+
+
+def genera_varianti(product):
+    """Genera tutte le varianti del prodotto (al salvataggio o al deploy)."""
+    return [
+        percorso
+        for larghezza in settings.IMMAGINI_LARGHEZZE
+        for formato in FORMATI
+        if (percorso := variante(product, larghezza, formato)) is not None
+    ]
+
+
+def pulizia_periodica():
+    """
+    Applica il limite della cache al massimo ogni IMMAGINI_PULIZIA_INTERVALLO
+    secondi per processo: la scansione della cartella non pesa su ogni
+    variante generata durante una richiesta.
+    """
+    if time.monotonic() - _ultima_pulizia < settings.IMMAGINI_PULIZIA_INTERVALLO:
+        return 0
+    return pulisci_cache()
+
+
+def pulisci_cache(limite=None):
+    """
+    Mantiene la cache sotto IMMAGINI_CACHE_MAX_BYTES eliminando le varianti
+    usate meno di recente (mtime piu' vecchio) fino al 90% del limite.
+    Restituisce il numero di file eliminati.
+    """
+    global _ultima_pulizia
+    limite = settings.IMMAGINI_CACHE_MAX_BYTES if limite is None else limite
+    with _lock_pulizia:
+        _ultima_pulizia = time.monotonic()
+        file = []
+        for cartella, _, nomi in os.walk(settings.IMMAGINI_CACHE_DIR):
+            for nome in nomi:
+                if nome.endswith('.tmp'):
+                    continue  # Variante in scrittura
+                percorso = os.path.join(cartella, nome)
+                try:
+                    stat = os.stat(percorso)
+                except FileNotFoundError:
+                    continue
+                file.append((stat.st_mtime, stat.st_size, percorso))
+        totale = sum(dimensione for _, dimensione, _ in file)
+        if totale <= limite:
+            return 0
+        eliminati = 0
+        for _, dimensione, percorso in sorted(file):
+            if totale <= limite * 0.9:
+                break
+            try:
+                os.remove(percorso)
+            except FileNotFoundError:
+                pass
+            totale -= dimensione
+            eliminati += 1
+        return eliminati
+
+
+def url_variante(product, larghezza, formato):
+    percorso_sorgente = sorgente(product)
+    return reverse('immagine_prodotto', kwargs={
+        'product_id': product.id,
+        'digest': digest_sorgente(percorso_sorgente),
+        'larghezza': larghezza,
+        'formato': formato,
+    })
+
+
+def srcset(product, formato):
+    return ', '.join(
+        f'{url_variante(product, larghezza, formato)} {larghezza}w'
+        for larghezza in settings.IMMAGINI_LARGHEZZE
+    )
@@ -0,0 +1,41 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from gestione.archivio import archivia_blocco, da_archiviare, limite_archiviazione
+
+
+class Command(BaseCommand):
+    help = (
+        "Sposta in ArchivedOrder gli ordini consegnati piu' vecchi di --days giorni, a blocchi "
+        "in transazioni brevi. Si puo' interrompere e rilanciare: riparte dagli ordini rimasti."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.ARCHIVIO_ORDINI_GIORNI, help="Eta' minima degli ordini archiviati.")
+        parser.add_argument('--batch-size', type=int, default=500, help="Ordini archiviati per transazione.")
+        parser.add_argument('--pause', type=float, default=0.05, help="Secondi di pausa tra due blocchi.")
+        parser.add_argument('--max-batches', type=int, default=None, help="Ferma l'archiviazione dopo questi blocchi.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1 or batch_size > 5000:
+            # Resta sotto il limite di parametri per query di SQLite
+            raise CommandError("--batch-size deve essere compreso tra 1 e 5000.")
+        if options['days'] < 0:
+            raise CommandError("--days non puo' essere negativo.")
+
+        prima_del = limite_archiviazione(options['days'])
+        archiviati = blocchi = 0
+        while options['max_batches'] is None or blocchi < options['max_batches']:
+            spostati = archivia_blocco(prima_del, batch_size)
+            archiviati += spostati
+            blocchi += 1
+            if spostati < batch_size:
+                break
+            time.sleep(options['pause'])
+        rimasti = da_archiviare(prima_del).count()
+        self.stdout.write(self.style.SUCCESS(
+            f"Archiviati {archiviati} ordini in {blocchi} blocchi; da archiviare: {rimasti}."
+        ))
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from gestione.benchmark import conta_query, database_di_prova, riepilogo
+
+
+class Command(BaseCommand):
+    help = "Misura tempo CPU e query per registrazione (su un database di test)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--signups', type=int, default=20, help="Numero di registrazioni da misurare.")
+
+    def handle(self, *args, **options):
+        cpu, query = [], []
+        with database_di_prova():
+            for i in range(options['signups']):
+                client = Client()
+                with CaptureQueriesContext(connection) as ctx:
+                    inizio = time.process_time()
+                    client.post('/register/', {'username': f'bench{i}', 'password': 'Bench-pass-123'})
+                    cpu.append((time.process_time() - inizio) * 1000)
+                query.append(conta_query(ctx.captured_queries))
+
+        stats = riepilogo(cpu)
+        self.stdout.write(
+            f"{options['signups']} registrazioni: CPU p50={stats['p50']:.1f}ms "
+            f"p95={stats['p95']:.1f}ms media={stats['media']:.1f}ms, "
+            f"query per registrazione={max(query)}"
+        )
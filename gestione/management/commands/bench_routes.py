@@ -0,0 +1,82 @@
+import json
+import os
+import tempfile
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gestione.benchmark import (
+    ROTTE, ContestoClient, confronta, database_di_prova, misura_rotta, popola_dati, rotte_non_coperte,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Misura latenza (p50/p95/p99), throughput e query per richiesta di ogni rotta "
+        "con client simulati concorrenti, su un database di test popolato."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=4, help="Client simulati in parallelo.")
+        parser.add_argument('--requests', type=int, default=10, help="Richieste per client e per rotta.")
+        parser.add_argument('--orders', type=int, default=200, help="Ordini nello storico di ogni cliente.")
+        parser.add_argument('--routes', nargs='+', default=None, help="Misura solo le rotte indicate (nomi di urls.py).")
+        parser.add_argument('--output', default=None, help="Salva i risultati come baseline JSON.")
+        parser.add_argument('--compare', default=None, help="Baseline JSON con cui confrontare i risultati.")
+        parser.add_argument('--threshold', type=float, default=20.0, help="Peggioramento del p95 tollerato (%%).")
+        parser.add_argument('--threshold-ms', type=float, default=1.0, help="Peggioramento del p95 sempre tollerato (ms).")
+
+    def handle(self, *args, **options):
+        if options['clients'] < 1 or options['requests'] < 1:
+            raise CommandError("--clients e --requests devono essere positivi.")
+        rotte = ROTTE
+        if options['routes']:
+            sconosciute = set(options['routes']) - {rotta.nome for rotta in ROTTE}
+            if sconosciute:
+                raise CommandError(f"Rotte senza scenario: {', '.join(sorted(sconosciute))}")
+            rotte = [rotta for rotta in ROTTE if rotta.nome in options['routes']]
+        base = self._carica(options['compare']) if options['compare'] else None
+
+        mancanti = rotte_non_coperte()
+        if mancanti:
+            self.stderr.write(self.style.WARNING(f"Rotte non misurate (manca lo scenario): {', '.join(mancanti)}"))
+
+        risultati = {}
+        # Database su file: i thread dei client usano ciascuno la propria connessione
+        with tempfile.TemporaryDirectory() as cartella:
+            with database_di_prova(os.path.join(cartella, 'bench_routes.sqlite3')):
+                dati = popola_dati(options['clients'], options['orders'])
+                contesti = [ContestoClient(i, dati) for i in range(options['clients'])]
+                for rotta in rotte:
+                    misura_rotta(rotta, contesti[:1], 1)  # Riscaldamento (cache, template)
+                    risultati[rotta.nome] = misura = misura_rotta(rotta, contesti, options['requests'])
+                    self.stdout.write(
+                        f"{rotta.nome:<24} p50={misura['p50']:7.1f}ms p95={misura['p95']:7.1f}ms "
+                        f"p99={misura['p99']:7.1f}ms {misura['throughput']:7.1f} req/s "
+                        f"query={misura['query_media']:5.1f} errori={misura['errori']}"
+                    )
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump({
+                    'creato': datetime.now().isoformat(timespec='seconds'),
+                    'config': {key: options[key] for key in ('clients', 'requests', 'orders')},
+                    'rotte': risultati,
+                }, file, indent=2, sort_keys=True)
+            self.stdout.write(f"Baseline salvata in {options['output']}")
+
+        if base is not None:
+            regressioni = confronta(base['rotte'], risultati, options['threshold'], options['threshold_ms'])
+            if regressioni:
+                for regressione in regressioni:
+                    self.stderr.write(self.style.ERROR(regressione))
+                raise CommandError(f"{len(regressioni)} regressioni rispetto a {options['compare']}.")
+            self.stdout.write(self.style.SUCCESS(f"Nessuna regressione rispetto a {options['compare']}."))
+
+    @staticmethod
+    def _carica(percorso):
+        try:
+            with open(percorso) as file:
+                return json.load(file)
+        except (OSError, ValueError) as errore:
+            raise CommandError(f"Baseline non leggibile: {errore}")
@@ -0,0 +1,53 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from gestione.benchmark import ContestoClient, database_di_prova, popola_dati, riepilogo
+
+MOTORI = ('db', 'cached_db', 'cache', 'signed_cookies')
+
+
+class Command(BaseCommand):
+    help = "Misura letture e scritture su django_session per richiesta con ogni motore di sessione."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help="Cicli di richieste per motore.")
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1:
+            raise CommandError("--requests deve essere positivo.")
+        with database_di_prova():
+            ctx = ContestoClient(0, popola_dati(1, ordini_per_cliente=50))
+            for motore in MOTORI:
+                with override_settings(SESSION_ENGINE=f'django.contrib.sessions.backends.{motore}'):
+                    letture, scritture, durate = self._misura(ctx, options['requests'])
+                stats = riepilogo(durate)
+                self.stdout.write(
+                    f"{motore:<15} letture django_session/richiesta={letture:.2f} "
+                    f"scritture/richiesta={scritture:.2f} p50={stats['p50']:.1f}ms p95={stats['p95']:.1f}ms"
+                )
+
+    @staticmethod
+    def _misura(ctx, cicli):
+        # Il client nasce dentro override_settings: il middleware legge il motore all'avvio
+        client = Client()
+        client.force_login(ctx.utente)
+        percorsi = ['/cart/', None, '/prodotti/', '/orders/']  # None: aggiunta con messaggio
+        letture = scritture = 0
+        durate = []
+        for _ in range(cicli):
+            for percorso in percorsi:
+                with CaptureQueriesContext(connection) as query:
+                    inizio = time.perf_counter()
+                    client.get(percorso or f'/add_to_cart/{ctx.prodotto()}/')
+                    durate.append((time.perf_counter() - inizio) * 1000)
+                for sql in (q['sql'] for q in query.captured_queries if 'django_session' in q['sql']):
+                    if sql.startswith('SELECT'):
+                        letture += 1
+                    else:
+                        scritture += 1
+        richieste = cicli * len(percorsi)
+        return letture / richieste, scritture / richieste, durate
@@ -0,0 +1,97 @@
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+
+from gestione.benchmark import ContestoClient, database_di_prova, popola_dati, riepilogo
+from gestione.coupon import conia_coupon
+
+# Il profilo "predefinito" e' la configurazione SQLite di Django senza opzioni
+PROFILI = {
+    'predefinito': ({}, {}),
+    'produzione': (None, None),  # OPTIONS e SQLITE_PRAGMAS da settings.py
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Confronta la contesa sui lock di SQLite tra la configurazione predefinita e il "
+        "profilo di produzione, con checkout, letture e coupon concorrenti."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=8, help="Client simulati in parallelo.")
+        parser.add_argument('--rounds', type=int, default=10, help="Cicli aggiungi/carrello/checkout/ordini/coupon per client.")
+        parser.add_argument('--orders', type=int, default=100, help="Ordini nello storico di ogni cliente.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("Il benchmark riguarda solo SQLite.")
+        if options['clients'] < 1 or options['rounds'] < 1:
+            raise CommandError("--clients e --rounds devono essere positivi.")
+
+        opzioni_originali = dict(connection.settings_dict.get('OPTIONS', {}))
+        for nome, (opzioni, pragma) in PROFILI.items():
+            connection.settings_dict['OPTIONS'] = opzioni_originali if opzioni is None else opzioni
+            pragma = settings.SQLITE_PRAGMAS if pragma is None else pragma
+            try:
+                with override_settings(SQLITE_PRAGMAS=pragma), tempfile.TemporaryDirectory() as cartella:
+                    with database_di_prova(os.path.join(cartella, f'bench_{nome}.sqlite3')):
+                        risultato = self._esegui(options)
+            finally:
+                connection.settings_dict['OPTIONS'] = opzioni_originali
+            stats = riepilogo(risultato['durate'])
+            self.stdout.write(
+                f"{nome:<12} {risultato['ok']:5d} operazioni ok, {risultato['bloccate']:4d} 'database is locked', "
+                f"{risultato['altri_errori']:3d} altri errori, {risultato['ok'] / risultato['durata']:7.1f} op/s, "
+                f"p50={stats['p50']:.1f}ms p95={stats['p95']:.1f}ms p99={stats['p99']:.1f}ms"
+            )
+
+    def _esegui(self, options):
+        dati = popola_dati(options['clients'], options['orders'])
+        contesti = [ContestoClient(i, dati) for i in range(options['clients'])]
+        risultato = {'ok': 0, 'bloccate': 0, 'altri_errori': 0, 'durate': []}
+        lock = threading.Lock()
+
+        def client_simulato(ctx):
+            client = Client()
+            client.force_login(ctx.utente)
+            operazioni = (
+                lambda: client.get(f'/add_to_cart/{ctx.prodotto()}/'),
+                lambda: client.get('/cart/'),
+                lambda: client.post('/create_order/', {'order_type': 'delivery', 'address': 'Via Roma 1', 'city': 'Modena'}),
+                lambda: client.get('/orders/'),
+                # Campagna coupon in corso: legge e poi scrive nella stessa transazione
+                lambda: conia_coupon([ctx.utente.id]),
+            )
+            try:
+                for _ in range(options['rounds']):
+                    for operazione in operazioni:
+                        inizio = time.perf_counter()
+                        try:
+                            operazione()
+                        except Exception as errore:
+                            chiave = 'bloccate' if 'locked' in str(errore) else 'altri_errori'
+                            with lock:
+                                risultato[chiave] += 1
+                            continue
+                        durata = (time.perf_counter() - inizio) * 1000
+                        with lock:
+                            risultato['ok'] += 1
+                            risultato['durate'].append(durata)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=client_simulato, args=(ctx,)) for ctx in contesti]
+        inizio = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        risultato['durata'] = time.perf_counter() - inizio
+        return risultato
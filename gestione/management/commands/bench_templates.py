@@ -0,0 +1,72 @@
+import copy
+import os
+import re
+import tempfile
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from gestione.benchmark import ContestoClient, database_di_prova, popola_dati, riepilogo
+
+PAGINE = ('/', '/prodotti/', '/cart/', '/orders/', '/coupon/', '/map/')
+LOADER_SEMPLICI = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+TEMPO_TEMPLATE = re.compile(r'tpl;dur=([\d.]+)')
+
+
+def _templates(cached):
+    templates = copy.deepcopy(settings.TEMPLATES)
+    templates[0]['OPTIONS']['loaders'] = (
+        [('django.template.loaders.cached.Loader', LOADER_SEMPLICI)] if cached else LOADER_SEMPLICI
+    )
+    return templates
+
+
+class Command(BaseCommand):
+    help = (
+        "Misura il tempo di render dei template (p50 per pagina, dall'header Server-Timing) "
+        "senza cache, con il loader in cache e con loader e frammenti in cache."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help="Richieste per pagina e configurazione.")
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1:
+            raise CommandError("--requests deve essere positivo.")
+        configurazioni = {
+            'nessuna cache': {'TEMPLATES': _templates(False), 'FRAMMENTI_CACHE_TIMEOUT': 0},
+            'loader': {'TEMPLATES': _templates(True), 'FRAMMENTI_CACHE_TIMEOUT': 0},
+            'loader+frammenti': {'TEMPLATES': _templates(True)},
+        }
+
+        with tempfile.TemporaryDirectory() as cartella:
+            with database_di_prova(os.path.join(cartella, 'bench_templates.sqlite3')):
+                ctx = ContestoClient(0, popola_dati(1, 50))
+                risultati = {}
+                for nome, impostazioni in configurazioni.items():
+                    cache.clear()
+                    with override_settings(STRUMENTAZIONE_SERVER_TIMING=True, **impostazioni):
+                        ctx.nuovo_client('cliente')
+                        risultati[nome] = {pagina: self._misura(ctx.client, pagina, options['requests']) for pagina in PAGINE}
+
+        self.stdout.write(f"{'pagina':<12}" + ''.join(f"{nome:>18}" for nome in configurazioni))
+        for pagina in PAGINE:
+            self.stdout.write(
+                f"{pagina:<12}" + ''.join(f"{risultati[nome][pagina]:16.2f}ms" for nome in configurazioni)
+            )
+
+    @staticmethod
+    def _misura(client, pagina, richieste):
+        client.get(pagina)  # Riscaldamento
+        durate = []
+        for _ in range(richieste):
+            risposta = client.get(pagina)
+            if risposta.status_code != 200:
+                raise CommandError(f"{pagina}: status {risposta.status_code}")
+            durate.append(float(TEMPO_TEMPLATE.search(risposta['Server-Timing']).group(1)))
+        return riepilogo(durate)['p50']
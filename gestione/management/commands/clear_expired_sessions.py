@@ -0,0 +1,35 @@
+import time
+
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = (
+        "Elimina da django_session le sessioni scadute a blocchi, in transazioni "
+        "brevi, per non tenere il lock di scrittura di SQLite durante la pulizia."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Sessioni eliminate per transazione.")
+        parser.add_argument('--pause', type=float, default=0.05, help="Secondi di pausa tra due blocchi.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1 or batch_size > 5000:
+            # Resta sotto il limite di parametri per query di SQLite
+            raise CommandError("--batch-size deve essere compreso tra 1 e 5000.")
+
+        adesso = timezone.now()
+        scadute = Session.objects.filter(expire_date__lt=adesso).order_by('expire_date')
+        eliminate = 0
+        while True:
+            chiavi = list(scadute.values_list('session_key', flat=True)[:batch_size])
+            if not chiavi:
+                break
+            eliminate += Session.objects.filter(session_key__in=chiavi, expire_date__lt=adesso).delete()[0]
+            if len(chiavi) < batch_size:
+                break
+            time.sleep(options['pause'])
+        self.stdout.write(self.style.SUCCESS(f"Eliminate {eliminate} sessioni scadute."))
@@ -0,0 +1,37 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gestione.export import FORMATI, esporta, ordini_da_esportare
+
+
+class Command(BaseCommand):
+    help = "Esporta gli ordini in CSV o NDJSON, in streaming e a memoria costante."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fast-food', type=int, help="Id del fast food.")
+        parser.add_argument('--from', dest='dal', type=date.fromisoformat, help="Data iniziale (YYYY-MM-DD).")
+        parser.add_argument('--to', dest='al', type=date.fromisoformat, help="Data finale inclusa (YYYY-MM-DD).")
+        parser.add_argument('--format', dest='formato', choices=sorted(FORMATI), default='csv')
+        parser.add_argument('--output', '-o', help="File di destinazione (default: stdout).")
+
+    def handle(self, *args, **options):
+        if options['dal'] and options['al'] and options['dal'] > options['al']:
+            raise CommandError("--from deve precedere --to.")
+        ordini = ordini_da_esportare(
+            fast_food_id=options['fast_food'], dal=options['dal'], al=options['al'],
+        )
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as destinazione:
+                righe = self._scrivi(ordini, options['formato'], destinazione.write)
+            self.stderr.write(f"Esportati {righe} ordini in {options['output']}.")
+        else:
+            self._scrivi(ordini, options['formato'], lambda riga: self.stdout.write(riga, ending=''))
+
+    @staticmethod
+    def _scrivi(ordini, formato, scrivi):
+        righe = 0
+        for riga in esporta(ordini, formato):
+            scrivi(riga)
+            righe += 1
+        return righe - 1 if formato == 'csv' else righe  # Esclude l'intestazione CSV
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from gestione import immagini
+from gestione.models import Product
+
+
+class Command(BaseCommand):
+    help = "Genera le varianti ridimensionate e WebP delle immagini dei prodotti (da eseguire al deploy)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prune', action='store_true', help="Applica subito il limite di dimensione della cache.")
+
+    def handle(self, *args, **options):
+        if not immagini.disponibile():
+            self.stderr.write(self.style.WARNING("Pillow non installato: verranno servite le immagini originali."))
+            return
+        varianti = 0
+        prodotti = Product.objects.exclude(image_name__isnull=True).exclude(image_name='').only('id', 'image_name')
+        for product in prodotti.iterator():
+            varianti += len(immagini.genera_varianti(product))
+        self.stdout.write(self.style.SUCCESS(f"{varianti} varianti pronte."))
+        if options['prune']:
+            self.stdout.write(f"{immagini.pulisci_cache()} varianti eliminate dalla cache.")
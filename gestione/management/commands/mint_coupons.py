@@ -0,0 +1,63 @@
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gestione.coupon import SCONTO_MAX, SCONTO_MIN, conia_coupon
+from gestione.models import User
+
+
+class Command(BaseCommand):
+    help = "Crea coupon di una campagna per gli utenti esistenti, a blocchi."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--per-user', type=int, default=1, help="Coupon per utente.")
+        parser.add_argument('--discount-min', type=int, default=SCONTO_MIN, help="Sconto minimo (%%).")
+        parser.add_argument('--discount-max', type=int, default=SCONTO_MAX, help="Sconto massimo (%%).")
+        parser.add_argument('--description', default=None, help="Descrizione dei coupon della campagna.")
+        parser.add_argument(
+            '--valid-days', type=int, default=None,
+            help="Giorni di validita' dei coupon (se omesso non scadono).",
+        )
+        parser.add_argument('--chunk-size', type=int, default=200, help="Utenti elaborati per transazione.")
+        parser.add_argument(
+            '--include-ristoratori', action='store_true',
+            help="Crea coupon anche per gli account dei ristoratori.",
+        )
+
+    def handle(self, *args, **options):
+        per_utente = options['per_user']
+        sconto_min, sconto_max = options['discount_min'], options['discount_max']
+        chunk_size = options['chunk_size']
+        if per_utente < 1 or chunk_size < 1:
+            raise CommandError("--per-user e --chunk-size devono essere positivi.")
+        if chunk_size > 5000:
+            # Ogni blocco e' una transazione: come --batch-size di archive_orders e sweep_coupons
+            raise CommandError("--chunk-size non puo' superare 5000.")
+        if options['valid_days'] is not None and options['valid_days'] < 0:
+            raise CommandError("--valid-days non puo' essere negativo.")
+        if not 0 < sconto_min <= sconto_max <= 100:
+            raise CommandError("Lo sconto deve essere compreso tra 1 e 100 con min <= max.")
+
+        utenti = User.objects.order_by('id')
+        if not options['include_ristoratori']:
+            utenti = utenti.filter(is_ristoratore=False)
+
+        inizio = time.monotonic()
+        creati = 0
+        user_ids = utenti.values_list('id', flat=True).iterator(chunk_size=chunk_size)
+        while blocco := list(islice(user_ids, chunk_size)):
+            creati += conia_coupon(
+                blocco, per_utente, sconto_min, sconto_max, options['description'], options['valid_days'],
+            )
+            self.stdout.write(f"{creati} coupon ({self._velocita(creati, inizio)} coupon/s)")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Creati {creati} coupon in {time.monotonic() - inizio:.1f}s "
+            f"({self._velocita(creati, inizio)} coupon/s)."
+        ))
+
+    @staticmethod
+    def _velocita(creati, inizio):
+        durata = time.monotonic() - inizio
+        return f"{creati / durata:.0f}" if durata else "-"
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from gestione.vendite import ricostruisci
+
+
+class Command(BaseCommand):
+    help = (
+        "Ricalcola il rollup delle vendite per fast food, ora e tipo di ordine da Order e "
+        "ArchivedOrder (primo popolamento o dopo modifiche fatte fuori dall'applicazione)."
+    )
+
+    def handle(self, *args, **options):
+        celle = ricostruisci()
+        self.stdout.write(self.style.SUCCESS(f"Rollup ricostruito: {celle} celle."))
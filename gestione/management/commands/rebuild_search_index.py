@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from gestione import ricerca
+
+
+class Command(BaseCommand):
+    help = (
+        "Ricostruisce gli indici full-text (FTS5) di ordini e prodotti dalle tabelle di origine "
+        "(dati caricati fuori dall'applicazione o indice danneggiato)."
+    )
+
+    def handle(self, *args, **options):
+        if not ricerca.disponibile():
+            raise CommandError("Gli indici full-text richiedono SQLite.")
+        for tabella, righe in ricerca.ricostruisci().items():
+            self.stdout.write(self.style.SUCCESS(f"{tabella}: {righe} righe indicizzate."))
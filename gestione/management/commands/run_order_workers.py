@@ -0,0 +1,70 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from gestione.coda import DIMENSIONE_BLOCCO, elabora_coda, profondita
+
+
+class Command(BaseCommand):
+    help = (
+        "Avvia i worker che trasformano i comandi della coda degli ordini in ordini, "
+        "a blocchi, con nuovi tentativi e scarto dei comandi non elaborabili."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1, help="Worker in parallelo (thread).")
+        parser.add_argument('--batch-size', type=int, default=DIMENSIONE_BLOCCO, help="Comandi prelevati per transazione.")
+        parser.add_argument('--poll', type=float, default=1.0, help="Secondi di attesa quando la coda e' vuota.")
+        parser.add_argument('--metrics-every', type=float, default=60.0, help="Secondi tra due righe di metriche della coda.")
+        parser.add_argument('--once', action='store_true', help="Svuota i comandi pronti ed esce.")
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1 or options['batch_size'] < 1:
+            raise CommandError("--workers e --batch-size devono essere positivi.")
+        if options['once']:
+            risultato = elabora_coda(options['batch_size'])
+            self._scrivi_metriche(risultato)
+            return
+
+        fermo = threading.Event()
+        totali = {'completati': 0, 'ritentati': 0, 'scartati': 0}
+        lock = threading.Lock()
+
+        def worker():
+            try:
+                while not fermo.is_set():
+                    # Un blocco per giro, cosi' i worker si alternano sui comandi pronti
+                    risultato = elabora_coda(options['batch_size'], blocchi=1)
+                    with lock:
+                        for chiave, valore in risultato.items():
+                            totali[chiave] += valore
+                    if not any(risultato.values()):
+                        fermo.wait(options['poll'])
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(options['workers'])]
+        for thread in threads:
+            thread.start()
+        self.stdout.write(f"{options['workers']} worker avviati (Ctrl+C per fermarli).")
+        try:
+            while True:
+                time.sleep(options['metrics_every'])
+                with lock:
+                    risultato = dict(totali)
+                    totali.update(dict.fromkeys(totali, 0))
+                self._scrivi_metriche(risultato)
+        except KeyboardInterrupt:
+            fermo.set()
+            for thread in threads:
+                thread.join()
+
+    def _scrivi_metriche(self, risultato):
+        coda = profondita()
+        self.stdout.write(
+            f"completati={risultato['completati']} ritentati={risultato['ritentati']} scartati={risultato['scartati']} | "
+            f"in coda={coda['in_coda']} in lavorazione={coda['in_lavorazione']} "
+            f"scartati totali={coda['scartati']} attesa max={coda['attesa_max_s']}s"
+        )
@@ -0,0 +1,51 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from gestione.coupon import disattiva_scaduti, elimina_scaduti
+
+
+class Command(BaseCommand):
+    help = (
+        "Disattiva i coupon scaduti ed elimina quelli scaduti da piu' di --purge-after-days "
+        "giorni, a blocchi in transazioni brevi."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Coupon aggiornati o eliminati per transazione.")
+        parser.add_argument('--pause', type=float, default=0.05, help="Secondi di pausa tra due blocchi.")
+        parser.add_argument(
+            '--purge-after-days', type=int, default=settings.COUPON_CONSERVA_GIORNI,
+            help="Giorni dopo la scadenza oltre i quali il coupon viene eliminato.",
+        )
+        parser.add_argument('--no-purge', action='store_true', help="Disattiva soltanto, senza eliminare.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1 or batch_size > 5000:
+            # Resta sotto il limite di parametri per query di SQLite
+            raise CommandError("--batch-size deve essere compreso tra 1 e 5000.")
+        if options['purge_after_days'] < 0:
+            raise CommandError("--purge-after-days non puo' essere negativo.")
+
+        disattivati = self._a_blocchi(lambda: disattiva_scaduti(batch_size), batch_size, options['pause'])
+        eliminati = 0
+        if not options['no_purge']:
+            prima_del = timezone.now() - timedelta(days=options['purge_after_days'])
+            eliminati = self._a_blocchi(lambda: elimina_scaduti(prima_del, batch_size), batch_size, options['pause'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Disattivati {disattivati} coupon scaduti, eliminati {eliminati}."
+        ))
+
+    @staticmethod
+    def _a_blocchi(blocco, batch_size, pausa):
+        totale = 0
+        while True:
+            fatti = blocco()
+            totale += fatti
+            if fatti < batch_size:
+                return totale
+            time.sleep(pausa)
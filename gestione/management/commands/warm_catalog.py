@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from gestione.catalogo import invalida_catalogo, scalda_catalogo, statistiche_catalogo
+
+
+class Command(BaseCommand):
+    help = "Scalda la cache del catalogo prodotti (da eseguire ad ogni deploy)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--invalida', action='store_true',
+            help="Forza una nuova versione del catalogo prima di scaldarla.",
+        )
+        parser.add_argument(
+            '--stats', action='store_true',
+            help="Mostra solo i contatori hit/miss senza scaldare la cache.",
+        )
+
+    def handle(self, *args, **options):
+        if not options['stats']:
+            if options['invalida']:
+                invalida_catalogo()
+            versione, prodotti = scalda_catalogo()
+            self.stdout.write(self.style.SUCCESS(
+                f"Catalogo v{versione} in cache ({prodotti} prodotti)."
+            ))
+        stats = statistiche_catalogo()
+        self.stdout.write(
+            f"hit={stats['hit']} miss={stats['miss']} hit_ratio={stats['hit_ratio']:.2%}"
+        )
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.1 on 2026-10-18 13:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestione', '0017_rename_indirizzo_fastfood_address_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_name', models.CharField(max_length=255)),
+                ('quantity', models.PositiveIntegerField()),
+                ('unit_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='gestione.order')),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='order_lines', to='gestione.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'order'], name='orderline_product_order_idx'), models.Index(fields=['product_name'], name='orderline_product_name_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.1 on 2026-10-18 13:20
+
+import re
+from decimal import Decimal
+
+from django.db import migrations
+
+BATCH_SIZE = 1000
+
+# Order.items e' nel formato "2x Big, 1x Fries"
+RIGA_RE = re.compile(r'^\s*(\d+)x (.+?)\s*$')
+
+
+def parse_items(items):
+    righe = []
+    for parte in (items or '').split(', '):
+        match = RIGA_RE.match(parte)
+        if match:
+            righe.append((int(match.group(1)), match.group(2)))
+    return righe
+
+
+def backfill_orderline(apps, schema_editor):
+    Order = apps.get_model('gestione', 'Order')
+    OrderLine = apps.get_model('gestione', 'OrderLine')
+    Product = apps.get_model('gestione', 'Product')
+
+    # Il prezzo storico non e' disponibile: si usa quello attuale del prodotto
+    prodotti = {p.name: (p.id, p.price) for p in Product.objects.all()}
+
+    ultimo_id = 0
+    while True:
+        ordini = list(
+            Order.objects.filter(id__gt=ultimo_id, lines__isnull=True)
+            .order_by('id')
+            .values_list('id', 'items')[:BATCH_SIZE]
+        )
+        if not ordini:
+            break
+        righe = []
+        for order_id, items in ordini:
+            for quantity, name in parse_items(items):
+                product_id, price = prodotti.get(name, (None, Decimal('0.00')))
+                righe.append(OrderLine(
+                    order_id=order_id,
+                    product_id=product_id,
+                    product_name=name,
+                    quantity=quantity,
+                    unit_price=price,
+                ))
+        OrderLine.objects.bulk_create(righe, batch_size=BATCH_SIZE)
+        ultimo_id = ordini[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestione', '0018_orderline'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_orderline, migrations.RunPython.noop),
+    ]
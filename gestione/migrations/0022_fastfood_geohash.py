@@ -0,0 +1,29 @@
+# Generated by Django 5.2.1 on 2026-10-18 13:30
+
+from django.db import migrations, models
+
+from gestione.spaziale import geohash
+
+
+def calcola_geohash(apps, schema_editor):
+    FastFood = apps.get_model('gestione', 'FastFood')
+    fast_foods = list(FastFood.objects.only('id', 'latitudine', 'longitudine'))
+    for fast_food in fast_foods:
+        fast_food.geohash = geohash(fast_food.latitudine, fast_food.longitudine)
+    FastFood.objects.bulk_update(fast_foods, ['geohash'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestione', '0021_indici_accessi'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fastfood',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=12),
+        ),
+        migrations.RunPython(calcola_geohash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.1 on 2026-10-18 13:32
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def unisci_righe_doppie(apps, schema_editor):
+    # Prima del vincolo unico: le righe doppie dello stesso prodotto vengono
+    # unite nella prima, sommando le quantita'
+    CartItem = apps.get_model('gestione', 'CartItem')
+    doppie = (
+        CartItem.objects.values('cart_id', 'product_id')
+        .annotate(righe=Count('id'), prima=Min('id'), quantita=Sum('quantity'))
+        .filter(righe__gt=1)
+    )
+    for gruppo in doppie:
+        CartItem.objects.filter(id=gruppo['prima']).update(quantity=gruppo['quantita'])
+        CartItem.objects.filter(
+            cart_id=gruppo['cart_id'], product_id=gruppo['product_id'],
+        ).exclude(id=gruppo['prima']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestione', '0022_fastfood_geohash'),
+    ]
+
+    operations = [
+        migrations.RunPython(unisci_righe_doppie, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'product'), name='cartitem_cart_product_unico'),
+        ),
+    ]
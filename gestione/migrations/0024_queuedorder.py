@@ -0,0 +1,37 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestione', '0023_cartitem_unico'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueuedOrder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('comando', models.JSONField()),
+                ('chiave', models.CharField(max_length=64)),
+                ('stato', models.CharField(choices=[('in_coda', 'In coda'), ('in_lavorazione', 'In lavorazione'), ('completato', 'Completato'), ('scartato', 'Scartato')], default='in_coda', max_length=20)),
+                ('tentativi', models.PositiveIntegerField(default=0)),
+                ('errore', models.TextField(blank=True)),
+                ('disponibile_dal', models.DateTimeField()),
+                ('preso_il', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('cart', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='gestione.cart')),
+                ('order', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='comando', to='gestione.order')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('stato', 'in_coda')), fields=['disponibile_dal', 'id'], name='queuedorder_pronti_idx'), models.Index(condition=models.Q(('stato', 'in_lavorazione')), fields=['preso_il'], name='queuedorder_lavorazione_idx'), models.Index(condition=models.Q(('stato', 'completato'), _negated=True), fields=['stato', 'created_at'], name='queuedorder_aperti_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('stato__in', ['in_coda', 'in_lavorazione'])), fields=('user', 'chiave'), name='queuedorder_sospeso_unico')],
+            },
+        ),
+    ]
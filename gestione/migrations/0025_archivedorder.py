@@ -0,0 +1,53 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestione', '0024_queuedorder'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('total_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('items', models.TextField()),
+                ('status', models.CharField(choices=[('ORDINE RICEVUTO', 'Ordine Ricevuto'), ('IN PREPARAZIONE', 'In Preparazione'), ('IN CONSEGNA', 'In Consegna'), ('CONSEGNATO', 'Consegnato')], max_length=20)),
+                ('tipo_di_ordine', models.CharField(choices=[('DELIVERY', 'Delivery'), ('IN LOCO', 'In Loco')], max_length=20)),
+                ('delivery_address', models.CharField(blank=True, max_length=255, null=True)),
+                ('delivery_city', models.CharField(blank=True, max_length=100, null=True)),
+                ('righe', models.JSONField(default=list)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('status', 'CONSEGNATO')), fields=['created_at', 'id'], name='order_consegnati_idx'),
+        ),
+        migrations.AddField(
+            model_name='archivedorder',
+            name='fast_food',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='gestione.fastfood'),
+        ),
+        migrations.AddField(
+            model_name='archivedorder',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='archived_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['fast_food', '-created_at', '-id'], name='archived_store_created_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestione', '0025_archivedorder'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo_di_ordine', models.CharField(max_length=20)),
+                ('ora', models.DateTimeField()),
+                ('ordini', models.PositiveIntegerField(default=0)),
+                ('incasso', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('consegnati', models.PositiveIntegerField(default=0)),
+                ('incasso_consegnato', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('fast_food', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='gestione.fastfood')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['ora'], name='salesrollup_ora_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('fast_food__isnull', False)), fields=('fast_food', 'tipo_di_ordine', 'ora'), name='salesrollup_cella_unica'), models.UniqueConstraint(condition=models.Q(('fast_food__isnull', True)), fields=('tipo_di_ordine', 'ora'), name='salesrollup_cella_senza_fast_food_unica')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestione', '0026_salesrollup'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='coupon',
+            name='coupon_user_attivi_idx',
+        ),
+        migrations.AddField(
+            model_name='coupon',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='coupon',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['user', 'expires_at'], name='coupon_user_attivi_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='coupon',
+            index=models.Index(condition=models.Q(('expires_at__isnull', False)), fields=['expires_at'], name='coupon_scadenza_idx'),
+        ),
+    ]
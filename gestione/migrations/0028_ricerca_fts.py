@@ -0,0 +1,60 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:40
+
+from django.db import migrations
+
+# Tabelle FTS5 a contenuto esterno: il testo resta in gestione_order e
+# gestione_product, l'indice contiene solo i trigrammi. I trigger lo
+# aggiornano nella stessa transazione della scrittura.
+#
+# Copia congelata di gestione/ricerca.py (INDICI, sql_indice) com'era a
+# questa migrazione: non va importata da li', perche' una migrazione non
+# deve cambiare quando cambia il codice. Dopo ogni migrate,
+# ricerca.ripristina() ricrea i trigger eliminati da migrazioni successive.
+INDICI = {
+    'gestione_order_fts': ('gestione_order', ('items', 'delivery_address', 'delivery_city')),
+    'gestione_product_fts': ('gestione_product', ('name',)),
+}
+
+
+def _sql_creazione(tabella, origine, colonne):
+    elenco = ', '.join(colonne)
+    nuovi = ', '.join(f'new.{colonna}' for colonna in colonne)
+    vecchi = ', '.join(f'old.{colonna}' for colonna in colonne)
+    elimina = f"INSERT INTO {tabella}({tabella}, rowid, {elenco}) VALUES ('delete', old.id, {vecchi});"
+    inserisci = f"INSERT INTO {tabella}(rowid, {elenco}) VALUES (new.id, {nuovi});"
+    return [
+        f"CREATE VIRTUAL TABLE {tabella} USING fts5({elenco}, content='{origine}', content_rowid='id', tokenize='trigram')",
+        f"CREATE TRIGGER {tabella}_ai AFTER INSERT ON {origine} BEGIN {inserisci} END",
+        f"CREATE TRIGGER {tabella}_ad AFTER DELETE ON {origine} BEGIN {elimina} END",
+        # Solo le colonne indicizzate: i cambi di stato non toccano l'indice
+        f"CREATE TRIGGER {tabella}_au AFTER UPDATE OF {elenco} ON {origine} BEGIN {elimina} {inserisci} END",
+        f"INSERT INTO {tabella}({tabella}) VALUES ('rebuild')",
+    ]
+
+
+def crea_indici(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for tabella, (origine, colonne) in INDICI.items():
+        for sql in _sql_creazione(tabella, origine, colonne):
+            schema_editor.execute(sql)
+
+
+def elimina_indici(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for tabella in INDICI:
+        for suffisso in ('ai', 'ad', 'au'):
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {tabella}_{suffisso}")
+        schema_editor.execute(f"DROP TABLE IF EXISTS {tabella}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestione', '0027_coupon_expires_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(crea_indici, elimina_indici),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.1 on 2026-10-18 20:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestione', '0028_ricerca_fts'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='queuedorder',
+            index=models.Index(condition=models.Q(('stato', 'scartato')), fields=['user', '-updated_at'], name='queuedorder_scartati_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.1 on 2026-10-18 20:30
+
+from django.db import migrations
+from django.utils import timezone
+
+BATCH_SIZE = 1000
+
+
+def imposta_scadenza(apps, schema_editor):
+    # I coupon gia' usati prima della scadenza non verrebbero mai eliminati
+    # da sweep_coupons: scadono adesso. Quelli attivi restano senza scadenza
+    Coupon = apps.get_model('gestione', 'Coupon')
+    adesso = timezone.now()
+    while True:
+        ids = list(
+            Coupon.objects.filter(expires_at__isnull=True, is_active=False)
+            .values_list('id', flat=True)[:BATCH_SIZE]
+        )
+        if not ids:
+            break
+        Coupon.objects.filter(id__in=ids).update(expires_at=adesso)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestione', '0029_queuedorder_scartati_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(imposta_scadenza, migrations.RunPython.noop),
+    ]
@@ -29,6 +29,15 @@ class Coupon(models.Model):
     discount = models.IntegerField()  # Percentuale di sconto
     description = models.CharField(max_length=255)  # Descrizione del coupon
     is_active = models.BooleanField(default=True)  # Stato del coupon (attivo o meno)
+    expires_at = models.DateTimeField(null=True, blank=True)  # Scadenza (None: non scade)
+
+    class Meta:
+        indexes = [
+            # Solo i coupon attivi e non scaduti vengono mostrati all'utente (coupon_page)
+            models.Index(fields=['user', 'expires_at'], condition=models.Q(is_active=True), name='coupon_user_attivi_idx'),
+            # Coupon scaduti da disattivare o eliminare (sweep_coupons)
+            models.Index(fields=['expires_at'], condition=models.Q(expires_at__isnull=False), name='coupon_scadenza_idx'),
+        ]
 
     def __str__(self):
         return f"{self.code} - {self.discount}%"
@@ -40,9 +49,9 @@ class Cart(models.Model):
     products = models.ManyToManyField(Product, blank=True)  # Relazione ManyToMany con i prodotti
 
     def calculate_discounted_price(self):
+        from .prezzi import calcola_sconto  # Import locale: prezzi importa i modelli
         if self.coupon:
-            discount = (self.total_price * self.coupon.discount) / 100
-            return self.total_price - discount
+            return self.total_price - calcola_sconto(self.total_price, self.coupon.discount)
         return self.total_price
 
     def __str__(self):
@@ -53,6 +62,12 @@ class CartItem(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)  # Relazione con il prodotto
     quantity = models.PositiveIntegerField(default=1)
 
+    class Meta:
+        constraints = [
+            # Una sola riga per prodotto: le aggiunte incrementano la quantita'
+            models.UniqueConstraint(fields=['cart', 'product'], name='cartitem_cart_product_unico'),
+        ]
+
     def __str__(self):
         return f"{self.quantity} x {self.product.name} nel carrello di {self.cart.user.username}"
 
@@ -61,6 +76,7 @@ class FastFood(models.Model):
     address = models.CharField(max_length=255)
     latitudine = models.FloatField()
     longitudine = models.FloatField()
+    geohash = models.CharField(max_length=12, blank=True, db_index=True, editable=False)  # Cella della griglia, calcolata al salvataggio
 
     def __str__(self):
         return self.name
@@ -78,17 +94,196 @@ class Order(models.Model):
         ('IN LOCO', 'In Loco'),
     ]
 
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    # Passaggi di stato consentiti per tipo di ordine (create_order salva
+    # il tipo in minuscolo): un ordine in loco non passa da IN CONSEGNA
+    _FLUSSO_DELIVERY = {
+        'ORDINE RICEVUTO': ('IN PREPARAZIONE',),
+        'IN PREPARAZIONE': ('IN CONSEGNA',),
+        'IN CONSEGNA': ('CONSEGNATO',),
+    }
+    _FLUSSO_IN_LOCO = {
+        'ORDINE RICEVUTO': ('IN PREPARAZIONE',),
+        'IN PREPARAZIONE': ('CONSEGNATO',),
+    }
+    TRANSIZIONI = {
+        'delivery': _FLUSSO_DELIVERY,
+        'DELIVERY': _FLUSSO_DELIVERY,
+        'in_loco': _FLUSSO_IN_LOCO,
+        'IN LOCO': _FLUSSO_IN_LOCO,
+    }
+
+    # Gli indici sulle FK sono coperti dagli indici composti in Meta.indexes
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_index=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Cursore del feed della cucina: ogni modifica deve aggiornarlo, anche
+    # gli update() in blocco (save() lo fa da solo), altrimenti il feed non la vede
+    updated_at = models.DateTimeField(auto_now=True)
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
     items = models.TextField()  # Salva i dettagli degli articoli come stringa
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='ORDINE RICEVUTO')
     tipo_di_ordine = models.CharField(max_length=20, choices=ORDER_TYPE_CHOICES, default='DELIVERY')
-    fast_food = models.ForeignKey(FastFood, on_delete=models.SET_NULL, null=True, blank=True)  # Fast-food per "In Loco"
+    fast_food = models.ForeignKey(FastFood, on_delete=models.SET_NULL, null=True, blank=True, db_index=False)  # Fast-food per "In Loco"
     delivery_address = models.CharField(max_length=255, blank=True, null=True)  # Indirizzo per "Delivery"
     delivery_city = models.CharField(max_length=100, blank=True, null=True)  # Città per "Delivery"
 
+    class Meta:
+        indexes = [
+            # Storico del cliente (orders_view)
+            models.Index(fields=['user', '-created_at', '-id'], name='order_user_created_idx'),
+            # Ordini di un fast food, anche divisi per tipo (gestione_ordine)
+            models.Index(fields=['fast_food', '-created_at', '-id'], name='order_store_created_idx'),
+            models.Index(fields=['fast_food', 'tipo_di_ordine', '-created_at', '-id'], name='order_store_tipo_idx'),
+            # Feed live della cucina
+            models.Index(fields=['fast_food', 'updated_at', 'id'], name='order_feed_idx'),
+            # Ordini consegnati da archiviare (archive_orders)
+            models.Index(fields=['created_at', 'id'], condition=models.Q(status='CONSEGNATO'), name='order_consegnati_idx'),
+        ]
+
+    def stati_successivi(self):
+        """Stati in cui l'ordine puo' passare da quello attuale."""
+        return self.TRANSIZIONI.get(self.tipo_di_ordine, {}).get(self.status, ())
+
     def __str__(self):
         return f"Ordine di {self.user.username} - {self.created_at.strftime('%Y-%m-%d %H:%M:%S')} - Stato: {self.status} - Tipo: {self.tipo_di_ordine}"
 
 
+class OrderLine(models.Model):
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='lines')
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, blank=True, related_name='order_lines')
+    product_name = models.CharField(max_length=255)  # Nome del prodotto al momento dell'ordine
+    quantity = models.PositiveIntegerField()
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)  # Prezzo unitario al momento dell'ordine
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'order'], name='orderline_product_order_idx'),
+            models.Index(fields=['product_name'], name='orderline_product_name_idx'),
+        ]
+
+    @staticmethod
+    def descrivi(lines):
+        """Testo mostrato in Order.items, es. "2x Big, 1x Fries"."""
+        return ", ".join(f"{line.quantity}x {line.product_name}" for line in lines)
+
+    def __str__(self):
+        return f"{self.quantity}x {self.product_name} (ordine {self.order_id})"
+
+
+class QueuedOrder(models.Model):
+    """
+    Comando d'ordine accodato dal checkout (gestione/coda.py): contiene la
+    fotografia del carrello e viene trasformato in Order dai worker.
+    """
+    IN_CODA = 'in_coda'
+    IN_LAVORAZIONE = 'in_lavorazione'
+    COMPLETATO = 'completato'
+    SCARTATO = 'scartato'  # Dead letter: tentativi esauriti
+    STATO_CHOICES = [
+        (IN_CODA, 'In coda'),
+        (IN_LAVORAZIONE, 'In lavorazione'),
+        (COMPLETATO, 'Completato'),
+        (SCARTATO, 'Scartato'),
+    ]
+    IN_SOSPESO = (IN_CODA, IN_LAVORAZIONE)
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_index=False)
+    cart = models.ForeignKey(Cart, on_delete=models.SET_NULL, null=True, blank=True, db_index=False)
+    comando = models.JSONField()  # Righe, prezzi, coupon e campi dell'ordine al momento del checkout
+    chiave = models.CharField(max_length=64)  # Hash del comando: lo stesso checkout non viene accodato due volte
+    stato = models.CharField(max_length=20, choices=STATO_CHOICES, default=IN_CODA)
+    tentativi = models.PositiveIntegerField(default=0)
+    errore = models.TextField(blank=True)
+    disponibile_dal = models.DateTimeField()  # I tentativi falliti vengono ripresi dopo un'attesa
+    preso_il = models.DateTimeField(null=True, blank=True)  # Inizio della lavorazione (worker bloccati)
+    order = models.OneToOneField(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='comando')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Prelievo dei comandi pronti da parte dei worker
+            models.Index(fields=['disponibile_dal', 'id'], condition=models.Q(stato='in_coda'), name='queuedorder_pronti_idx'),
+            # Lavorazioni rimaste a meta' (worker interrotto)
+            models.Index(fields=['preso_il'], condition=models.Q(stato='in_lavorazione'), name='queuedorder_lavorazione_idx'),
+            # Profondita' della coda: i comandi completati non vengono letti
+            models.Index(fields=['stato', 'created_at'], condition=~models.Q(stato='completato'), name='queuedorder_aperti_idx'),
+            # Checkout scartati mostrati al cliente (orders_view)
+            models.Index(fields=['user', '-updated_at'], condition=models.Q(stato='scartato'), name='queuedorder_scartati_idx'),
+        ]
+        constraints = [
+            # Un doppio invio dello stesso carrello non crea due ordini
+            models.UniqueConstraint(
+                fields=['user', 'chiave'], condition=models.Q(stato__in=['in_coda', 'in_lavorazione']),
+                name='queuedorder_sospeso_unico',
+            ),
+        ]
+
+    def __str__(self):
+        return f"Comando {self.id} di {self.user_id} - {self.stato}"
+
+
+class ArchivedOrder(models.Model):
+    """
+    Ordine consegnato spostato fuori da gestione_order da archive_orders
+    (gestione/archivio.py). Mantiene l'id e i campi dell'ordine, cosi' le
+    viste e l'export lo trattano come un Order; le righe sono salvate in
+    JSON insieme all'ordine.
+    """
+    id = models.BigIntegerField(primary_key=True)  # Lo stesso id dell'ordine originale
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_index=False)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    total_price = models.DecimalField(max_digits=10, decimal_places=2)
+    items = models.TextField()
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    tipo_di_ordine = models.CharField(max_length=20, choices=Order.ORDER_TYPE_CHOICES)
+    fast_food = models.ForeignKey(FastFood, on_delete=models.SET_NULL, null=True, blank=True, db_index=False)
+    delivery_address = models.CharField(max_length=255, blank=True, null=True)
+    delivery_city = models.CharField(max_length=100, blank=True, null=True)
+    righe = models.JSONField(default=list)  # [{product_id, product_name, quantity, unit_price}]
+
+    class Meta:
+        indexes = [
+            # Gli stessi accessi di Order: storico del cliente ed export per fast food
+            models.Index(fields=['user', '-created_at', '-id'], name='archived_user_created_idx'),
+            models.Index(fields=['fast_food', '-created_at', '-id'], name='archived_store_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"Ordine archiviato {self.id} - {self.created_at.strftime('%Y-%m-%d %H:%M:%S')}"
+
+
+class SalesRollup(models.Model):
+    """
+    Ordini e incassi per fast food, ora (UTC) e tipo di ordine, aggiornati
+    a ogni ordine creato o consegnato (gestione/vendite.py): la dashboard
+    delle vendite legge solo questa tabella.
+    """
+    fast_food = models.ForeignKey(FastFood, on_delete=models.CASCADE, null=True, blank=True, db_index=False)
+    tipo_di_ordine = models.CharField(max_length=20)
+    ora = models.DateTimeField()  # Inizio dell'ora, in UTC
+    ordini = models.PositiveIntegerField(default=0)
+    incasso = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    consegnati = models.PositiveIntegerField(default=0)
+    incasso_consegnato = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            # Una riga per cella; gli ordini delivery senza fast food hanno la loro
+            models.UniqueConstraint(
+                fields=['fast_food', 'tipo_di_ordine', 'ora'], condition=models.Q(fast_food__isnull=False),
+                name='salesrollup_cella_unica',
+            ),
+            models.UniqueConstraint(
+                fields=['tipo_di_ordine', 'ora'], condition=models.Q(fast_food__isnull=True),
+                name='salesrollup_cella_senza_fast_food_unica',
+            ),
+        ]
+        indexes = [
+            # Dashboard: tutte le celle di un periodo
+            models.Index(fields=['ora'], name='salesrollup_ora_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.fast_food_id} {self.tipo_di_ordine} {self.ora:%Y-%m-%d %H}:00 - {self.ordini} ordini"
@@ -0,0 +1,32 @@
+from django.db import transaction
+
+from .models import Order, OrderLine
+from .vendite import registra_ordine
+
+
+def crea_ordine(user, prezzo, **campi):
+    """
+    Crea l'ordine e le sue righe a partire dal prezzo del carrello.
+    Order.items resta come testo di visualizzazione derivato dalle righe.
+    """
+    lines = [
+        OrderLine(
+            product=item.product,
+            product_name=item.product.name,
+            quantity=item.quantity,
+            unit_price=item.product.price,
+        )
+        for item in prezzo.items
+    ]
+    with transaction.atomic():
+        order = Order.objects.create(
+            user=user,
+            total_price=prezzo.totale,
+            items=OrderLine.descrivi(lines),
+            **campi
+        )
+        for line in lines:
+            line.order = order
+        OrderLine.objects.bulk_create(lines)
+        registra_ordine(order)  # Rollup delle vendite nella stessa transazione
+    return order
@@ -0,0 +1,65 @@
+import heapq
+from datetime import datetime, timedelta, timezone as dt_timezone
+from itertools import islice
+
+from django.db.models import Q
+
+EPOCA = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def codifica_cursore(istante, pk):
+    micro = (istante - EPOCA) // timedelta(microseconds=1)
+    return f"{micro}-{pk}"
+
+
+def decodifica_cursore(cursore):
+    """Restituisce (istante, pk) oppure None se il cursore non e' valido."""
+    try:
+        micro, pk = (int(parte) for parte in cursore.split('-', 1))
+    except (AttributeError, ValueError):
+        return None
+    return EPOCA + timedelta(microseconds=micro), pk
+
+
+def filtra_keyset(queryset, cursore, campo='created_at'):
+    """Righe successive al cursore, dalla piu' recente alla piu' vecchia."""
+    queryset = queryset.order_by(f'-{campo}', '-id')
+    posizione = decodifica_cursore(cursore)
+    if posizione is not None:
+        istante, pk = posizione
+        # Il limite "campo <= istante" permette al database di partire
+        # direttamente dal cursore nell'indice invece di scorrere le righe
+        # delle pagine precedenti.
+        queryset = queryset.filter(
+            Q(**{f'{campo}__lte': istante}),
+            Q(**{f'{campo}__lt': istante}) | Q(id__lt=pk),
+        )
+    return queryset
+
+
+def pagina_keyset(queryset, cursore, dimensione, campo='created_at'):
+    """
+    Pagina dal piu' recente al piu' vecchio su (campo, id): il costo dipende
+    solo dalla dimensione della pagina, non da quante righe la precedono.
+    Restituisce le righe della pagina e il cursore della pagina successiva.
+    """
+    return _pagina(list(filtra_keyset(queryset, cursore, campo)[:dimensione + 1]), dimensione, campo)
+
+
+def pagina_keyset_unione(querysets, cursore, dimensione, campo='created_at'):
+    """
+    Come pagina_keyset, su piu' tabelle con gli stessi campi (ordini attivi
+    e archiviati) e id non sovrapposti: una pagina per tabella dallo stesso
+    cursore, unite in ordine. Il costo resta di una pagina per tabella.
+    """
+    pagine = [filtra_keyset(queryset, cursore, campo)[:dimensione + 1] for queryset in querysets]
+    unite = heapq.merge(*pagine, key=lambda riga: (getattr(riga, campo), riga.id), reverse=True)
+    return _pagina(list(islice(unite, dimensione + 1)), dimensione, campo)
+
+
+def _pagina(righe, dimensione, campo):
+    successivo = None
+    if len(righe) > dimensione:
+        righe = righe[:dimensione]
+        successivo = codifica_cursore(getattr(righe[-1], campo), righe[-1].id)
+    return righe, successivo
@@ -0,0 +1,91 @@
+from dataclasses import dataclass, field
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db.models import DecimalField, ExpressionWrapper, F
+
+from .models import CartItem
+
+CENTESIMI = Decimal('0.01')
+
+
+def arrotonda(importo):
+    return Decimal(importo).quantize(CENTESIMI, rounding=ROUND_HALF_UP)
+
+
+def calcola_sconto(importo, percentuale):
+    """Restituisce lo sconto (in euro) di una percentuale su un importo."""
+    if not percentuale:
+        return Decimal('0.00')
+    return arrotonda(Decimal(importo) * percentuale / 100)
+
+
+@dataclass
+class PrezzoCarrello:
+    """Riepilogo dei prezzi di un carrello, riusabile da viste e ordini."""
+    items: list = field(default_factory=list)
+    subtotale: Decimal = Decimal('0.00')
+    coupon: object = None
+    sconto: Decimal = Decimal('0.00')
+    totale: Decimal = Decimal('0.00')
+
+    @property
+    def percentuale_sconto(self):
+        return self.coupon.discount if self.coupon else 0
+
+    @property
+    def vuoto(self):
+        return not self.items
+
+    def come_dict(self):
+        """Riepilogo serializzabile in JSON per l'API del carrello."""
+        return {
+            'righe': [
+                {
+                    'id': item.id,
+                    'product_id': item.product_id,
+                    'nome': item.product.name,
+                    'quantita': item.quantity,
+                    'prezzo': str(item.product.price),
+                    'totale_riga': str(arrotonda(item.line_total)),
+                }
+                for item in self.items
+            ],
+            'articoli': sum(item.quantity for item in self.items),
+            'subtotale': str(self.subtotale),
+            'coupon': self.coupon.code if self.coupon else None,
+            'sconto': str(self.sconto),
+            'totale': str(self.totale),
+        }
+
+
+def righe_carrello(cart):
+    # Una sola query: le righe con il prodotto gia' unito e il totale di riga
+    # calcolato dal database.
+    return (
+        CartItem.objects.filter(cart=cart)
+        .select_related('product')
+        .annotate(line_total=ExpressionWrapper(
+            F('quantity') * F('product__price'),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        ))
+        .order_by('id')
+    )
+
+
+def prezzo_carrello(cart):
+    """
+    Calcola subtotale, sconto e totale del carrello con una query sulle righe.
+    Il coupon viene letto dal carrello: caricarlo con select_related('coupon')
+    evita la query aggiuntiva.
+    """
+    items = list(righe_carrello(cart))
+    subtotale = arrotonda(sum((item.line_total for item in items), Decimal('0')))
+    coupon = cart.coupon
+    sconto = calcola_sconto(subtotale, coupon.discount if coupon else 0)
+    return PrezzoCarrello(
+        items=items,
+        subtotale=subtotale,
+        coupon=coupon,
+        sconto=sconto,
+        totale=subtotale - sconto,
+    )
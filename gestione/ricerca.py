@@ -0,0 +1,119 @@
+from functools import reduce
+from operator import or_
+
+from django.db import connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.text import smart_split, unescape_string_literal
+
+from .models import Order, Product
+
+# Tabelle FTS5 (solo su SQLite) tenute allineate da trigger: per modello,
+# tabella e colonne indicizzate. Create dalla migrazione 0028 e ricreate da
+# ripristina() dopo ogni migrate, se una migrazione le ha eliminate.
+INDICI = {
+    Order: ('gestione_order_fts', ('items', 'delivery_address', 'delivery_city')),
+    Product: ('gestione_product_fts', ('name',)),
+}
+LUNGHEZZA_MINIMA = 3  # Il tokenizer trigram non trova sottostringhe piu' corte
+
+
+def disponibile(using='default'):
+    return connections[using].vendor == 'sqlite'
+
+
+def termini(testo):
+    """Parole cercate, come nella ricerca dell'admin: "Big Mac" tra virgolette resta unito."""
+    risultato = []
+    for termine in smart_split(testo):
+        if termine.startswith(('"', "'")) and termine[0] == termine[-1]:
+            termine = unescape_string_literal(termine)
+        if termine:
+            risultato.append(termine)
+    return risultato
+
+
+def _frase(termine):
+    # Tra virgolette il termine e' una sottostringa, non una query FTS5
+    return '"' + termine.replace('"', '""') + '"'
+
+
+def condizione(modello, termine, using='default'):
+    """
+    Q delle righe di modello che contengono termine (senza distinzione tra
+    maiuscole e minuscole) in una delle colonne indicizzate: dall'indice
+    FTS5 se possibile, altrimenti con icontains.
+    """
+    tabella, campi = INDICI[modello]
+    if disponibile(using) and len(termine) >= LUNGHEZZA_MINIMA:
+        return Q(pk__in=RawSQL(f'SELECT rowid FROM {tabella} WHERE {tabella} MATCH %s', [_frase(termine)]))
+    return reduce(or_, (Q(**{f'{campo}__icontains': termine}) for campo in campi))
+
+
+def filtra(queryset, testo, altro=None):
+    """
+    Righe di queryset che contengono ogni termine di testo. altro(termine),
+    se indicato, restituisce una Q alternativa all'indice per quel termine.
+    """
+    for termine in termini(testo):
+        q = condizione(queryset.model, termine, queryset.db)
+        if altro is not None:
+            q |= altro(termine)
+        queryset = queryset.filter(q)
+    return queryset
+
+
+def sql_indice(tabella, origine, colonne):
+    """Tabella FTS5 a contenuto esterno e trigger che la aggiornano con origine."""
+    elenco = ', '.join(colonne)
+    nuovi = ', '.join(f'new.{colonna}' for colonna in colonne)
+    vecchi = ', '.join(f'old.{colonna}' for colonna in colonne)
+    elimina = f"INSERT INTO {tabella}({tabella}, rowid, {elenco}) VALUES ('delete', old.id, {vecchi});"
+    inserisci = f"INSERT INTO {tabella}(rowid, {elenco}) VALUES (new.id, {nuovi});"
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {tabella} USING fts5("
+        f"{elenco}, content='{origine}', content_rowid='id', tokenize='trigram')",
+        f"CREATE TRIGGER IF NOT EXISTS {tabella}_ai AFTER INSERT ON {origine} BEGIN {inserisci} END",
+        f"CREATE TRIGGER IF NOT EXISTS {tabella}_ad AFTER DELETE ON {origine} BEGIN {elimina} END",
+        # Solo le colonne indicizzate: i cambi di stato non toccano l'indice
+        f"CREATE TRIGGER IF NOT EXISTS {tabella}_au AFTER UPDATE OF {elenco} ON {origine} BEGIN {elimina} {inserisci} END",
+    ]
+
+
+def _crea(cursor, modello):
+    tabella, colonne = INDICI[modello]
+    for sql in sql_indice(tabella, modello._meta.db_table, colonne):
+        cursor.execute(sql)
+    cursor.execute(f"INSERT INTO {tabella}({tabella}) VALUES ('rebuild')")
+
+
+def ricostruisci(using='default'):
+    """
+    Ricrea tabelle e trigger mancanti e ripopola gli indici dalle tabelle
+    di origine. Restituisce le righe per tabella.
+    """
+    risultato = {}
+    with connections[using].cursor() as cursor:
+        for modello, (tabella, _) in INDICI.items():
+            _crea(cursor, modello)
+            risultato[tabella] = modello.objects.using(using).count()
+    return risultato
+
+
+def ripristina(using='default'):
+    """
+    Una migrazione che ricostruisce la tabella di origine su SQLite
+    (AlterField, AddField...) elimina i suoi trigger e l'indice smetterebbe
+    di aggiornarsi: ricrea cio' che manca e, solo in quel caso, ripopola
+    l'indice. Chiamata dopo ogni migrate. Restituisce le tabelle ripristinate.
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')")
+        esistenti = {nome for nome, in cursor.fetchall()}
+        ripristinate = []
+        for modello, (tabella, _) in INDICI.items():
+            attesi = {tabella} | {f'{tabella}_{suffisso}' for suffisso in ('ai', 'ad', 'au')}
+            if not attesi <= esistenti:
+                _crea(cursor, modello)
+                ripristinate.append(tabella)
+    return ripristinate
@@ -0,0 +1,64 @@
+from django.db import connections, transaction
+from django.db.backends.signals import connection_created
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_save
+from django.dispatch import receiver
+from django.utils.autoreload import file_changed
+
+from .catalogo import invalida_catalogo
+from .context_processors import versione_template
+from .database import configura_sqlite
+from .immagini import genera_varianti
+from .models import FastFood, Product
+from .ricerca import ripristina as ripristina_ricerca
+from .spaziale import geohash, invalida_indice
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalida_catalogo_prodotti(sender, **kwargs):
+    # Cambia la versione solo dopo il commit, altrimenti una richiesta
+    # concorrente potrebbe rimettere in cache i dati non ancora salvati.
+    transaction.on_commit(invalida_catalogo)
+
+
+@receiver(post_save, sender=Product)
+def genera_immagini_prodotto(sender, instance, update_fields=None, **kwargs):
+    # Le varianti della nuova immagine sono pronte prima della prima richiesta;
+    # quelle della vecchia escono dalla cache LRU da sole
+    if instance.image_name and (update_fields is None or 'image_name' in update_fields):
+        transaction.on_commit(lambda: genera_varianti(instance))
+
+
+@receiver(pre_save, sender=FastFood)
+def aggiorna_geohash(sender, instance, **kwargs):
+    instance.geohash = geohash(instance.latitudine, instance.longitudine)
+
+
+@receiver(post_save, sender=FastFood)
+@receiver(post_delete, sender=FastFood)
+def invalida_indice_fast_food(sender, **kwargs):
+    # Ogni processo ricostruisce il proprio KD-tree alla prossima ricerca
+    transaction.on_commit(invalida_indice)
+
+
+# Profilo di produzione di SQLite (PROGETTO/settings.py, SQLITE_PRAGMAS)
+connection_created.connect(configura_sqlite, dispatch_uid='gestione_configura_sqlite')
+
+
+@receiver(file_changed)
+def aggiorna_versione_template(sender, file_path, **kwargs):
+    # runserver: un template modificato cambia la chiave dei frammenti in cache
+    if file_path.suffix == '.html':
+        versione_template.cache_clear()
+
+
+@receiver(post_migrate)
+def ripristina_indici_ricerca(sender, using, **kwargs):
+    # Trigger FTS5 eliminati da una ricostruzione della tabella di origine
+    # (solo se la migrazione che crea gli indici e' applicata)
+    connection = connections[using]
+    if sender.name != 'gestione' or connection.vendor != 'sqlite':
+        return
+    if ('gestione', '0028_ricerca_fts') in MigrationRecorder(connection).applied_migrations():
+        ripristina_ricerca(using)
@@ -0,0 +1,243 @@
+import heapq
+import math
+import threading
+import time
+from itertools import count
+
+from django.core.cache import cache
+from django.db.models import ExpressionWrapper, F, FloatField, Q, Value
+from django.db.models.functions import Abs, Least
+
+from .models import FastFood
+
+RAGGIO_TERRA_KM = 6371.0088
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+PRECISIONE_GEOHASH = 9  # Celle di circa 5 m x 5 m
+MAX_CELLE_RIQUADRO = 16
+
+VERSIONE_KEY = 'spaziale:versione'
+
+
+# Geohash ---------------------------------------------------------------
+
+def geohash(lat, lng, precisione=PRECISIONE_GEOHASH):
+    lat_min, lat_max = -90.0, 90.0
+    lng_min, lng_max = -180.0, 180.0
+    codice, bit, carattere, pari = [], 0, 0, True
+    while len(codice) < precisione:
+        if pari:
+            centro = (lng_min + lng_max) / 2
+            if lng >= centro:
+                carattere = carattere * 2 + 1
+                lng_min = centro
+            else:
+                carattere *= 2
+                lng_max = centro
+        else:
+            centro = (lat_min + lat_max) / 2
+            if lat >= centro:
+                carattere = carattere * 2 + 1
+                lat_min = centro
+            else:
+                carattere *= 2
+                lat_max = centro
+        pari = not pari
+        bit += 1
+        if bit == 5:
+            codice.append(BASE32[carattere])
+            bit, carattere = 0, 0
+    return ''.join(codice)
+
+
+def dimensioni_cella(precisione):
+    """Altezza e larghezza in gradi di una cella geohash."""
+    bit = 5 * precisione
+    return 180.0 / 2 ** (bit // 2), 360.0 / 2 ** (bit - bit // 2)
+
+
+def celle_riquadro(sud, ovest, nord, est):
+    """
+    Prefissi geohash che coprono il riquadro, alla precisione piu' fine che
+    resta entro MAX_CELLE_RIQUADRO celle.
+    """
+    for precisione in range(PRECISIONE_GEOHASH, 0, -1):
+        altezza, larghezza = dimensioni_cella(precisione)
+        righe = math.floor(nord / altezza) - math.floor(sud / altezza) + 1
+        colonne = math.floor(est / larghezza) - math.floor(ovest / larghezza) + 1
+        if righe * colonne <= MAX_CELLE_RIQUADRO:
+            break
+    celle = set()
+    for i in range(righe):
+        lat = min((math.floor(sud / altezza) + i + 0.5) * altezza, 89.999999)
+        for j in range(colonne):
+            lng = (math.floor(ovest / larghezza) + j + 0.5) * larghezza
+            celle.add(geohash(lat, min(lng, 179.999999), precisione))
+    return sorted(celle)
+
+
+def filtro_riquadro(sud, ovest, nord, est):
+    """
+    Filtro sui FastFood nel riquadro: prima sulle celle geohash (intervalli
+    sull'indice della colonna geohash), poi sulle coordinate esatte.
+    """
+    if ovest > est:
+        # Il riquadro attraversa l'antimeridiano: due riquadri separati
+        return filtro_riquadro(sud, ovest, nord, 180.0) | filtro_riquadro(sud, -180.0, nord, est)
+    celle = Q()
+    for cella in celle_riquadro(sud, ovest, nord, est):
+        celle |= Q(geohash__gte=cella, geohash__lt=cella + '~')
+    return celle & Q(
+        latitudine__gte=sud, latitudine__lte=nord,
+        longitudine__gte=ovest, longitudine__lte=est,
+    )
+
+
+# Distanze --------------------------------------------------------------
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * RAGGIO_TERRA_KM * math.asin(math.sqrt(min(1.0, a)))
+
+
+def _cartesiano(lat, lng):
+    # Punto sulla sfera unitaria: la distanza euclidea (corda) cresce con
+    # quella sulla superficie, quindi il KD-tree trova i vicini corretti.
+    phi, lam = math.radians(lat), math.radians(lng)
+    return (math.cos(phi) * math.cos(lam), math.cos(phi) * math.sin(lam), math.sin(phi))
+
+
+def dati_fast_food(fast_food, distanza_km=None):
+    dati = {
+        'id': fast_food.id,
+        'name': fast_food.name,
+        'address': fast_food.address,
+        'lat': fast_food.latitudine,
+        'lng': fast_food.longitudine,
+    }
+    if distanza_km is not None:
+        dati['distanza_km'] = round(distanza_km, 3)
+    return dati
+
+
+# KD-tree ---------------------------------------------------------------
+
+class KDTree:
+    """KD-tree in tre dimensioni sui punti della sfera unitaria."""
+
+    def __init__(self, elementi):
+        # elementi: lista di (lat, lng, dato)
+        self.dimensione = len(elementi)
+        self.radice = self._costruisci(
+            [(_cartesiano(lat, lng), dato) for lat, lng, dato in elementi], 0
+        )
+
+    def _costruisci(self, punti, profondita):
+        if not punti:
+            return None
+        asse = profondita % 3
+        punti.sort(key=lambda punto: punto[0][asse])
+        mezzo = len(punti) // 2
+        punto, dato = punti[mezzo]
+        return (
+            punto, dato, asse,
+            self._costruisci(punti[:mezzo], profondita + 1),
+            self._costruisci(punti[mezzo + 1:], profondita + 1),
+        )
+
+    def piu_vicini(self, lat, lng, k):
+        bersaglio = _cartesiano(lat, lng)
+        migliori = []  # max-heap su -distanza^2
+        contatore = count()
+
+        def cerca(nodo):
+            if nodo is None:
+                return
+            punto, dato, asse, sinistra, destra = nodo
+            d2 = sum((a - b) ** 2 for a, b in zip(punto, bersaglio))
+            if len(migliori) < k:
+                heapq.heappush(migliori, (-d2, next(contatore), dato))
+            elif d2 < -migliori[0][0]:
+                heapq.heapreplace(migliori, (-d2, next(contatore), dato))
+            diff = bersaglio[asse] - punto[asse]
+            vicino, lontano = (sinistra, destra) if diff < 0 else (destra, sinistra)
+            cerca(vicino)
+            if len(migliori) < k or diff * diff < -migliori[0][0]:
+                cerca(lontano)
+
+        if k > 0:
+            cerca(self.radice)
+        return [dato for _, _, dato in sorted(migliori, key=lambda voce: (-voce[0], voce[1]))]
+
+
+_indice = {'versione': None, 'albero': None}
+_lock = threading.Lock()
+
+
+def versione_indice():
+    versione = cache.get(VERSIONE_KEY)
+    if versione is None:
+        cache.add(VERSIONE_KEY, time.time_ns(), None)
+        versione = cache.get(VERSIONE_KEY)
+    return versione
+
+
+def invalida_indice():
+    cache.set(VERSIONE_KEY, time.time_ns(), None)
+
+
+def indice_fast_food():
+    """KD-tree dei fast food, ricostruito quando la versione cambia."""
+    versione = versione_indice()
+    if _indice['versione'] != versione:
+        with _lock:
+            if _indice['versione'] != versione:
+                fast_foods = FastFood.objects.only('id', 'name', 'address', 'latitudine', 'longitudine')
+                _indice['albero'] = KDTree([
+                    (ff.latitudine, ff.longitudine, dati_fast_food(ff)) for ff in fast_foods
+                ])
+                _indice['versione'] = versione
+    return _indice['albero']
+
+
+def fast_food_vicini(lat, lng, k):
+    """I k fast food piu' vicini, ordinati per distanza (haversine)."""
+    return [
+        dict(dati, distanza_km=round(haversine_km(lat, lng, dati['lat'], dati['lng']), 3))
+        for dati in indice_fast_food().piu_vicini(lat, lng, k)
+    ]
+
+
+def _distanza_approssimata(lat, lng):
+    # Distanza equirettangolare al quadrato, in gradi: calcolabile in SQL e
+    # con lo stesso ordinamento dell'haversine a scala di una mappa
+    dlng = Abs(F('longitudine') - lng)
+    dlng = Least(dlng, Value(360.0) - dlng)  # Oltre l'antimeridiano
+    dlat = F('latitudine') - lat
+    scala = math.cos(math.radians(lat)) ** 2
+    return ExpressionWrapper(dlat * dlat + dlng * dlng * Value(scala), output_field=FloatField())
+
+
+def fast_food_nel_riquadro(sud, ovest, nord, est, limite):
+    """
+    Fast food nel riquadro, ordinati per distanza dal centro del riquadro.
+    Ordinamento e limite sono nella query: anche un riquadro grande quanto
+    il mondo legge al piu' limite righe.
+    """
+    centro_lat = (sud + nord) / 2
+    larghezza = est - ovest if ovest <= est else est + 360 - ovest
+    centro_lng = (ovest + larghezza / 2 + 180) % 360 - 180
+    fast_foods = (
+        FastFood.objects.filter(filtro_riquadro(sud, ovest, nord, est))
+        .only('id', 'name', 'address', 'latitudine', 'longitudine')
+        .annotate(distanza=_distanza_approssimata(centro_lat, centro_lng))
+        .order_by('distanza', 'id')[:limite]
+    )
+    risultati = [
+        dati_fast_food(ff, haversine_km(centro_lat, centro_lng, ff.latitudine, ff.longitudine))
+        for ff in fast_foods
+    ]
+    risultati.sort(key=lambda dati: (dati['distanza_km'], dati['id']))
+    return risultati
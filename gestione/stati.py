@@ -0,0 +1,78 @@
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Order
+from .vendite import registra_consegne
+
+# Ordini per transizione: resta sotto il limite di parametri per query di SQLite
+MAX_ORDINI_TRANSIZIONE = 500
+
+
+def stati_di_arrivo():
+    """Stati raggiungibili con almeno una transizione, nell'ordine di STATUS_CHOICES."""
+    arrivi = {
+        stato for flusso in Order.TRANSIZIONI.values() for successivi in flusso.values() for stato in successivi
+    }
+    return [(valore, etichetta) for valore, etichetta in Order.STATUS_CHOICES if valore in arrivi]
+
+
+def condizione_partenza(nuovo_stato):
+    """
+    Q degli ordini che possono passare a nuovo_stato: per ogni tipo di
+    ordine, gli stati da cui la macchina a stati lo consente.
+    """
+    condizione = Q(pk__in=[])
+    for tipo, flusso in Order.TRANSIZIONI.items():
+        partenze = [stato for stato, successivi in flusso.items() if nuovo_stato in successivi]
+        if partenze:
+            condizione |= Q(tipo_di_ordine=tipo, status__in=partenze)
+    return condizione
+
+
+def valida_transizione(order_ids, nuovo_stato):
+    """Id degli ordini senza duplicati; solleva ValueError se la richiesta non e' valida."""
+    if nuovo_stato not in dict(Order.STATUS_CHOICES):
+        raise ValueError(f"Stato non valido: {nuovo_stato!r}.")
+    if not isinstance(order_ids, (list, tuple)) or not order_ids:
+        raise ValueError("Nessun ordine selezionato.")
+    if len(order_ids) > MAX_ORDINI_TRANSIZIONE:
+        raise ValueError(f"Al massimo {MAX_ORDINI_TRANSIZIONE} ordini per volta.")
+    ids = []
+    for order_id in order_ids:
+        try:
+            order_id = int(order_id)
+        except (TypeError, ValueError):
+            raise ValueError(f"Id ordine non valido: {order_id!r}.")
+        if order_id not in ids:
+            ids.append(order_id)
+    return ids
+
+
+def cambia_stato(order_ids, nuovo_stato, fast_food_id=None):
+    """
+    Porta gli ordini a nuovo_stato con un solo UPDATE condizionato: sono
+    aggiornati solo quelli il cui stato attuale lo consente (per il loro
+    tipo di ordine). updated_at viene impostato esplicitamente, cosi' il
+    feed della cucina vede le modifiche; le consegne aggiornano il rollup
+    delle vendite. Con fast_food_id si toccano solo
+    gli ordini di quel fast food.
+    Restituisce (aggiornati, saltati), due liste di id.
+    """
+    ids = valida_transizione(order_ids, nuovo_stato)
+    ordini = Order.objects.filter(condizione_partenza(nuovo_stato), id__in=ids)
+    if fast_food_id is not None:
+        ordini = ordini.filter(fast_food_id=fast_food_id)
+    adesso = timezone.now()
+    with transaction.atomic():
+        numero = ordini.update(status=nuovo_stato, updated_at=adesso)
+        if numero == len(ids):
+            aggiornati = set(ids)
+        else:
+            # Nella stessa transazione: le righe con questo updated_at sono le nostre
+            aggiornati = set(
+                Order.objects.filter(id__in=ids, status=nuovo_stato, updated_at=adesso).values_list('id', flat=True)
+            ) if numero else set()
+        if aggiornati and nuovo_stato == 'CONSEGNATO':
+            registra_consegne(aggiornati)  # Rollup delle vendite nella stessa transazione
+    return [i for i in ids if i in aggiornati], [i for i in ids if i not in aggiornati]
@@ -0,0 +1,100 @@
+import gzip
+import mimetypes
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404
+from django.utils._os import safe_join
+from django.utils.http import http_date
+
+try:
+    import brotli
+except ImportError:  # Dipendenza opzionale: senza, solo gzip
+    brotli = None
+
+ESTENSIONI_COMPRIMIBILI = ('.css', '.js', '.json', '.svg', '.txt', '.html', '.map', '.xml')
+DIMENSIONE_MINIMA = 512  # Sotto questa soglia la compressione non conviene
+
+CACHE_IMMUTABILE = 'public, max-age=31536000, immutable'
+CACHE_BREVE = 'public, max-age=60, must-revalidate'
+
+
+class ManifestPrecompressoStorage(ManifestStaticFilesStorage):
+    """
+    Storage dei file statici con nomi contenenti l'hash del contenuto e,
+    a collectstatic, copie .gz (e .br se brotli e' installato) dei file
+    testuali, pronte per essere servite senza comprimere a ogni richiesta.
+    Senza manifest (sviluppo, test senza collectstatic) gli URL restano
+    quelli originali.
+    """
+
+    def stored_name(self, name):
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for nome in set(self.hashed_files.values()):
+            if nome.endswith(ESTENSIONI_COMPRIMIBILI):
+                self._comprimi(nome)
+
+    def _comprimi(self, nome):
+        percorso = self.path(nome)
+        with open(percorso, 'rb') as file:
+            contenuto = file.read()
+        if len(contenuto) < DIMENSIONE_MINIMA:
+            return
+        varianti = {'.gz': gzip.compress(contenuto, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            varianti['.br'] = brotli.compress(contenuto)
+        for estensione, compresso in varianti.items():
+            if len(compresso) < len(contenuto):
+                with open(percorso + estensione, 'wb') as file:
+                    file.write(compresso)
+
+
+def _codifiche_accettate(request):
+    accettate = {
+        voce.split(';')[0].strip()
+        for voce in request.headers.get('Accept-Encoding', '').split(',')
+    }
+    return [
+        (codifica, estensione)
+        for codifica, estensione in (('br', '.br'), ('gzip', '.gz'))
+        if codifica in accettate
+    ]
+
+
+def risposta_file_statico(request, percorso):
+    """
+    Serve un file di STATIC_ROOT scegliendo la variante precompressa
+    accettata dal client. I file con l'hash nel nome non cambiano mai:
+    il browser li tiene in cache per un anno senza rivalidarli.
+    """
+    try:
+        completo = safe_join(settings.STATIC_ROOT, percorso)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(completo):
+        raise Http404
+
+    tipo, _ = mimetypes.guess_type(completo)
+    servito, codifica = completo, None
+    for nome_codifica, estensione in _codifiche_accettate(request):
+        if os.path.isfile(completo + estensione):
+            servito, codifica = completo + estensione, nome_codifica
+            break
+
+    response = FileResponse(open(servito, 'rb'), content_type=tipo or 'application/octet-stream')
+    if codifica:
+        response['Content-Encoding'] = codifica
+    response['Vary'] = 'Accept-Encoding'
+    response['Last-Modified'] = http_date(os.path.getmtime(completo))
+    hashato = percorso in getattr(staticfiles_storage, 'hashed_files', {}).values()
+    response['Cache-Control'] = CACHE_IMMUTABILE if hashato else CACHE_BREVE
+    return response
@@ -0,0 +1,213 @@
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.db import connection
+from django.template.backends.django import DjangoTemplates
+
+logger = logging.getLogger('gestione.richieste_lente')
+
+# Limiti superiori (ms) dei bucket degli istogrammi; l'ultimo e' infinito
+BUCKET_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float('inf'))
+MAX_QUERY_REGISTRATE = 200  # Query conservate per il log delle richieste lente
+QUERY_NEL_LOG = 5
+
+_misura_corrente = ContextVar('misura_richiesta', default=None)
+
+
+@dataclass
+class Misura:
+    """Tempi di una singola richiesta."""
+    query: int = 0
+    sql_ms: float = 0.0
+    template_ms: float = 0.0
+    sql: list = field(default_factory=list)  # (ms, sql) delle prime query
+    _profondita_template: int = 0
+
+
+def _misura_sql(execute, sql, params, many, context):
+    misura = _misura_corrente.get()
+    inizio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        if misura is not None:
+            durata = (time.perf_counter() - inizio) * 1000
+            misura.query += 1
+            misura.sql_ms += durata
+            if len(misura.sql) < MAX_QUERY_REGISTRATE:
+                misura.sql.append((durata, sql))
+
+
+# Template ---------------------------------------------------------------
+
+class TemplateMisurato:
+    """Template che somma il proprio tempo di render alla richiesta in corso."""
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, nome):
+        return getattr(self.template, nome)
+
+    def render(self, context=None, request=None):
+        misura = _misura_corrente.get()
+        if misura is None:
+            return self.template.render(context, request)
+        # I render annidati (render_to_string dentro un render) si contano una volta
+        misura._profondita_template += 1
+        inizio = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            misura._profondita_template -= 1
+            if not misura._profondita_template:
+                misura.template_ms += (time.perf_counter() - inizio) * 1000
+
+
+class DjangoTemplatesMisurati(DjangoTemplates):
+    """Backend DjangoTemplates che misura il tempo di render dei template."""
+
+    def from_string(self, template_code):
+        return TemplateMisurato(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TemplateMisurato(super().get_template(template_name))
+
+
+# Istogrammi -------------------------------------------------------------
+
+class Istogrammi:
+    """
+    Istogrammi per rotta della durata delle richieste. Sono tenuti nel
+    processo: con piu' worker ogni processo riporta le proprie richieste.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.azzera()
+
+    def azzera(self):
+        with self._lock:
+            self._rotte = {}
+            self.dal = time.time()
+
+    def registra(self, rotta, totale_ms, misura, errore):
+        indice = bisect_left(BUCKET_MS, totale_ms)
+        with self._lock:
+            dati = self._rotte.get(rotta)
+            if dati is None:
+                dati = self._rotte[rotta] = {
+                    'richieste': 0, 'errori': 0, 'totale_ms': 0.0, 'sql_ms': 0.0,
+                    'template_ms': 0.0, 'query': 0, 'max_ms': 0.0, 'bucket': [0] * len(BUCKET_MS),
+                }
+            dati['richieste'] += 1
+            dati['errori'] += errore
+            dati['totale_ms'] += totale_ms
+            dati['sql_ms'] += misura.sql_ms
+            dati['template_ms'] += misura.template_ms
+            dati['query'] += misura.query
+            dati['max_ms'] = max(dati['max_ms'], totale_ms)
+            dati['bucket'][indice] += 1
+
+    @staticmethod
+    def _percentile(bucket, richieste, p):
+        # Limite superiore del bucket che contiene il percentile
+        soglia = richieste * p / 100
+        cumulato = 0
+        for limite, n in zip(BUCKET_MS, bucket):
+            cumulato += n
+            if cumulato >= soglia:
+                return limite
+        return BUCKET_MS[-1]
+
+    def riepilogo(self):
+        with self._lock:
+            rotte = {rotta: dict(dati, bucket=list(dati['bucket'])) for rotta, dati in self._rotte.items()}
+        risultato = {}
+        for rotta, dati in sorted(rotte.items()):
+            n = dati['richieste']
+            risultato[rotta] = {
+                'richieste': n,
+                'errori': dati['errori'],
+                'media_ms': round(dati['totale_ms'] / n, 2),
+                'max_ms': round(dati['max_ms'], 2),
+                'sql_media_ms': round(dati['sql_ms'] / n, 2),
+                'template_media_ms': round(dati['template_ms'] / n, 2),
+                'query_media': round(dati['query'] / n, 2),
+                **{
+                    f'p{p}_ms': self._percentile(dati['bucket'], n, p)
+                    for p in (50, 95, 99)
+                },
+                'istogramma': {
+                    ('+inf' if limite == float('inf') else f'<={limite}'): conteggio
+                    for limite, conteggio in zip(BUCKET_MS, dati['bucket'])
+                },
+            }
+        return {'pid': os.getpid(), 'dal': self.dal, 'rotte': risultato}
+
+
+istogrammi = Istogrammi()
+
+
+# Middleware -------------------------------------------------------------
+
+def _server_timing(totale_ms, misura):
+    return (
+        f'total;dur={totale_ms:.1f}, '
+        f'sql;dur={misura.sql_ms:.1f};desc="{misura.query} query", '
+        f'tpl;dur={misura.template_ms:.1f}'
+    )
+
+
+def _log_richiesta_lenta(request, rotta, totale_ms, misura, status):
+    lente = sorted(misura.sql, key=lambda voce: voce[0], reverse=True)[:QUERY_NEL_LOG]
+    ripetute = {}
+    for _, sql in misura.sql:
+        ripetute[sql] = ripetute.get(sql, 0) + 1
+    ripetute = sorted(((n, sql) for sql, n in ripetute.items() if n > 1), reverse=True)[:QUERY_NEL_LOG]
+    righe = [
+        f"{request.method} {request.path} ({rotta}) {status}: {totale_ms:.1f}ms, "
+        f"sql {misura.sql_ms:.1f}ms in {misura.query} query, template {misura.template_ms:.1f}ms"
+    ]
+    righe += [f"  {durata:.1f}ms {sql}" for durata, sql in lente]
+    righe += [f"  ripetuta {n} volte: {sql}" for n, sql in ripetute]
+    logger.warning("\n".join(righe))
+
+
+class StrumentazioneMiddleware:
+    """
+    Misura ogni richiesta: tempo totale, numero e tempo delle query SQL,
+    tempo di render dei template. Aggiunge l'header Server-Timing, scrive
+    nel log 'gestione.richieste_lente' le richieste oltre
+    RICHIESTA_LENTA_MS con le query responsabili e aggiorna gli istogrammi
+    per rotta. Per le risposte in streaming misura la vista, non il corpo.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        misura = Misura()
+        token = _misura_corrente.set(misura)
+        inizio = time.perf_counter()
+        try:
+            with connection.execute_wrapper(_misura_sql):
+                response = self.get_response(request)
+        finally:
+            _misura_corrente.reset(token)
+        totale_ms = (time.perf_counter() - inizio) * 1000
+
+        match = request.resolver_match
+        rotta = match.view_name if match else '<404>'
+        istogrammi.registra(rotta, totale_ms, misura, response.status_code >= 500)
+        if settings.STRUMENTAZIONE_SERVER_TIMING:
+            response['Server-Timing'] = _server_timing(totale_ms, misura)
+        if totale_ms >= settings.RICHIESTA_LENTA_MS:
+            _log_richiesta_lenta(request, rotta, totale_ms, misura, response.status_code)
+        return response
@@ -0,0 +1,34 @@
+from django import template
+from django.conf import settings
+from django.templatetags.static import static
+from django.utils.html import format_html
+
+from gestione import immagini
+
+register = template.Library()
+
+
+@register.simple_tag
+def immagine_prodotto(product, sizes='250px'):
+    """
+    <picture> con le varianti WebP e PNG ridimensionate del prodotto: il
+    browser sceglie la larghezza adatta allo schermo tramite srcset.
+    """
+    if not product.image_name or immagini.sorgente(product) is None:
+        return ''
+    if not immagini.disponibile():
+        # Senza Pillow: l'immagine originale
+        return format_html(
+            '<img src="{}" alt="{}" loading="lazy" class="immagine-prodotto">',
+            static(product.image_name), product.name,
+        )
+    predefinita = settings.IMMAGINI_LARGHEZZE[len(settings.IMMAGINI_LARGHEZZE) // 2]
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" alt="{}" loading="lazy" decoding="async" class="immagine-prodotto">'
+        '</picture>',
+        immagini.srcset(product, 'webp'), sizes,
+        immagini.url_variante(product, predefinita, 'png'), immagini.srcset(product, 'png'), sizes,
+        product.name,
+    )
@@ -1,6 +1,32 @@
-from django.test import TestCase, Client  # Importa TestCase per i test e Client per simulare richieste HTTP
-from django.contrib.auth import get_user_model  # Importa la funzione per ottenere il modello utente personalizzato
-from .models import FastFood, Coupon  # Importa i modelli FastFood e Coupon
+from asgiref.sync import sync_to_async
+from django.test import TestCase, TransactionTestCase, Client, AsyncClient, override_settings  # Importa TestCase per i test e Client per simulare richieste HTTP
+from django.contrib.auth import get_user_model, hashers  # Importa la funzione per ottenere il modello utente personalizzato
+import hashlib
+import json
+import random
+from datetime import datetime, timedelta, timezone as dt_timezone
+from importlib import import_module
+from unittest import mock, skipUnless
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+import os
+import tempfile
+import threading
+from django.utils import timezone
+from io import BytesIO, StringIO
+from django.conf import settings
+from django.core.cache import cache
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import CommandError, call_command
+from decimal import Decimal
+from .models import FastFood, Coupon, Product, Cart, CartItem, Order, OrderLine, QueuedOrder, ArchivedOrder, SalesRollup  # Importa i modelli usati nei test
+from . import benchmark, catalogo, coda, coupon, immagini, ricerca, spaziale, strumentazione, vendite
+from .prezzi import prezzo_carrello
+from .benchmark import conta_query
+from .carrello import aggiungi_prodotto, rimuovi_riga
+from .ordini import crea_ordine
+from .stati import cambia_stato
+from .paginazione import codifica_cursore, filtra_keyset, pagina_keyset
 
 User = get_user_model()  # Ottiene il modello utente personalizzato (User)
 
@@ -109,4 +135,1736 @@ class SiteTests(TestCase):
         codes = Coupon.objects.values_list('code', flat=True)
         self.assertEqual(len(codes), len(set(codes)))  # Verifica che non ci siano duplicati
 
-   
\ No newline at end of file
+
+class CatalogoTests(TestCase):
+    """
+    Test della cache versionata del catalogo prodotti.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='catalogo', password='testpass')
+        self.client.force_login(self.user)
+        self.product = Product.objects.create(name='Big', price='5.50')
+
+    def test_seconda_richiesta_senza_query_sui_prodotti(self):
+        """
+        Dopo il primo accesso la griglia arriva dalla cache: nessuna query su Product.
+        """
+        self.client.get('/prodotti/')
+        with self.assertNumQueries(0):
+            html = catalogo.griglia_catalogo()
+        self.assertIn('Big', html)
+        self.assertGreaterEqual(catalogo.statistiche_catalogo()['hit'], 1)
+
+    def test_invalidazione_su_salvataggio_e_cancellazione(self):
+        """
+        Salvare o cancellare un prodotto cambia la versione e quindi la griglia.
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            versione = catalogo.versione_catalogo()
+            self.product.name = 'Big Mac'
+            self.product.save()
+        self.assertNotEqual(versione, catalogo.versione_catalogo())
+        self.assertIn('Big Mac', self.client.get('/prodotti/').content.decode())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.delete()
+        self.assertNotIn('Big Mac', self.client.get('/prodotti/').content.decode())
+
+    def test_comando_warm_catalog(self):
+        """
+        Il comando di warm-up popola la cache: la richiesta successiva e' un hit.
+        """
+        call_command('warm_catalog', stdout=StringIO())
+        miss = catalogo.statistiche_catalogo()['miss']
+        self.client.get('/prodotti/')
+        self.assertEqual(catalogo.statistiche_catalogo()['miss'], miss)
+
+
+class PrezziCarrelloTests(TestCase):
+    """
+    Test del motore prezzi condiviso da carrello e ordini.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='prezzi', password='testpass')
+        self.cart = Cart.objects.get(user=self.user)  # Creato dal segnale post_save
+        self.products = [
+            Product.objects.create(name=f'Prodotto {i}', price=Decimal('2.35') + i)
+            for i in range(10)
+        ]
+
+    def _riempi(self, n):
+        for i, product in enumerate(self.products[:n]):
+            CartItem.objects.create(cart=self.cart, product=product, quantity=i + 1)
+
+    def test_numero_query_costante(self):
+        """
+        Il calcolo usa sempre una sola query, indipendentemente dal numero di righe.
+        """
+        for n in (1, 10):
+            CartItem.objects.filter(cart=self.cart).delete()
+            self._riempi(n)
+            cart = Cart.objects.select_related('coupon').get(pk=self.cart.pk)
+            with self.assertNumQueries(1):
+                prezzo = prezzo_carrello(cart)
+                [item.product.name for item in prezzo.items]
+            self.assertEqual(len(prezzo.items), n)
+
+    def test_subtotale_sconto_totale(self):
+        """
+        Lo sconto del coupon viene applicato al subtotale e arrotondato al centesimo.
+        """
+        self._riempi(2)  # 1 x 2.35 + 2 x 3.35 = 9.05
+        self.cart.coupon = Coupon.objects.create(code='SCONTO7', discount=7, description='7%')
+        self.cart.save()
+        prezzo = prezzo_carrello(self.cart)
+        self.assertEqual(prezzo.subtotale, Decimal('9.05'))
+        self.assertEqual(prezzo.sconto, Decimal('0.63'))
+        self.assertEqual(prezzo.totale, Decimal('8.42'))
+
+    def test_create_order_usa_il_totale_scontato(self):
+        """
+        L'ordine creato dal checkout salva il totale calcolato dal motore prezzi.
+        """
+        self._riempi(2)
+        self.cart.coupon = Coupon.objects.create(code='SCONTO10', discount=10, description='10%')
+        self.cart.save()
+        client = Client()
+        client.force_login(self.user)
+        client.post('/create_order/', {'order_type': 'delivery', 'address': 'Via Emilia 1', 'city': 'Modena'})
+        order = Order.objects.get(user=self.user)
+        self.assertEqual(order.total_price, Decimal('8.14'))
+        self.assertEqual(order.items, '1x Prodotto 0, 2x Prodotto 1')
+
+
+class OrderLineTests(TestCase):
+    """
+    Test delle righe d'ordine strutturate.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='righe', password='testpass')
+        self.big = Product.objects.create(name='Big', price='5.00')
+        self.fries = Product.objects.create(name='Fries', price='2.50')
+        cart = Cart.objects.get(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.big, quantity=2)
+        CartItem.objects.create(cart=cart, product=self.fries, quantity=1)
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def test_create_order_scrive_le_righe(self):
+        """
+        Il checkout salva una riga per prodotto con il prezzo unitario del momento.
+        """
+        self.client.post('/create_order/', {'order_type': 'delivery', 'address': 'Via Emilia 1', 'city': 'Modena'})
+        order = Order.objects.get(user=self.user)
+        lines = list(order.lines.order_by('id').values_list('product_id', 'product_name', 'quantity', 'unit_price'))
+        self.assertEqual(lines, [
+            (self.big.id, 'Big', 2, Decimal('5.00')),
+            (self.fries.id, 'Fries', 1, Decimal('2.50')),
+        ])
+        self.assertEqual(order.items, '2x Big, 1x Fries')
+        self.assertFalse(CartItem.objects.filter(cart__user=self.user).exists())
+
+    def test_parsing_del_testo_items(self):
+        """
+        La migrazione di backfill interpreta il vecchio formato di Order.items.
+        """
+        migrazione = import_module('gestione.migrations.0019_backfill_orderline')
+        self.assertEqual(migrazione.parse_items('2x Big, 1x Fries'), [(2, 'Big'), (1, 'Fries')])
+        self.assertEqual(migrazione.parse_items(''), [])
+
+
+@override_settings(FEED_ORDINI_INTERVALLO=0, FEED_ORDINI_LONG_POLL=0, FEED_ORDINI_DURATA_SSE=0.05, FEED_ORDINI_ASSESTAMENTO=0)
+class FeedOrdiniTests(TestCase):
+    """
+    Test del feed live degli ordini per la cucina.
+    """
+
+    def setUp(self):
+        self.staff = User.objects.create_user(username='cucina', password='testpass', is_ristoratore=True)
+        self.cliente = User.objects.create_user(username='cliente', password='testpass')
+        self.fast_food = FastFood.objects.create(name='McTest', address='Via Test 1', latitudine=45.0, longitudine=9.0)
+        self.client = Client()
+        self.client.force_login(self.staff)
+
+    def _ordine(self, tipo='in_loco'):
+        return Order.objects.create(
+            user=self.cliente, total_price='5.00', items='1x Big',
+            tipo_di_ordine=tipo, fast_food=self.fast_food,
+        )
+
+    def _poll(self, cursore):
+        return self.client.get('/gestione_ordine/feed/poll/', {
+            'fast_food': self.fast_food.id, 'cursore': cursore,
+        }).json()
+
+    def test_poll_restituisce_solo_le_modifiche(self):
+        """
+        Il long-poll restituisce solo gli ordini nuovi o modificati dopo il cursore.
+        """
+        vecchio = self._ordine()
+        cursore = self.client.get('/gestione_ordine/', {'fast_food': self.fast_food.id}).context['feed_cursore']
+        self.assertEqual(self._poll(cursore)['ordini'], [])
+
+        nuovo = self._ordine('delivery')
+        dati = self._poll(cursore)
+        self.assertEqual([o['id'] for o in dati['ordini']], [nuovo.id])
+        self.assertEqual(dati['ordini'][0]['tipo'], 'delivery')
+        self.assertIn(f'id="ordine-{nuovo.id}"', dati['ordini'][0]['html'])
+
+        vecchio.status = 'IN PREPARAZIONE'
+        vecchio.save()
+        dati = self._poll(dati['cursore'])
+        self.assertEqual([o['id'] for o in dati['ordini']], [vecchio.id])
+        self.assertIn('IN PREPARAZIONE', dati['ordini'][0]['html'])
+
+    def test_modifiche_recenti_attendono_l_assestamento(self):
+        """
+        Un ordine appena salvato arriva dal feed solo dopo FEED_ORDINI_ASSESTAMENTO secondi.
+        """
+        cursore = codifica_cursore(timezone.now() - timedelta(minutes=5), 0)
+        ordine = self._ordine()
+        with self.settings(FEED_ORDINI_ASSESTAMENTO=60, FEED_ORDINI_LONG_POLL=0):
+            self.assertEqual(self._poll(cursore)['ordini'], [])
+        Order.objects.filter(id=ordine.id).update(updated_at=timezone.now() - timedelta(seconds=61))
+        with self.settings(FEED_ORDINI_ASSESTAMENTO=60):
+            self.assertEqual([o['id'] for o in self._poll(cursore)['ordini']], [ordine.id])
+
+    def test_poll_richiede_login(self):
+        """
+        Il feed non e' accessibile agli utenti anonimi.
+        """
+        response = Client().get('/gestione_ordine/feed/poll/', {'fast_food': self.fast_food.id})
+        self.assertEqual(response.status_code, 302)
+
+    def test_feed_riservato_ai_ristoratori(self):
+        """
+        Un cliente non vede il feed di un fast food; un id non valido da' 400 o 404.
+        """
+        cliente = Client()
+        cliente.force_login(self.cliente)
+        response = cliente.get('/gestione_ordine/feed/poll/', {'fast_food': self.fast_food.id})
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get('/gestione_ordine/feed/poll/', {'fast_food': 'abc'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/gestione_ordine/feed/poll/')
+        self.assertEqual(response.status_code, 404)
+
+    async def test_stream_riservato_ai_ristoratori(self):
+        """
+        Lo stream SSE risponde 403 ai clienti e 400 a un fast food non numerico.
+        """
+        client = AsyncClient()
+        await client.aforce_login(self.cliente)
+        response = await client.get('/gestione_ordine/feed/', {'fast_food': self.fast_food.id})
+        self.assertEqual(response.status_code, 403)
+        await client.aforce_login(self.staff)
+        response = await client.get('/gestione_ordine/feed/', {'fast_food': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+    async def test_stream_sse(self):
+        """
+        Lo stream SSE invia gli ordini successivi al cursore come evento 'ordini'.
+        """
+        ordine = await sync_to_async(self._ordine)()
+        client = AsyncClient()
+        await client.aforce_login(self.staff)
+        response = await client.get('/gestione_ordine/feed/', {
+            'fast_food': self.fast_food.id,
+            'cursore': codifica_cursore(ordine.updated_at, ordine.id - 1),
+        })
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        corpo = b''.join([parte async for parte in response.streaming_content]).decode()
+        self.assertIn('event: ordini', corpo)
+        self.assertIn(f'ordine-{ordine.id}', corpo)
+
+
+@override_settings(ORDINI_PER_PAGINA=2)
+class PaginazioneOrdiniTests(TestCase):
+    """
+    Test della paginazione keyset di orders e gestione_ordine.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='storico', password='testpass')
+        self.fast_food = FastFood.objects.create(name='McTest', address='Via Test 1', latitudine=45.0, longitudine=9.0)
+        self.ordini = [
+            Order.objects.create(
+                user=self.user, total_price='5.00', items=f'{i}x Big', fast_food=self.fast_food,
+                tipo_di_ordine='in_loco' if i % 2 else 'delivery',
+                status='CONSEGNATO' if i < 3 else 'ORDINE RICEVUTO',
+            )
+            for i in range(5)
+        ]
+        # Stesso istante per tutti: la paginazione deve reggersi sull'id
+        Order.objects.update(created_at=self.ordini[0].created_at)
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def test_pagine_dello_storico_ordini(self):
+        """
+        Le pagine di orders non si sovrappongono e coprono tutti gli ordini.
+        """
+        visti = []
+        url = '/orders/'
+        while url:
+            response = self.client.get(url if url.startswith('/') else '/orders/' + url)
+            visti += [order.id for order in response.context['orders']]
+            url = response.context['pagina_successiva']
+        self.assertEqual(visti, [order.id for order in reversed(self.ordini)])
+
+    def test_gestione_ordine_divide_per_tipo_e_stato(self):
+        """
+        In loco e delivery arrivano da query separate, con il filtro sullo stato.
+        """
+        response = self.client.get('/gestione_ordine/', {'fast_food': self.fast_food.id})
+        self.assertEqual([o.id for o in response.context['ordini_in_loco']], [self.ordini[3].id, self.ordini[1].id])
+        self.assertEqual([o.id for o in response.context['ordini_delivery']], [self.ordini[4].id, self.ordini[2].id])
+        self.assertIsNotNone(response.context['pagina_delivery'])
+        self.assertIsNone(response.context['pagina_in_loco'])
+
+        response = self.client.get('/gestione_ordine/', {'fast_food': self.fast_food.id, 'status': 'CONSEGNATO'})
+        self.assertEqual([o.id for o in response.context['ordini_in_loco']], [self.ordini[1].id])
+        self.assertEqual([o.id for o in response.context['ordini_delivery']], [self.ordini[2].id, self.ordini[0].id])
+
+    def test_pagina_keyset(self):
+        """
+        Il cursore riparte esattamente dopo l'ultima riga della pagina precedente.
+        """
+        prima, cursore = pagina_keyset(Order.objects.all(), None, 3)
+        seconda, fine = pagina_keyset(Order.objects.all(), cursore, 3)
+        self.assertEqual([o.id for o in prima + seconda], [o.id for o in reversed(self.ordini)])
+        self.assertIsNone(fine)
+
+
+@skipUnless(connection.vendor == 'sqlite', "EXPLAIN QUERY PLAN e' specifico di SQLite")
+class PianiQueryTests(TestCase):
+    """
+    Regressione sui piani delle query calde: nessuna scansione completa e
+    nessun ordinamento su B-tree temporaneo.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='piani', password='testpass')
+        self.fast_food = FastFood.objects.create(name='McTest', address='Via Test 1', latitudine=45.0, longitudine=9.0)
+        self.cart = Cart.objects.get(user=self.user)
+        cursore = codifica_cursore(timezone.now(), 10)
+        self.query_calde = {
+            'storico cliente': Order.objects.filter(user=self.user).order_by('-created_at', '-id'),
+            'storico cliente, pagina successiva': filtra_keyset(Order.objects.filter(user=self.user), cursore),
+            'ordini del fast food': Order.objects.filter(fast_food=self.fast_food).order_by('-created_at', '-id'),
+            'ordini del fast food per tipo': Order.objects.filter(
+                fast_food=self.fast_food, tipo_di_ordine='delivery').order_by('-created_at', '-id'),
+            'ordini del fast food per tipo e stato': Order.objects.filter(
+                fast_food=self.fast_food, tipo_di_ordine='in_loco', status='CONSEGNATO').order_by('-created_at', '-id'),
+            'feed della cucina': Order.objects.filter(fast_food=self.fast_food).order_by('updated_at', 'id'),
+            'checkout scartati': QueuedOrder.objects.filter(
+                user=self.user, stato=QueuedOrder.SCARTATO, updated_at__gte=timezone.now()).order_by('-updated_at'),
+            'coupon attivi': Coupon.objects.filter(user=self.user, is_active=True),
+            'coupon validi': coupon.coupon_validi(self.user),
+            'coupon scaduti da disattivare': Coupon.objects.filter(is_active=True, expires_at__lt=timezone.now()),
+            'righe del carrello': CartItem.objects.filter(cart=self.cart).select_related('product').order_by('id'),
+        }
+
+    def _piano(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [riga[-1] for riga in cursor.fetchall()]
+
+    def test_nessuna_scansione_completa(self):
+        """
+        Ogni query calda usa un indice (SEARCH) invece di leggere tutta la tabella.
+        """
+        for nome, queryset in self.query_calde.items():
+            with self.subTest(nome):
+                piano = self._piano(queryset)
+                self.assertFalse([r for r in piano if r.startswith('SCAN')], piano)
+                self.assertFalse([r for r in piano if 'TEMP B-TREE' in r], piano)
+
+    def test_pagina_successiva_parte_dal_cursore(self):
+        """
+        La pagina successiva cerca nell'indice a partire dal cursore.
+        """
+        piano = self._piano(self.query_calde['storico cliente, pagina successiva'])
+        self.assertIn('order_user_created_idx (user_id=? AND created_at<?)', piano[0])
+
+
+class CouponMintingTests(TestCase):
+    """
+    Test della creazione massiva dei coupon.
+    """
+
+    def test_registrazione_crea_cinque_coupon_con_un_inserimento(self):
+        """
+        Il segnale di creazione utente usa un solo bulk_create per i 5 coupon.
+        """
+        user = User.objects.create_user(username='nuovo', password='testpass')
+        coupons = Coupon.objects.filter(user=user)
+        self.assertEqual(coupons.count(), 5)
+        self.assertTrue(all(5 <= c.discount <= 12 for c in coupons))
+
+    def test_collisioni_con_codici_esistenti(self):
+        """
+        Un codice gia' presente viene scartato e rigenerato invece di fallire.
+        """
+        Coupon.objects.create(code='DOPPIONE00', discount=5, description='Esistente')
+        codici = iter(['DOPPIONE00', 'NUOVO00001'])
+        with mock.patch.object(coupon, 'genera_codice', lambda: next(codici)):
+            self.assertEqual(coupon.codici_unici(1), ['NUOVO00001'])
+
+    def test_controllo_codici_a_blocchi(self):
+        """
+        I candidati vengono controllati a blocchi di BATCH_SIZE, mai in un'unica IN.
+        """
+        with CaptureQueriesContext(connection) as query:
+            codici = coupon.codici_unici(coupon.BATCH_SIZE * 2 + 1)
+        self.assertEqual(len(set(codici)), coupon.BATCH_SIZE * 2 + 1)
+        self.assertEqual(len(query.captured_queries), 3)
+        with self.assertRaises(CommandError):
+            call_command('mint_coupons', '--chunk-size=5001')
+
+    def test_comando_mint_coupons(self):
+        """
+        Il comando crea i coupon della campagna per tutti i clienti, a blocchi.
+        """
+        for i in range(5):
+            User.objects.create_user(username=f'cliente{i}', password='testpass')
+        User.objects.create_user(username='cuoco', password='testpass', is_ristoratore=True)
+        prima = Coupon.objects.count()
+        out = StringIO()
+        call_command('mint_coupons', '--per-user=3', '--chunk-size=2', '--description=Campagna', stdout=out)
+        self.assertEqual(Coupon.objects.count() - prima, 15)
+        self.assertEqual(Coupon.objects.filter(description='Campagna', user__is_ristoratore=True).count(), 0)
+        self.assertIn('coupon/s', out.getvalue())
+
+
+class RegistrazioneTests(TestCase):
+    """
+    Test del percorso veloce di registrazione.
+    """
+
+    def test_un_solo_hash_e_login_diretto(self):
+        """
+        La registrazione calcola l'hash una volta sola e logga subito l'utente.
+        """
+        with mock.patch.object(hashers.PBKDF2PasswordHasher, 'encode', autospec=True,
+                               side_effect=hashers.PBKDF2PasswordHasher.encode) as encode:
+            response = self.client.post('/register/', {'username': 'veloce', 'password': 'Veloce-123'})
+        self.assertEqual(encode.call_count, 1)
+        self.assertRedirects(response, '/')
+        user = User.objects.get(username='veloce')
+        self.assertEqual(int(self.client.session['_auth_user_id']), user.id)
+        self.assertTrue(user.check_password('Veloce-123'))
+        self.assertEqual(Cart.objects.filter(user=user).count(), 1)
+        self.assertEqual(Coupon.objects.filter(user=user).count(), 5)
+
+    def test_nome_utente_gia_usato(self):
+        """
+        Un nome utente duplicato mostra un errore senza lasciare dati a meta'.
+        """
+        User.objects.create_user(username='doppio', password='testpass')
+        coupon_prima = Coupon.objects.count()
+        response = self.client.post('/register/', {'username': 'doppio', 'password': 'Altra-123'})
+        self.assertContains(response, 'Nome utente già in uso.')
+        self.assertEqual(Coupon.objects.count(), coupon_prima)
+
+
+class ExportOrdiniTests(TestCase):
+    """
+    Test dell'export in streaming degli ordini.
+    """
+
+    def setUp(self):
+        self.gestore = User.objects.create_user(username='gestore', password='testpass', is_ristoratore=True)
+        self.cliente = User.objects.create_user(username='cliente', password='testpass')
+        self.fast_food = FastFood.objects.create(name='McTest', address='Via Test 1', latitudine=45.0, longitudine=9.0)
+        self.altro = FastFood.objects.create(name='McAltro', address='Via Altra 2', latitudine=44.6, longitudine=10.9)
+        self.inverno = self._ordine(self.fast_food, datetime(2026, 1, 15, 11, 30, tzinfo=dt_timezone.utc))
+        self.estate = self._ordine(self.fast_food, datetime(2026, 7, 15, 22, 30, tzinfo=dt_timezone.utc))
+        self._ordine(self.altro, datetime(2026, 7, 15, 12, 0, tzinfo=dt_timezone.utc))
+        self.client = Client()
+
+    def _ordine(self, fast_food, istante):
+        order = Order.objects.create(
+            user=self.cliente, total_price='7.50', items='1x Big', tipo_di_ordine='in_loco', fast_food=fast_food,
+        )
+        Order.objects.filter(pk=order.pk).update(created_at=istante)
+        return order
+
+    def _contenuto(self, response):
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_per_fast_food_e_periodo(self):
+        """
+        Il CSV contiene solo gli ordini del fast food e del periodo, in ora locale.
+        """
+        self.client.force_login(self.gestore)
+        response = self.client.get('/gestione_ordine/export/', {
+            'fast_food': self.fast_food.id, 'dal': '2026-01-01', 'al': '2026-07-15',
+        })
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        righe = self._contenuto(response).splitlines()
+        self.assertEqual(righe[0].split(',')[:2], ['id', 'created_at'])
+        # L'ordine delle 22:30 UTC del 15 luglio e' gia' il 16 a Roma: resta fuori
+        self.assertEqual(len(righe), 2)
+        self.assertTrue(righe[1].startswith(f'{self.inverno.id},2026-01-15T12:30:00+01:00,cliente,McTest'))
+
+    def test_ndjson_del_cliente(self):
+        """
+        Il cliente esporta solo i propri ordini, con l'ora legale applicata.
+        """
+        self.client.force_login(self.cliente)
+        response = self.client.get('/orders/export/', {'formato': 'ndjson', 'dal': '2026-07-16'})
+        ordini = [json.loads(riga) for riga in self._contenuto(response).splitlines()]
+        self.assertEqual([o['id'] for o in ordini], [self.estate.id])
+        self.assertEqual(ordini[0]['created_at'], '2026-07-16T00:30:00+02:00')
+        self.assertEqual(ordini[0]['total_price'], '7.50')
+
+    def test_export_gestori_vietato_ai_clienti(self):
+        """
+        L'export di tutti gli ordini e' riservato a ristoratori e staff.
+        """
+        self.client.force_login(self.cliente)
+        self.assertEqual(self.client.get('/gestione_ordine/export/').status_code, 403)
+        self.assertEqual(self.client.get('/orders/export/', {'formato': 'xml'}).status_code, 400)
+
+    def test_fast_food_non_valido(self):
+        """
+        Un id di fast food non numerico restituisce 400 invece di un errore del server.
+        """
+        self.client.force_login(self.gestore)
+        response = self.client.get('/gestione_ordine/export/', {'fast_food': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_comando_export_orders(self):
+        """
+        Il comando scrive lo stesso formato dell'endpoint.
+        """
+        out = StringIO()
+        call_command('export_orders', '--format=ndjson', f'--fast-food={self.altro.id}', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 1)
+
+
+class FastFoodVicinoTests(TestCase):
+    """
+    Test dell'indice spaziale dei fast food.
+    """
+
+    def setUp(self):
+        cache.clear()  # Forza la ricostruzione del KD-tree
+        self.modena = FastFood.objects.create(name='McModena', address='Via Emilia 1', latitudine=44.6471, longitudine=10.9252)
+        self.bologna = FastFood.objects.create(name='McBologna', address='Via Rizzoli 1', latitudine=44.4938, longitudine=11.3426)
+        self.milano = FastFood.objects.create(name='McMilano', address='Piazza Duomo 1', latitudine=45.4642, longitudine=9.1900)
+        self.fiji = FastFood.objects.create(name='McFiji', address='Suva', latitudine=-18.1, longitudine=179.9)
+
+    def test_geohash(self):
+        """
+        Il geohash segue la codifica standard e viene salvato con il fast food.
+        """
+        self.assertEqual(spaziale.geohash(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertEqual(self.modena.geohash, spaziale.geohash(44.6471, 10.9252))
+
+    def test_kdtree_come_ricerca_esaustiva(self):
+        """
+        Il KD-tree restituisce gli stessi vicini di un confronto su tutti i punti.
+        """
+        generatore = random.Random(42)
+        punti = [(generatore.uniform(-80, 80), generatore.uniform(-180, 180), i) for i in range(500)]
+        albero = spaziale.KDTree(punti)
+        for _ in range(20):
+            lat, lng = generatore.uniform(-80, 80), generatore.uniform(-180, 180)
+            attesi = sorted(punti, key=lambda p: spaziale.haversine_km(lat, lng, p[0], p[1]))[:5]
+            self.assertEqual(albero.piu_vicini(lat, lng, 5), [p[2] for p in attesi])
+
+    def test_api_nearby(self):
+        """
+        L'API restituisce i k fast food piu' vicini ordinati per distanza.
+        """
+        dati = self.client.get('/api/fastfood/nearby', {'lat': 44.70, 'lng': 10.63, 'k': 2}).json()
+        self.assertEqual([f['name'] for f in dati['fast_food']], ['McModena', 'McBologna'])
+        self.assertLess(dati['fast_food'][0]['distanza_km'], dati['fast_food'][1]['distanza_km'])
+        self.assertEqual(self.client.get('/api/fastfood/nearby', {'lat': 100, 'lng': 0}).status_code, 400)
+
+    @override_settings(CHECKOUT_FAST_FOOD=1)
+    def test_carrello_propone_tutti_i_fast_food(self):
+        """
+        Senza geolocalizzazione il carrello offre tutti i fast food, non solo i piu' vicini al centro mappa.
+        """
+        self.client.force_login(User.objects.create_user(username='cliente', password='testpass'))
+        response = self.client.get('/cart/')
+        self.assertEqual(
+            [f.name for f in response.context['fast_foods']], ['McBologna', 'McFiji', 'McMilano', 'McModena'],
+        )
+        self.assertEqual(response.context['nearby']['k'], 1)
+
+    def test_api_bbox(self):
+        """
+        Il riquadro restituisce solo i fast food visibili, anche oltre l'antimeridiano.
+        """
+        dati = self.client.get('/api/fastfood/bbox', {'bbox': '10.0,44.0,12.0,45.0'}).json()
+        self.assertEqual({f['name'] for f in dati['fast_food']}, {'McModena', 'McBologna'})
+        dati = self.client.get('/api/fastfood/bbox', {'bbox': '179.0,-19.0,-179.0,-17.0'}).json()
+        self.assertEqual([f['name'] for f in dati['fast_food']], ['McFiji'])
+        self.assertEqual(self.client.get('/api/fastfood/bbox', {'bbox': '1,2,3'}).status_code, 400)
+
+    def test_bbox_limitato_nella_query(self):
+        """
+        Con un riquadro grande quanto il mondo la query legge solo i k fast food piu' vicini al centro.
+        """
+        with CaptureQueriesContext(connection) as query:
+            dati = self.client.get('/api/fastfood/bbox', {'bbox': '-180,-90,180,90', 'k': 2}).json()
+        self.assertIn('LIMIT 2', query.captured_queries[-1]['sql'])
+        self.assertEqual(len(dati['fast_food']), 2)
+        dati = self.client.get('/api/fastfood/bbox', {'bbox': '5.0,40.0,17.0,49.0', 'k': 2}).json()
+        self.assertEqual([f['name'] for f in dati['fast_food']], ['McModena', 'McBologna'])
+        dati = self.client.get('/api/fastfood/bbox', {'bbox': '170.0,-30.0,-170.0,0.0', 'k': 1}).json()
+        self.assertEqual([f['name'] for f in dati['fast_food']], ['McFiji'])
+
+    def test_indice_ricostruito_dopo_le_modifiche(self):
+        """
+        Dopo il commit di una modifica il KD-tree viene ricostruito.
+        """
+        self.assertEqual(spaziale.fast_food_vicini(45.0, 7.7, 1)[0]['name'], 'McMilano')
+        with self.captureOnCommitCallbacks(execute=True):
+            FastFood.objects.create(name='McTorino', address='Via Roma 1', latitudine=45.07, longitudine=7.68)
+        self.assertEqual(spaziale.fast_food_vicini(45.0, 7.7, 1)[0]['name'], 'McTorino')
+
+    def test_mappa_con_i_punti_iniziali(self):
+        """
+        La mappa include i fast food vicini al centro iniziale.
+        """
+        response = self.client.get('/map/')
+        self.assertContains(response, 'McModena')
+        self.assertContains(response, 'mappa-config')
+
+
+class CarrelloConcorrenteTests(TransactionTestCase):
+    """
+    Test delle modifiche al carrello con richieste concorrenti.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='concorrente', password='testpass')
+        self.cart = Cart.objects.get(user=self.user)
+        self.big = Product.objects.create(name='Big', price='5.00')
+        self.fries = Product.objects.create(name='Fries', price='2.50')
+
+    def _in_parallelo(self, operazioni):
+        errori = []
+
+        def esegui(operazione):
+            try:
+                operazione()
+            except Exception as errore:  # Riportato nel thread principale
+                errori.append(errore)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=esegui, args=(op,)) for op in operazioni]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errori, [])
+
+    def test_aggiunte_e_rimozioni_concorrenti(self):
+        """
+        Nessuna aggiunta va persa e il totale corrisponde sempre alle righe.
+        """
+        CartItem.objects.create(cart=self.cart, product=self.fries, quantity=1)
+        riga_fries = CartItem.objects.get(cart=self.cart, product=self.fries)
+        operazioni = [lambda: aggiungi_prodotto(self.cart.id, self.big.id) for _ in range(40)]
+        operazioni += [lambda: rimuovi_riga(self.cart.id, riga_fries.id) for _ in range(5)]
+        random.Random(7).shuffle(operazioni)
+        self._in_parallelo(operazioni)
+
+        self.assertEqual(list(CartItem.objects.filter(cart=self.cart).values_list('product_id', 'quantity')), [(self.big.id, 40)])
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.total_price, Decimal('200.00'))
+
+    def test_riscatto_concorrente_del_coupon(self):
+        """
+        Lo stesso coupon applicato da piu' richieste insieme viene riscattato una volta sola.
+        """
+        codice = Coupon.objects.filter(user=self.user).values_list('code', flat=True).first()
+        esiti = []
+        self._in_parallelo([lambda: esiti.append(coupon.riscatta_coupon(self.user, self.cart.id, codice)) for _ in range(8)])
+        self.assertEqual(sorted(esiti), [False] * 7 + [True])
+        self.assertEqual(Cart.objects.get(id=self.cart.id).coupon.code, codice)
+        self.assertFalse(Coupon.objects.get(code=codice).is_active)
+
+    def test_query_per_operazione(self):
+        """
+        Aggiungere e rimuovere costano un numero fisso di query, anche dalla vista.
+        """
+        client = Client()
+        client.force_login(self.user)
+        client.get(f'/add_to_cart/{self.big.id}/')  # Crea la riga
+        for url, attese in ((f'/add_to_cart/{self.big.id}/', 4), (f'/add_to_cart/{self.fries.id}/', 5)):
+            with CaptureQueriesContext(connection) as ctx:
+                client.get(url)
+            # Esclude l'utente del login (la sessione arriva dalla cache)
+            self.assertEqual(conta_query(ctx.captured_queries) - 1, attese, [q['sql'] for q in ctx.captured_queries])
+
+        riga = CartItem.objects.get(cart=self.cart, product=self.fries)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertTrue(rimuovi_riga(self.cart.id, riga.id))
+        self.assertEqual(conta_query(ctx.captured_queries), 2)
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.total_price, Decimal('10.00'))
+
+
+class CarrelloApiTests(TestCase):
+    """
+    Test dell'API JSON del carrello usata dalla pagina dei prodotti.
+    """
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='api_carrello', password='testpass')
+        self.client.force_login(self.user)
+        self.cart = Cart.objects.get(user=self.user)
+        self.big = Product.objects.create(name='Big', price='5.00')
+        self.fries = Product.objects.create(name='Fries', price='2.50')
+
+    def _post(self, url, dati):
+        return self.client.post(url, json.dumps(dati), content_type='application/json')
+
+    def test_aggiunte_ripetute_fermate_al_massimo(self):
+        """
+        Le aggiunte accumulate non superano la quantita' massima di una riga.
+        """
+        aggiungi_prodotto(self.cart.id, self.big.id, 98)
+        aggiungi_prodotto(self.cart.id, self.big.id, 98)
+        for _ in range(3):
+            self.client.get(f'/add_to_cart/{self.big.id}/')
+        self.assertEqual(CartItem.objects.get(cart=self.cart, product=self.big).quantity, 99)
+        self.assertEqual(Cart.objects.get(id=self.cart.id).total_price, Decimal('495.00'))
+
+    def test_batch_in_una_transazione(self):
+        """
+        Il batch applica tutte le modifiche e restituisce il riepilogo aggiornato.
+        """
+        CartItem.objects.create(cart=self.cart, product=self.fries, quantity=4)
+        risposta = self._post('/api/carrello/batch/', {'operazioni': [
+            {'azione': 'aggiungi', 'product_id': self.big.id, 'quantita': 2},
+            {'azione': 'aggiungi', 'product_id': self.big.id},
+            {'azione': 'quantita', 'product_id': self.fries.id, 'quantita': 1},
+        ]})
+        self.assertEqual(risposta.status_code, 200)
+        carrello = risposta.json()['carrello']
+        self.assertEqual(carrello['articoli'], 4)
+        self.assertEqual(carrello['totale'], '17.50')
+        self.assertEqual([(r['nome'], r['quantita']) for r in carrello['righe']], [('Fries', 1), ('Big', 3)])
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.total_price, Decimal('17.50'))
+
+    def test_batch_non_valido_non_modifica_nulla(self):
+        """
+        Un prodotto inesistente rifiuta l'intero batch con un 400.
+        """
+        risposta = self._post('/api/carrello/batch/', {'operazioni': [
+            {'azione': 'aggiungi', 'product_id': self.big.id},
+            {'azione': 'aggiungi', 'product_id': 999999},
+        ]})
+        self.assertEqual(risposta.status_code, 400)
+        self.assertFalse(CartItem.objects.filter(cart=self.cart).exists())
+        self.assertEqual(self._post('/api/carrello/batch/', {'operazioni': []}).status_code, 400)
+        self.assertEqual(self.client.post('/api/carrello/batch/', 'non json', content_type='application/json').status_code, 400)
+
+    def test_endpoint_singoli(self):
+        """
+        Aggiunta, cambio di quantita' e rimozione di una riga.
+        """
+        self._post('/api/carrello/aggiungi/', {'product_id': self.big.id, 'quantita': 2})
+        self._post('/api/carrello/quantita/', {'product_id': self.fries.id, 'quantita': 3})
+        carrello = self._post('/api/carrello/rimuovi/', {'product_id': self.big.id}).json()['carrello']
+        self.assertEqual(carrello['articoli'], 3)
+        self.assertEqual(carrello['subtotale'], '7.50')
+        carrello = self._post('/api/carrello/quantita/', {'product_id': self.fries.id, 'quantita': 0}).json()['carrello']
+        self.assertEqual(carrello['righe'], [])
+        self.assertEqual(self.client.get('/api/carrello/').json()['carrello']['totale'], '0.00')
+        self.assertEqual(self.client.get('/api/carrello/aggiungi/').status_code, 405)
+
+    def test_richiede_csrf(self):
+        """
+        Le modifiche via API sono protette dal token CSRF come i form.
+        """
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        risposta = client.post('/api/carrello/batch/', json.dumps({'operazioni': []}), content_type='application/json')
+        self.assertEqual(risposta.status_code, 403)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class BenchmarkRotteTests(TestCase):
+    """
+    Test del benchmark delle rotte (comando bench_routes).
+    """
+
+    def test_ogni_rotta_ha_uno_scenario(self):
+        """
+        Una nuova rotta in urls.py deve avere uno scenario o una motivazione in ROTTE_ESCLUSE.
+        """
+        self.assertEqual(benchmark.rotte_non_coperte(), [])
+
+    def test_misura_rotte_su_dati_di_prova(self):
+        """
+        Gli scenari girano sul dataset generato senza errori e contano le query.
+        """
+        dati = benchmark.popola_dati(1, ordini_per_cliente=5, prodotti=5, fast_food=3)
+        contesto = benchmark.ContestoClient(0, dati)
+        with tempfile.TemporaryDirectory() as cartella, override_settings(IMMAGINI_CACHE_DIR=cartella):
+            for rotta in benchmark.ROTTE:
+                with self.subTest(rotta=rotta.nome):
+                    misura = benchmark.misura_rotta(rotta, [contesto], 2)
+                    self.assertEqual(misura['errori'], 0, misura.get('primo_errore'))
+                    self.assertEqual(misura['richieste'], 2)
+        self.assertGreater(benchmark.misura_rotta(benchmark.ROTTE[4], [contesto], 1)['query_media'], 0)
+
+    def test_confronto_con_baseline(self):
+        """
+        Sono regressioni solo i peggioramenti oltre entrambe le soglie e le query in piu'.
+        """
+        base = {
+            'cart': {'p95': 10.0, 'query_media': 4.0, 'errori': 0},
+            'homepage': {'p95': 1.0, 'query_media': 0.0, 'errori': 0},
+        }
+        attuale = {
+            'cart': {'p95': 13.0, 'query_media': 6.0, 'errori': 0},
+            'homepage': {'p95': 1.8, 'query_media': 0.0, 'errori': 0},
+            'nuova': {'p95': 99.0, 'query_media': 9.0, 'errori': 0},
+        }
+        self.assertEqual(benchmark.confronta(base, attuale, soglia=20, soglia_ms=1.0), [
+            'cart: p95 10.0ms -> 13.0ms',
+            'cart: query 4.0 -> 6.0',
+        ])
+
+
+class StrumentazioneTests(TestCase):
+    """
+    Test del middleware di strumentazione (Server-Timing, log lente, istogrammi).
+    """
+
+    def setUp(self):
+        strumentazione.istogrammi.azzera()
+        self.client = Client()
+        self.user = User.objects.create_user(username='misurato', password='testpass')
+        self.client.force_login(self.user)
+        Product.objects.create(name='Big', price='5.00')
+
+    def test_header_server_timing(self):
+        """
+        Se abilitato, l'header riporta tempo totale, tempo e numero delle query, tempo dei template.
+        """
+        self.assertNotIn('Server-Timing', self.client.get('/cart/'))
+        with self.settings(STRUMENTAZIONE_SERVER_TIMING=True):
+            risposta = self.client.get('/cart/')
+        header = risposta['Server-Timing']
+        self.assertRegex(header, r'^total;dur=[\d.]+, sql;dur=[\d.]+;desc="\d+ query", tpl;dur=[\d.]+$')
+        self.assertNotIn('desc="0 query"', header)
+        self.assertNotIn('tpl;dur=0.0', header)
+
+    @override_settings(RICHIESTA_LENTA_MS=0)
+    def test_log_richieste_lente_con_query(self):
+        """
+        Oltre la soglia la richiesta viene registrata con le query piu' lente.
+        """
+        with self.assertLogs('gestione.richieste_lente', 'WARNING') as log:
+            self.client.get('/cart/')
+        self.assertIn('GET /cart/ (cart) 200', log.output[0])
+        self.assertIn('SELECT', log.output[0])
+
+    def test_istogrammi_solo_per_lo_staff(self):
+        """
+        L'endpoint delle metriche e' riservato allo staff e aggrega per rotta.
+        """
+        self.client.get('/prodotti/')
+        self.client.get('/prodotti/')
+        self.assertEqual(self.client.get('/metrics/rotte/').status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+        rotte = self.client.get('/metrics/rotte/').json()['rotte']
+        self.assertEqual(rotte['prodotti']['richieste'], 2)
+        self.assertEqual(sum(rotte['prodotti']['istogramma'].values()), 2)
+        self.assertGreater(rotte['prodotti']['query_media'], 0)
+
+
+@skipUnless(connection.vendor == 'sqlite', "Profilo specifico di SQLite")
+class ProfiloSqliteTests(TestCase):
+    """
+    Test del profilo di produzione applicato alle connessioni SQLite.
+    """
+
+    def _pragma(self, nome):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {nome}')
+            return cursor.fetchone()[0]
+
+    def test_pragma_applicati_alla_connessione(self):
+        """
+        busy_timeout (da OPTIONS['timeout']), synchronous e cache_size arrivano dalle impostazioni.
+        """
+        self.assertEqual(self._pragma('busy_timeout'), 5000)
+        self.assertEqual(self._pragma('synchronous'), 1)  # NORMAL
+        self.assertEqual(self._pragma('cache_size'), -20000)
+
+    def test_wal_su_database_file(self):
+        """
+        Su un database su file la connessione passa in modalita' WAL.
+        """
+        from django.db.backends.sqlite3.base import DatabaseWrapper
+
+        with tempfile.TemporaryDirectory() as cartella:
+            wrapper = DatabaseWrapper({
+                **connection.settings_dict, 'NAME': os.path.join(cartella, 'wal.sqlite3'),
+            }, alias='wal')
+            try:
+                with wrapper.cursor() as cursor:
+                    cursor.execute('PRAGMA journal_mode')
+                    self.assertEqual(cursor.fetchone()[0], 'wal')
+            finally:
+                wrapper.close()
+
+
+class SessioniTests(TestCase):
+    """
+    Test delle sessioni in cache e della pulizia delle sessioni scadute.
+    """
+
+    def test_richieste_autenticate_senza_django_session(self):
+        """
+        Con cached_db e i messaggi nei cookie le richieste non leggono django_session.
+        """
+        user = User.objects.create_user(username='sessione', password='testpass')
+        Product.objects.create(name='Big', price='5.00')
+        self.client.force_login(user)
+        for percorso in ('/cart/', f'/add_to_cart/{Product.objects.get().id}/', '/prodotti/'):
+            with CaptureQueriesContext(connection) as query:
+                self.assertLess(self.client.get(percorso).status_code, 400)
+            self.assertFalse([q for q in query.captured_queries if 'django_session' in q['sql']], percorso)
+
+    def test_pulizia_sessioni_scadute_a_blocchi(self):
+        """
+        Il comando elimina solo le sessioni scadute, un blocco alla volta.
+        """
+        from django.contrib.sessions.models import Session
+
+        adesso = timezone.now()
+        for i in range(5):
+            Session.objects.create(session_key=f'scaduta{i}', session_data='', expire_date=adesso - timedelta(days=1))
+        Session.objects.create(session_key='valida', session_data='', expire_date=adesso + timedelta(days=1))
+
+        out = StringIO()
+        with CaptureQueriesContext(connection) as query:
+            call_command('clear_expired_sessions', batch_size=2, pause=0, stdout=out)
+        self.assertIn('Eliminate 5 sessioni scadute', out.getvalue())
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['valida'])
+        self.assertEqual(sum(q['sql'].startswith('DELETE') for q in query.captured_queries), 3)
+
+
+class FileStaticiTests(TestCase):
+    """
+    Test dei file statici con hash, varianti precompresse e cache immutabile.
+    """
+
+    def setUp(self):
+        cartella = tempfile.TemporaryDirectory()
+        self.addCleanup(cartella.cleanup)
+        impostazioni = override_settings(STATIC_ROOT=cartella.name)
+        impostazioni.enable()
+        self.addCleanup(impostazioni.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+        self.user = User.objects.create_user(username='statici', password='testpass')
+        self.client.force_login(self.user)
+
+    def test_template_con_nomi_hashati(self):
+        """
+        Gli stili non sono piu' inline: le pagine linkano i bundle con l'hash.
+        """
+        html = self.client.get('/cart/').content.decode()
+        self.assertNotIn('<style>', html)
+        self.assertRegex(html, r'/static/css/base\.[0-9a-f]{12}\.css')
+        self.assertRegex(html, r'/static/css/cart\.[0-9a-f]{12}\.css')
+
+    def test_variante_gzip_immutabile(self):
+        """
+        Un nome con hash viene servito precompresso e con cache di un anno.
+        """
+        import gzip
+
+        url = staticfiles_storage.url('css/base.css')
+        risposta = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+        self.assertEqual(risposta['Content-Encoding'], 'gzip')
+        self.assertEqual(risposta['Content-Type'], 'text/css')
+        self.assertIn('immutable', risposta['Cache-Control'])
+        with staticfiles_storage.open('css/base.css') as originale:
+            self.assertEqual(gzip.decompress(b''.join(risposta.streaming_content)), originale.read())
+
+    def test_nome_senza_hash_e_percorsi_esterni(self):
+        """
+        Senza hash la cache e' breve; i percorsi fuori da STATIC_ROOT danno 404.
+        """
+        risposta = self.client.get('/static/css/base.css')
+        self.assertNotIn('Content-Encoding', risposta)
+        self.assertNotIn('immutable', risposta['Cache-Control'])
+        self.assertEqual(self.client.get('/static/../manage.py').status_code, 404)
+        self.assertEqual(self.client.get('/static/css/non_esiste.css').status_code, 404)
+
+
+@skipUnless(immagini.disponibile(), "Richiede Pillow")
+class ImmaginiProdottoTests(TestCase):
+    """
+    Test delle varianti ridimensionate e WebP delle immagini dei prodotti.
+    """
+
+    def setUp(self):
+        cartella = tempfile.TemporaryDirectory()
+        self.addCleanup(cartella.cleanup)
+        impostazioni = override_settings(IMMAGINI_CACHE_DIR=cartella.name)
+        impostazioni.enable()
+        self.addCleanup(impostazioni.disable)
+        self.cartella = cartella.name
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product = Product.objects.create(name='Big', price='5.00', image_name='prodotto_1.png')
+
+    def _varianti(self):
+        return sorted(nome for _, _, nomi in os.walk(self.cartella) for nome in nomi)
+
+    def test_varianti_generate_al_salvataggio(self):
+        """
+        Salvare il prodotto genera tutte le larghezze in WebP e PNG.
+        """
+        digest = immagini.digest_sorgente(immagini.sorgente(self.product))
+        self.assertEqual(self._varianti(), sorted(
+            f'{digest}-{larghezza}.{formato}' for larghezza in (160, 320, 640) for formato in ('png', 'webp')
+        ))
+
+    def test_griglia_con_srcset_e_variante_servita(self):
+        """
+        La griglia offre srcset WebP; la variante e' piu' piccola dell'originale.
+        """
+        from PIL import Image
+
+        self.client.force_login(User.objects.create_user(username='immagini', password='testpass'))
+        html = self.client.get('/prodotti/').content.decode()
+        self.assertIn('<source type="image/webp" srcset="', html)
+        self.assertIn(' 640w"', html)
+        url = immagini.url_variante(self.product, 320, 'webp')
+        risposta = self.client.get(url)
+        self.assertEqual(risposta['Content-Type'], 'image/webp')
+        self.assertIn('immutable', risposta['Cache-Control'])
+        contenuto = b''.join(risposta.streaming_content)
+        self.assertLess(len(contenuto), os.path.getsize(immagini.sorgente(self.product)) / 5)
+        self.assertEqual(Image.open(BytesIO(contenuto)).width, 320)
+
+    def test_url_non_validi(self):
+        """
+        Larghezze non previste, formati sconosciuti e digest vecchi danno 404.
+        """
+        url = immagini.url_variante(self.product, 320, 'webp')
+        self.assertEqual(self.client.get(url.replace('/320.', '/321.')).status_code, 404)
+        self.assertEqual(self.client.get(url.replace('.webp', '.gif')).status_code, 404)
+        digest = url.split('/')[-2]
+        self.assertEqual(self.client.get(url.replace(digest, '0' * 16)).status_code, 404)
+
+    def test_pulizia_lru(self):
+        """
+        Oltre il limite si eliminano le varianti usate meno di recente.
+        """
+        varianti = [os.path.join(cartella, nome) for cartella, _, nomi in os.walk(self.cartella) for nome in nomi]
+        recente = immagini.variante(self.product, 640, 'webp')
+        for i, percorso in enumerate(sorted(varianti)):
+            os.utime(percorso, (1000 + i, 1000 + i))
+        os.utime(recente)
+        # La pulizia scende al 90% del limite: resta spazio solo per la piu' recente
+        eliminati = immagini.pulisci_cache(limite=os.path.getsize(recente) / 0.9 + 1)
+        self.assertEqual(eliminati, len(varianti) - 1)
+        self.assertEqual(self._varianti(), [os.path.basename(recente)])
+
+    def test_pulizia_al_massimo_una_volta_per_intervallo(self):
+        """
+        Generare varianti durante le richieste non scansiona la cache a ogni variante.
+        """
+        for cartella, _, nomi in os.walk(self.cartella):
+            for nome in nomi:
+                os.remove(os.path.join(cartella, nome))
+        with mock.patch.object(immagini, 'pulisci_cache', wraps=immagini.pulisci_cache) as pulizia, \
+                mock.patch.object(immagini, '_ultima_pulizia', 0.0), \
+                self.settings(IMMAGINI_PULIZIA_INTERVALLO=3600):
+            immagini.variante(self.product, 160, 'webp')
+            immagini.variante(self.product, 320, 'webp')
+            immagini.variante(self.product, 640, 'webp')
+        self.assertEqual(pulizia.call_count, 1)
+
+    def test_immagine_cambiata_invalida_il_catalogo(self):
+        """
+        Se il digest dell'immagine cambia, la griglia in cache (con gli URL vecchi) viene scartata.
+        """
+        percorso = immagini.sorgente(self.product)
+        chiave = immagini.DIGEST_KEY.format(percorso=hashlib.sha1(percorso.encode()).hexdigest())
+        versione = catalogo.versione_catalogo()
+        immagini._digest.clear()
+        immagini.digest_sorgente(percorso)
+        self.assertEqual(catalogo.versione_catalogo(), versione)
+
+        cache.set(chiave, '0' * 16, None)  # Digest di una versione precedente del file
+        immagini._digest.clear()
+        immagini.digest_sorgente(percorso)
+        self.assertNotEqual(catalogo.versione_catalogo(), versione)
+
+
+class FrammentiTemplateTests(TestCase):
+    """
+    Test dei frammenti di base.html e map.html in cache.
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def test_navbar_in_cache_senza_token_csrf(self):
+        """
+        I link della navbar sono in cache, il form di logout con il token CSRF no.
+        """
+        from django.core.cache.utils import make_template_fragment_key
+        from .context_processors import versione_template
+
+        for nome in ('primo', 'secondo'):
+            self.client.force_login(User.objects.create_user(username=nome, password='testpass'))
+            response = self.client.get('/cart/')
+            self.assertContains(response, 'csrfmiddlewaretoken')
+            self.assertContains(response, 'Logout')
+        frammento = cache.get(make_template_fragment_key('navbar_link', [versione_template()]))
+        self.assertIn('/prodotti/', frammento)
+        self.assertNotIn('csrfmiddlewaretoken', frammento)
+
+    def test_navbar_anonima_e_autenticata(self):
+        """
+        L'header della mappa ha una copia in cache per anonimi e una per utenti autenticati.
+        """
+        self.assertContains(self.client.get('/map/'), 'Ordini (Login richiesto)')
+        self.client.force_login(User.objects.create_user(username='mappa', password='testpass'))
+        autenticata = self.client.get('/map/')
+        self.assertContains(autenticata, 'I tuoi Ordini')
+        self.assertNotContains(autenticata, 'Login richiesto')
+        self.assertNotContains(self.client.get('/coupon/'), 'Registrati')
+        self.client.logout()
+        self.assertContains(self.client.get('/map/'), 'Ordini (Login richiesto)')
+
+    def test_versione_cambia_con_i_template(self):
+        """
+        Un template modificato cambia la versione, quindi la chiave dei frammenti.
+        """
+        from .context_processors import versione_template
+
+        cartella = tempfile.TemporaryDirectory()
+        self.addCleanup(cartella.cleanup)
+        self.addCleanup(versione_template.cache_clear)
+        percorso = os.path.join(cartella.name, 'base.html')
+        with open(percorso, 'w') as file:
+            file.write('{% block content %}{% endblock %}')
+        os.utime(percorso, ns=(10**18, 10**18))
+        templates = [dict(configurazione, DIRS=[cartella.name]) for configurazione in settings.TEMPLATES]
+        with self.settings(TEMPLATES=templates):
+            versione_template.cache_clear()
+            prima = versione_template()
+            self.assertEqual(prima, str(10**18))
+            os.utime(percorso, ns=(10**18, 10**18 + 10**9))
+            versione_template.cache_clear()
+            self.assertNotEqual(versione_template(), prima)
+
+
+class TransizioniOrdiniTests(TestCase):
+    """
+    Test della macchina a stati degli ordini e del cambio di stato di piu' ordini.
+    """
+
+    def setUp(self):
+        self.staff = User.objects.create_user(username='cucina', password='testpass', is_ristoratore=True)
+        self.cliente = User.objects.create_user(username='cliente', password='testpass')
+        self.fast_food = FastFood.objects.create(name='McTest', address='Via Test 1', latitudine=45.0, longitudine=9.0)
+        self.client.force_login(self.staff)
+
+    def _ordine(self, tipo='delivery', status='ORDINE RICEVUTO', fast_food=None):
+        return Order.objects.create(
+            user=self.cliente, total_price='5.00', items='1x Big',
+            tipo_di_ordine=tipo, status=status, fast_food=fast_food or self.fast_food,
+        )
+
+    def _transizione(self, ordini, status, **altro):
+        return self.client.post(
+            '/gestione_ordine/stato/', json.dumps({'ordini': ordini, 'status': status, **altro}),
+            content_type='application/json',
+        )
+
+    def test_stati_successivi_per_tipo(self):
+        """
+        Un ordine in loco passa da IN PREPARAZIONE a CONSEGNATO, uno delivery da IN CONSEGNA.
+        """
+        self.assertEqual(self._ordine('delivery', 'IN PREPARAZIONE').stati_successivi(), ('IN CONSEGNA',))
+        self.assertEqual(self._ordine('in_loco', 'IN PREPARAZIONE').stati_successivi(), ('CONSEGNATO',))
+        self.assertEqual(self._ordine('delivery', 'CONSEGNATO').stati_successivi(), ())
+
+    def test_un_solo_update_e_ordini_saltati(self):
+        """
+        Gli ordini compatibili sono aggiornati con un solo UPDATE, gli altri riportati come saltati.
+        """
+        ricevuti = [self._ordine(), self._ordine('in_loco')]
+        consegnato = self._ordine(status='CONSEGNATO')
+        prima = Order.objects.get(id=ricevuti[0].id).updated_at
+        ids = [o.id for o in ricevuti] + [consegnato.id, 99999]
+
+        with CaptureQueriesContext(connection) as query:
+            response = self._transizione(ids, 'IN PREPARAZIONE')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['aggiornati'], [o.id for o in ricevuti])
+        self.assertEqual(response.json()['saltati'], [consegnato.id, 99999])
+        self.assertEqual(sum(q['sql'].startswith('UPDATE "gestione_order"') for q in query.captured_queries), 1)
+
+        self.assertEqual(set(Order.objects.filter(id__in=ids).values_list('status', flat=True)), {'IN PREPARAZIONE', 'CONSEGNATO'})
+        self.assertGreater(Order.objects.get(id=ricevuti[0].id).updated_at, prima)
+
+    def test_in_loco_non_va_in_consegna(self):
+        """
+        Il passaggio a IN CONSEGNA e' consentito solo agli ordini delivery.
+        """
+        delivery = self._ordine('delivery', 'IN PREPARAZIONE')
+        in_loco = self._ordine('in_loco', 'IN PREPARAZIONE')
+        dati = self._transizione([delivery.id, in_loco.id], 'IN CONSEGNA').json()
+        self.assertEqual((dati['aggiornati'], dati['saltati']), ([delivery.id], [in_loco.id]))
+
+    def test_limite_al_fast_food(self):
+        """
+        Con fast_food si aggiornano solo gli ordini di quel fast food.
+        """
+        altro = FastFood.objects.create(name='Altro', address='Via Test 2', latitudine=45.1, longitudine=9.1)
+        mio, suo = self._ordine(), self._ordine(fast_food=altro)
+        dati = self._transizione([mio.id, suo.id], 'IN PREPARAZIONE', fast_food=self.fast_food.id).json()
+        self.assertEqual((dati['aggiornati'], dati['saltati']), ([mio.id], [suo.id]))
+
+    def test_richieste_non_valide(self):
+        """
+        Stato sconosciuto o selezione vuota: 400; utenti non ristoratori: 403.
+        """
+        ordine = self._ordine()
+        self.assertEqual(self._transizione([ordine.id], 'BRUCIATO').status_code, 400)
+        self.assertEqual(self._transizione([], 'IN PREPARAZIONE').status_code, 400)
+        self.assertEqual(self.client.get('/gestione_ordine/stato/').status_code, 405)
+        self.client.force_login(self.cliente)
+        self.assertEqual(self._transizione([ordine.id], 'IN PREPARAZIONE').status_code, 403)
+        self.assertEqual(Order.objects.get(id=ordine.id).status, 'ORDINE RICEVUTO')
+
+    def test_form_e_aggiornamento_singolo(self):
+        """
+        Il form della pagina e update_order_status rispettano la macchina a stati.
+        """
+        ordine = self._ordine()
+        response = self.client.post('/gestione_ordine/stato/', {
+            'ordini': [ordine.id], 'status': 'IN PREPARAZIONE', 'fast_food': self.fast_food.id,
+        })
+        self.assertRedirects(response, f'/gestione_ordine/?fast_food={self.fast_food.id}', fetch_redirect_response=False)
+        self.client.post(f'/update_order_status/{ordine.id}/', {'status': 'ORDINE RICEVUTO'})
+        self.assertEqual(Order.objects.get(id=ordine.id).status, 'IN PREPARAZIONE')
+        self.client.post(f'/update_order_status/{ordine.id}/', {'status': 'IN CONSEGNA'})
+        self.assertEqual(Order.objects.get(id=ordine.id).status, 'IN CONSEGNA')
+
+        response = self.client.get('/gestione_ordine/', {'fast_food': self.fast_food.id})
+        self.assertEqual(
+            [valore for valore, _ in response.context['stati_di_arrivo']], ['IN PREPARAZIONE', 'IN CONSEGNA', 'CONSEGNATO'],
+        )
+        self.client.force_login(self.cliente)
+        response = self.client.post(f'/update_order_status/{ordine.id}/', {'status': 'CONSEGNATO'})
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(Order.objects.get(id=ordine.id).status, 'IN CONSEGNA')
+
+
+@override_settings(CODA_ORDINI=True)
+class CodaOrdiniTests(TestCase):
+    """
+    Test della coda degli ordini: checkout accodato e worker.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='coda', password='testpass')
+        self.big = Product.objects.create(name='Big', price='5.00')
+        self.fries = Product.objects.create(name='Fries', price='2.50')
+        self.cart = Cart.objects.get(user=self.user)  # Creato dal segnale post_save
+        aggiungi_prodotto(self.cart.id, self.big.id, 2)
+        aggiungi_prodotto(self.cart.id, self.fries.id)
+        self.client.force_login(self.user)
+
+    def _checkout(self):
+        return self.client.post('/create_order/', {'order_type': 'delivery', 'address': 'Via Emilia 1', 'city': 'Modena'})
+
+    def test_checkout_accoda_con_un_solo_insert(self):
+        """
+        Il checkout scrive solo il comando in coda; il doppio invio non lo duplica.
+        """
+        with CaptureQueriesContext(connection) as query:
+            self.assertRedirects(self._checkout(), '/orders/', fetch_redirect_response=False)
+        scritture = [q['sql'] for q in query.captured_queries if q['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))]
+        self.assertEqual(len(scritture), 1)
+        self.assertIn('gestione_queuedorder', scritture[0])
+        self._checkout()
+        self.assertEqual(QueuedOrder.objects.count(), 1)
+        self.assertFalse(Order.objects.exists())
+        self.assertContains(self.client.get('/orders/'), '1 ordine in elaborazione')
+
+    def test_worker_crea_ordine_e_svuota_il_carrello(self):
+        """
+        Il worker crea l'ordine con i prezzi del checkout e toglie dal carrello solo quanto ordinato.
+        """
+        self._checkout()
+        Product.objects.filter(id=self.big.id).update(price='9.00')  # Cambio di prezzo dopo il checkout
+        aggiungi_prodotto(self.cart.id, self.fries.id)  # Aggiunta dopo il checkout
+
+        self.assertEqual(coda.elabora_coda(), {'completati': 1, 'ritentati': 0, 'scartati': 0})
+        order = Order.objects.get(user=self.user)
+        self.assertEqual(order.total_price, Decimal('12.50'))
+        self.assertEqual(order.items, '2x Big, 1x Fries')
+        self.assertEqual(QueuedOrder.objects.get().order, order)
+        self.assertEqual(list(CartItem.objects.filter(cart=self.cart).values_list('product_id', 'quantity')), [(self.fries.id, 1)])
+        self.assertEqual(Cart.objects.get(id=self.cart.id).total_price, Decimal('2.50'))
+        self.assertEqual(coda.profondita(), {'in_coda': 0, 'in_lavorazione': 0, 'scartati': 0, 'attesa_max_s': 0.0})
+
+    @override_settings(CODA_ORDINI_TENTATIVI=2, CODA_ORDINI_ATTESA=0)
+    def test_nuovi_tentativi_e_dead_letter(self):
+        """
+        Un errore temporaneo rimette il comando in coda; esauriti i tentativi viene scartato.
+        """
+        self._checkout()
+        with mock.patch('gestione.coda.crea_ordine', side_effect=RuntimeError('disco pieno')), self.assertLogs('gestione.coda'):
+            self.assertEqual(coda.elabora_coda(blocchi=1), {'completati': 0, 'ritentati': 1, 'scartati': 0})
+            self.assertEqual(coda.elabora_coda(blocchi=1), {'completati': 0, 'ritentati': 0, 'scartati': 1})
+        comando = QueuedOrder.objects.get()
+        self.assertEqual((comando.stato, comando.tentativi), (QueuedOrder.SCARTATO, 2))
+        self.assertIn('disco pieno', comando.errore)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(CartItem.objects.filter(cart=self.cart).count(), 2)
+        self.assertEqual(coda.profondita()['scartati'], 1)
+        self.assertEqual(
+            [s['motivo'] for s in coda.scartati(self.user)], ["Non è stato possibile completare l'ordine, riprova."],
+        )
+
+    def test_prodotto_eliminato_scartato_subito(self):
+        """
+        Un comando con un prodotto non piu' esistente non viene ritentato.
+        """
+        self._checkout()
+        self.fries.delete()
+        with self.assertLogs('gestione.coda', 'ERROR'):
+            self.assertEqual(coda.elabora_coda(), {'completati': 0, 'ritentati': 0, 'scartati': 1})
+        self.assertIn('Fries', QueuedOrder.objects.get().errore)
+
+        # Il cliente vede che l'ordine non e' stato creato, e perche'
+        response = self.client.get('/orders/')
+        self.assertContains(response, "non è stato effettuato: Prodotti non più disponibili: Fries")
+        self.assertContains(response, '2x Big, 1x Fries')
+        QueuedOrder.objects.update(updated_at=timezone.now() - timedelta(days=8))
+        self.assertNotContains(self.client.get('/orders/'), 'non è stato effettuato')
+
+    def test_lavorazione_interrotta_torna_in_coda(self):
+        """
+        Un comando preso da un worker fermo da troppo tempo viene ripreso.
+        """
+        self._checkout()
+        self.assertEqual(len(coda.preleva()), 1)
+        self.assertEqual(coda.preleva(), [])
+        QueuedOrder.objects.update(preso_il=timezone.now() - timedelta(hours=1))
+        out = StringIO()
+        call_command('run_order_workers', once=True, stdout=out)
+        self.assertIn('completati=1', out.getvalue())
+        self.assertEqual(QueuedOrder.objects.get().tentativi, 2)
+
+    def test_metriche_solo_staff(self):
+        """
+        La profondita' della coda e' visibile solo allo staff.
+        """
+        self._checkout()
+        self.assertEqual(self.client.get('/metrics/coda/').status_code, 403)
+        self.client.force_login(User.objects.create_user(username='staff', password='testpass', is_staff=True))
+        self.assertEqual(self.client.get('/metrics/coda/').json()['in_coda'], 1)
+
+
+class ArchivioOrdiniTests(TestCase):
+    """
+    Test dell'archiviazione degli ordini consegnati e delle letture sulle due tabelle.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='archivio', password='testpass')
+        self.fast_food = FastFood.objects.create(name='McTest', address='Via Test 1', latitudine=45.0, longitudine=9.0)
+        self.big = Product.objects.create(name='Big', price='5.00')
+        adesso = timezone.now()
+        # Dal piu' vecchio: quattro consegnati vecchi, uno vecchio non consegnato, uno recente
+        self.ordini = [
+            self._ordine(adesso - timedelta(days=200 - i), 'CONSEGNATO' if i < 4 else 'IN CONSEGNA')
+            for i in range(5)
+        ] + [self._ordine(adesso - timedelta(days=1), 'CONSEGNATO')]
+        self.client.force_login(self.user)
+
+    def _ordine(self, istante, status):
+        order = Order.objects.create(
+            user=self.user, total_price='10.00', items='2x Big', status=status,
+            tipo_di_ordine='delivery', fast_food=self.fast_food,
+        )
+        OrderLine.objects.create(order=order, product=self.big, product_name='Big', quantity=2, unit_price='5.00')
+        Order.objects.filter(pk=order.pk).update(created_at=istante)
+        return order
+
+    def test_archiviazione_a_blocchi_riprendibile(self):
+        """
+        Solo i consegnati vecchi passano in archivio, righe comprese; il comando riparte da dove si e' fermato.
+        """
+        creati = dict(Order.objects.values_list('id', 'created_at'))
+        out = StringIO()
+        call_command('archive_orders', days=90, batch_size=3, max_batches=1, pause=0, stdout=out)
+        self.assertIn('Archiviati 3 ordini in 1 blocchi; da archiviare: 1.', out.getvalue())
+        call_command('archive_orders', days=90, batch_size=3, pause=0, stdout=out)
+        self.assertIn('Archiviati 1 ordini in 1 blocchi; da archiviare: 0.', out.getvalue())
+
+        archiviati = [o.id for o in self.ordini[:4]]
+        self.assertEqual(sorted(ArchivedOrder.objects.values_list('id', flat=True)), archiviati)
+        self.assertFalse(Order.objects.filter(id__in=archiviati).exists())
+        self.assertFalse(OrderLine.objects.filter(order_id__in=archiviati).exists())
+        archiviato = ArchivedOrder.objects.get(id=archiviati[0])
+        self.assertEqual(archiviato.righe, [{'product_id': self.big.id, 'product_name': 'Big', 'quantity': 2, 'unit_price': '5.00'}])
+        self.assertEqual(archiviato.created_at, creati[archiviati[0]])
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_storico_e_export_leggono_le_due_tabelle(self):
+        """
+        orders e l'export mostrano ordini attivi e archiviati nello stesso ordine di prima.
+        """
+        attesi = [o.id for o in reversed(self.ordini)]
+        call_command('archive_orders', days=90, pause=0, stdout=StringIO())
+        with self.settings(ORDINI_PER_PAGINA=2):
+            visti, url = [], '/orders/'
+            while url:
+                response = self.client.get(url if url.startswith('/') else '/orders/' + url)
+                visti += [order.id for order in response.context['orders']]
+                url = response.context['pagina_successiva']
+        self.assertEqual(visti, attesi)
+
+        response = self.client.get('/orders/export/', {'formato': 'ndjson'})
+        righe = [json.loads(riga) for riga in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([riga['id'] for riga in righe], list(reversed(attesi)))
+        self.assertEqual(righe[0]['fast_food'], 'McTest')
+
+
+class VenditeRollupTests(TestCase):
+    """
+    Test del rollup delle vendite per fast food, ora e tipo di ordine.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='vendite', password='testpass')
+        self.fast_food = FastFood.objects.create(name='McTest', address='Via Test 1', latitudine=45.0, longitudine=9.0)
+        self.big = Product.objects.create(name='Big', price='5.00')
+        self.cart = Cart.objects.get(user=self.user)
+
+    def _ordine(self, tipo='in_loco', quantita=1):
+        aggiungi_prodotto(self.cart.id, self.big.id, quantita)
+        prezzo = prezzo_carrello(Cart.objects.get(id=self.cart.id))
+        CartItem.objects.filter(cart=self.cart).delete()
+        return crea_ordine(self.user, prezzo, tipo_di_ordine=tipo, fast_food=self.fast_food if tipo == 'in_loco' else None)
+
+    def _celle(self):
+        return list(SalesRollup.objects.order_by('tipo_di_ordine').values_list(
+            'fast_food_id', 'tipo_di_ordine', 'ordini', 'incasso', 'consegnati', 'incasso_consegnato',
+        ))
+
+    def test_aggiornamento_incrementale_e_ricostruzione(self):
+        """
+        Ordini creati e consegnati aggiornano le celle; la ricostruzione da' lo stesso risultato.
+        """
+        ordini = [self._ordine(), self._ordine(quantita=2), self._ordine('delivery')]
+        cambia_stato([o.id for o in ordini], 'IN PREPARAZIONE')
+        cambia_stato([ordini[0].id, ordini[1].id], 'CONSEGNATO')
+        incrementale = self._celle()
+        self.assertEqual(incrementale, [
+            (None, 'delivery', 1, Decimal('5.00'), 0, Decimal('0.00')),
+            (self.fast_food.id, 'in_loco', 2, Decimal('15.00'), 2, Decimal('15.00')),
+        ])
+        SalesRollup.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_sales_rollups', stdout=out)
+        self.assertIn('2 celle', out.getvalue())
+        self.assertEqual(self._celle(), incrementale)
+
+    def test_admin_non_sposta_il_rollup(self):
+        """
+        Nell'admin lo stato non e' modificabile e l'eliminazione di ordini toglie le loro vendite dal rollup.
+        """
+        admin = User.objects.create_superuser(username='amministratore', password='testpass', email='a@example.com')
+        self.client.force_login(admin)
+        ordini = [self._ordine(), self._ordine(quantita=2), self._ordine('delivery')]
+        cambia_stato([ordini[0].id], 'IN PREPARAZIONE')
+        cambia_stato([ordini[0].id], 'CONSEGNATO')
+        response = self.client.get(f'/admin/gestione/order/{ordini[1].id}/change/')
+        self.assertNotIn('name="status"', response.content.decode())
+        self.assertContains(response, 'cambia dalla gestione ordini')
+
+        self.client.post(f'/admin/gestione/order/{ordini[2].id}/delete/', {'post': 'yes'})
+        self.client.post('/admin/gestione/order/', {
+            'action': 'delete_selected', '_selected_action': [ordini[0].id], 'post': 'yes',
+        })
+        self.assertEqual(Order.objects.count(), 1)
+        incrementale = self._celle()
+        self.assertEqual(incrementale, [
+            (None, 'delivery', 0, Decimal('0.00'), 0, Decimal('0.00')),
+            (self.fast_food.id, 'in_loco', 1, Decimal('10.00'), 0, Decimal('0.00')),
+        ])
+        vendite.ricostruisci()
+        self.assertEqual(self._celle(), incrementale[1:])
+
+    def test_ricostruzione_include_gli_archiviati(self):
+        """
+        Gli ordini archiviati restano nel rollup ricostruito.
+        """
+        order = self._ordine()
+        cambia_stato([order.id], 'IN PREPARAZIONE')
+        cambia_stato([order.id], 'CONSEGNATO')
+        Order.objects.filter(id=order.id).update(created_at=timezone.now() - timedelta(days=365))
+        call_command('archive_orders', days=90, pause=0, stdout=StringIO())
+        vendite.ricostruisci()
+        self.assertEqual(self._celle(), [(self.fast_food.id, 'in_loco', 1, Decimal('5.00'), 1, Decimal('5.00'))])
+
+    def test_dashboard_legge_solo_il_rollup(self):
+        """
+        La dashboard somma le ore del giorno locale senza leggere gli ordini; solo staff.
+        """
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get('/metrics/vendite/').status_code, 403)
+        locale = timezone.localtime().replace(hour=10, minute=0, second=0, microsecond=0)
+        for ore in (0, 3):
+            SalesRollup.objects.create(
+                fast_food=self.fast_food, tipo_di_ordine='in_loco', ora=locale + timedelta(hours=ore),
+                ordini=2, incasso='12.50',
+            )
+        self.client.force_login(User.objects.create_user(username='capo', password='testpass', is_staff=True))
+        with CaptureQueriesContext(connection) as query:
+            response = self.client.get('/metrics/vendite/', {'fast_food': self.fast_food.id})
+        self.assertFalse([q for q in query.captured_queries if 'gestione_order' in q['sql']])
+        self.assertEqual(response.json()['vendite'], [{
+            'periodo': locale.date().isoformat(), 'fast_food_id': self.fast_food.id, 'fast_food': 'McTest',
+            'tipo_di_ordine': 'in_loco', 'ordini': 4, 'incasso': '25.00', 'consegnati': 0, 'incasso_consegnato': '0.00',
+        }])
+        orarie = self.client.get('/metrics/vendite/', {'granularita': 'ora'}).json()['vendite']
+        self.assertEqual(len(orarie), 2)
+        self.assertEqual(self.client.get('/metrics/vendite/', {'granularita': 'settimana'}).status_code, 400)
+
+    def test_dashboard_con_periodo_limitato(self):
+        """
+        Senza date la dashboard legge solo gli ultimi VENDITE_GIORNI_PREDEFINITI giorni; periodi troppo lunghi danno 400.
+        """
+        adesso = timezone.now()
+        for giorni in (0, 40):
+            SalesRollup.objects.create(
+                fast_food=self.fast_food, tipo_di_ordine='in_loco', ora=vendite.ora_di(adesso - timedelta(days=giorni)),
+                ordini=1, incasso='5.00',
+            )
+        self.client.force_login(User.objects.create_user(username='capo', password='testpass', is_staff=True))
+        self.assertEqual(len(self.client.get('/metrics/vendite/').json()['vendite']), 1)
+        dal = (timezone.localdate() - timedelta(days=45)).isoformat()
+        self.assertEqual(len(self.client.get('/metrics/vendite/', {'dal': dal}).json()['vendite']), 2)
+        self.assertEqual(self.client.get('/metrics/vendite/', {'dal': '2020-01-01'}).status_code, 400)
+        self.assertEqual(self.client.get('/metrics/vendite/', {'dal': '2026-02-01', 'al': '2026-01-01'}).status_code, 400)
+
+
+class CouponScadenzaTests(TestCase):
+    """
+    Test del riscatto dei coupon, della scadenza e della pulizia dei coupon scaduti.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='scadenze', password='testpass')
+        self.cart = Cart.objects.get(user=self.user)
+        self.client.force_login(self.user)
+
+    def _coupon(self, codice, giorni, is_active=True):
+        return Coupon.objects.create(
+            user=self.user, code=codice, discount=10, description='10%', is_active=is_active,
+            expires_at=timezone.now() + timedelta(days=giorni) if giorni is not None else None,
+        )
+
+    def test_scadenza_solo_se_richiesta(self):
+        """
+        I coupon di benvenuto non scadono; quelli di una campagna solo se e' indicata la validita'.
+        """
+        self.assertFalse(Coupon.objects.filter(user=self.user, expires_at__isnull=False).exists())
+        coupon.conia_coupon([self.user.id], descrizione='Per sempre')
+        self.assertIsNone(Coupon.objects.get(description='Per sempre').expires_at)
+        coupon.conia_coupon([self.user.id], descrizione='Campagna', validita_giorni=30)
+        scadenza = Coupon.objects.get(description='Campagna').expires_at
+        self.assertTrue(timedelta(days=29) < scadenza - timezone.now() <= timedelta(days=30))
+
+    def test_apply_coupon_una_volta_sola_e_non_scaduto(self):
+        """
+        Il coupon si applica una volta; un coupon scaduto non si applica e non compare nella pagina.
+        """
+        self._coupon('VALIDO0001', 5)
+        self._coupon('SCADUTO001', -1)
+        with CaptureQueriesContext(connection) as query:
+            self.client.post('/apply_coupon/', {'coupon_code': 'VALIDO0001'})
+        self.assertEqual(sum(q['sql'].startswith('UPDATE') for q in query.captured_queries), 2)
+        self.assertEqual(Cart.objects.get(id=self.cart.id).coupon.code, 'VALIDO0001')
+
+        self.client.post('/apply_coupon/', {'coupon_code': 'SCADUTO001'})
+        self.assertEqual(Cart.objects.get(id=self.cart.id).coupon.code, 'VALIDO0001')
+        self.assertFalse(coupon.riscatta_coupon(self.user, self.cart.id, 'VALIDO0001'))
+        codici = [c.code for c in self.client.get('/coupon/').context['coupons']]
+        self.assertNotIn('SCADUTO001', codici)
+        self.assertNotIn('VALIDO0001', codici)
+
+    def test_sweep_disattiva_ed_elimina(self):
+        """
+        I coupon scaduti vengono disattivati; quelli scaduti da tempo eliminati, salvo se applicati a un carrello.
+        """
+        self._coupon('SCADUTO001', -1)
+        self._coupon('VECCHIO001', -60, is_active=False)
+        applicato = self._coupon('APPLICATO1', -60, is_active=False)
+        Cart.objects.filter(id=self.cart.id).update(coupon=applicato)
+        self._coupon('VALIDO0001', 5)
+        out = StringIO()
+        call_command('sweep_coupons', batch_size=1, pause=0, purge_after_days=30, stdout=out)
+        self.assertIn('Disattivati 1 coupon scaduti, eliminati 1.', out.getvalue())
+        self.assertFalse(Coupon.objects.get(code='SCADUTO001').is_active)
+        self.assertFalse(Coupon.objects.filter(code='VECCHIO001').exists())
+        self.assertTrue(Coupon.objects.filter(code='APPLICATO1').exists())
+        self.assertTrue(Coupon.objects.get(code='VALIDO0001').is_active)
+
+    def test_coupon_senza_scadenza_eliminato_dopo_il_riscatto(self):
+        """
+        Un coupon senza scadenza, una volta riscattato e tolto dal carrello, viene eliminato come gli altri.
+        """
+        self._coupon('PERSEMPRE1', None)
+        self.assertTrue(coupon.riscatta_coupon(self.user, self.cart.id, 'PERSEMPRE1'))
+        call_command('sweep_coupons', pause=0, purge_after_days=0, stdout=StringIO())
+        self.assertTrue(Coupon.objects.filter(code='PERSEMPRE1').exists())  # Ancora nel carrello
+        Cart.objects.filter(id=self.cart.id).update(coupon=None)  # Checkout
+        call_command('sweep_coupons', pause=0, purge_after_days=0, stdout=StringIO())
+        self.assertFalse(Coupon.objects.filter(code='PERSEMPRE1').exists())
+
+
+class RicercaFullTextTests(TestCase):
+    """
+    Test degli indici full-text di ordini e prodotti e della ricerca nell'admin.
+    """
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='amministratore', password='testpass', email='a@example.com')
+        self.cliente = User.objects.create_user(username='cliente', password='testpass')
+        self.fast_food = FastFood.objects.create(name='McTest', address='Via Test 1', latitudine=45.0, longitudine=9.0)
+        self.big = Order.objects.create(
+            user=self.cliente, total_price='5.00', items='2x Big Mac, 1x Fries', tipo_di_ordine='delivery',
+            fast_food=self.fast_food, delivery_address='Via Emilia 12', delivery_city='Modena',
+        )
+        self.nuggets = Order.objects.create(
+            user=self.cliente, total_price='4.00', items='1x Nuggets', tipo_di_ordine='in_loco', fast_food=self.fast_food,
+        )
+
+    def _trovati(self, testo, modello=Order):
+        return set(ricerca.filtra(modello.objects.all(), testo).values_list('id', flat=True))
+
+    def test_trigger_tengono_allineato_l_indice(self):
+        """
+        Inserimenti, modifiche ed eliminazioni arrivano all'indice; i cambi di stato no.
+        """
+        self.assertEqual(self._trovati('big mac'), {self.big.id})
+        self.assertEqual(self._trovati('"Via Emilia" modena'), {self.big.id})
+        self.assertEqual(self._trovati('nugget'), {self.nuggets.id})
+        self.assertEqual(self._trovati('1x'), {self.big.id, self.nuggets.id})  # Termine corto: icontains
+
+        Order.objects.filter(id=self.nuggets.id).update(items='3x McFlurry')
+        Order.objects.filter(id=self.big.id).update(status='IN PREPARAZIONE')
+        self.assertEqual(self._trovati('nugget'), set())
+        self.assertEqual(self._trovati('flurry'), {self.nuggets.id})
+        self.assertEqual(self._trovati('big mac'), {self.big.id})
+        self.big.delete()
+        self.assertEqual(self._trovati('big mac'), set())
+
+        prodotto = Product.objects.create(name='Chicken Wrap', price='4.50')
+        Product.objects.filter(id=prodotto.id).update(name='Veggie Wrap')
+        self.assertEqual(self._trovati('chicken', Product), set())
+        self.assertEqual(self._trovati('veggie', Product), {prodotto.id})
+
+    def test_ricerca_admin_usa_l_indice(self):
+        """
+        La ricerca dell'admin di ordini e prodotti passa dall'indice, quella dei coupon per prefisso
+        e, se nessun codice inizia cosi', nelle descrizioni.
+        """
+        self.client.force_login(self.admin)
+        with CaptureQueriesContext(connection) as query:
+            response = self.client.get('/admin/gestione/order/', {'q': 'big'})
+        self.assertEqual([o.id for o in response.context['cl'].result_list], [self.big.id])
+        sql = ' '.join(q['sql'] for q in query.captured_queries)
+        self.assertIn('MATCH', sql)
+        # Il LIKE resta solo sui nomi utente, non sulle colonne dell'ordine
+        self.assertNotIn('"gestione_order"."items" LIKE', sql)
+        self.assertIn('"username" LIKE', sql)
+        response = self.client.get('/admin/gestione/order/', {'q': 'lient'})
+        self.assertEqual(len(response.context['cl'].result_list), 2)
+
+        Product.objects.create(name='Chicken Wrap', price='4.50')
+        response = self.client.get('/admin/gestione/product/', {'q': 'wrap'})
+        self.assertEqual([p.name for p in response.context['cl'].result_list], ['Chicken Wrap'])
+
+        Coupon.objects.create(code='ABC1234567', discount=10, description='10%')
+        Coupon.objects.create(code='ABD1234567', discount=10, description='10%')
+        response = self.client.get('/admin/gestione/coupon/', {'q': 'abc'})
+        self.assertEqual([c.code for c in response.context['cl'].result_list], ['ABC1234567'])
+        Coupon.objects.create(code='ZZZ1234567', discount=20, description='Campagna estate')
+        response = self.client.get('/admin/gestione/coupon/', {'q': 'estate'})
+        self.assertEqual([c.code for c in response.context['cl'].result_list], ['ZZZ1234567'])
+        response = self.client.get('/admin/gestione/coupon/', {'q': '1234'})
+        self.assertEqual(len(response.context['cl'].result_list), 3)
+
+    def test_ricerca_nella_gestione_ordini(self):
+        """
+        Il ristoratore cerca gli ordini del fast food per articolo o indirizzo.
+        """
+        staff = User.objects.create_user(username='cucina', password='testpass', is_ristoratore=True)
+        self.client.force_login(staff)
+        response = self.client.get('/gestione_ordine/', {'fast_food': self.fast_food.id, 'q': 'emilia'})
+        self.assertEqual([o.id for o in response.context['ordini_delivery']], [self.big.id])
+        self.assertEqual(list(response.context['ordini_in_loco']), [])
+        self.assertIsNone(response.context['feed_config'])
+
+    def test_rebuild_search_index(self):
+        """
+        Il comando ricrea trigger mancanti e ripopola l'indice.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TRIGGER gestione_order_fts_ai")
+            cursor.execute("INSERT INTO gestione_order_fts(gestione_order_fts) VALUES ('delete-all')")
+        self.assertEqual(self._trovati('big mac'), set())
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('gestione_order_fts: 2 righe indicizzate.', out.getvalue())
+        self.assertEqual(self._trovati('big mac'), {self.big.id})
+        nuovo = Order.objects.create(user=self.cliente, total_price='3.00', items='1x Sundae', tipo_di_ordine='in_loco')
+        self.assertEqual(self._trovati('sundae'), {nuovo.id})
+
+    def test_trigger_ricreati_dopo_migrate(self):
+        """
+        Se una migrazione ricostruisce la tabella e ne elimina i trigger, il post_migrate li ricrea.
+        """
+        from django.core.management.sql import emit_post_migrate_signal
+
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TRIGGER gestione_order_fts_au")
+        Order.objects.filter(id=self.nuggets.id).update(items='1x Sundae')
+        self.assertEqual(self._trovati('sundae'), set())
+        emit_post_migrate_signal(0, False, 'default')
+        self.assertEqual(self._trovati('sundae'), {self.nuggets.id})
+        Order.objects.filter(id=self.nuggets.id).update(items='1x Cheeseburger')
+        self.assertEqual(self._trovati('cheese'), {self.nuggets.id})
+        self.assertEqual(ricerca.ripristina(), [])
@@ -0,0 +1,173 @@
+from collections import defaultdict
+from datetime import timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from .export import intervallo_date
+from .models import ArchivedOrder, Order, SalesRollup
+
+GRANULARITA = ('ora', 'giorno')
+BATCH_SIZE = 500
+
+
+def ora_di(istante):
+    """Inizio dell'ora UTC che contiene istante: la cella del rollup."""
+    return istante.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def _incrementa(fast_food_id, tipo_di_ordine, ora, **delta):
+    cella = SalesRollup.objects.filter(fast_food_id=fast_food_id, tipo_di_ordine=tipo_di_ordine, ora=ora)
+    incrementi = {campo: F(campo) + valore for campo, valore in delta.items()}
+    if cella.update(**incrementi):
+        return
+    try:
+        with transaction.atomic():
+            SalesRollup.objects.create(fast_food_id=fast_food_id, tipo_di_ordine=tipo_di_ordine, ora=ora, **delta)
+    except IntegrityError:
+        # Cella creata nel frattempo da un'altra transazione
+        cella.update(**incrementi)
+
+
+def registra_ordine(order):
+    """Conta un ordine appena creato nella cella della sua ora."""
+    delta = {'ordini': 1, 'incasso': Decimal(order.total_price)}
+    if order.status == 'CONSEGNATO':
+        delta.update(consegnati=1, incasso_consegnato=Decimal(order.total_price))
+    _incrementa(order.fast_food_id, order.tipo_di_ordine, ora_di(order.created_at), **delta)
+
+
+def registra_consegne(order_ids):
+    """
+    Conta come consegnati gli ordini appena passati a CONSEGNATO, nella
+    cella della loro ora di creazione: un UPDATE per cella, non per ordine.
+    """
+    celle = defaultdict(lambda: [0, Decimal('0')])
+    ordini = Order.objects.filter(id__in=order_ids).values_list('fast_food_id', 'tipo_di_ordine', 'created_at', 'total_price')
+    for fast_food_id, tipo, creato, totale in ordini:
+        cella = celle[fast_food_id, tipo, ora_di(creato)]
+        cella[0] += 1
+        cella[1] += totale
+    for (fast_food_id, tipo, ora), (consegnati, incasso) in celle.items():
+        _incrementa(fast_food_id, tipo, ora, consegnati=consegnati, incasso_consegnato=incasso)
+
+
+def togli_ordini(order_ids):
+    """
+    Toglie dalle celle gli ordini che stanno per essere eliminati (non
+    archiviati: gli archiviati restano nel rollup). Va chiamata prima
+    della DELETE, nella stessa transazione.
+    """
+    celle = defaultdict(lambda: {'ordini': 0, 'incasso': Decimal('0'), 'consegnati': 0, 'incasso_consegnato': Decimal('0')})
+    ordini = Order.objects.filter(id__in=order_ids).values_list(
+        'fast_food_id', 'tipo_di_ordine', 'created_at', 'total_price', 'status',
+    )
+    for fast_food_id, tipo, creato, totale, stato in ordini:
+        cella = celle[fast_food_id, tipo, ora_di(creato)]
+        cella['ordini'] -= 1
+        cella['incasso'] -= totale
+        if stato == 'CONSEGNATO':
+            cella['consegnati'] -= 1
+            cella['incasso_consegnato'] -= totale
+    for (fast_food_id, tipo, ora), delta in celle.items():
+        _incrementa(fast_food_id, tipo, ora, **delta)
+
+
+def ricostruisci():
+    """
+    Ricalcola tutte le celle da Order e ArchivedOrder con un GROUP BY per
+    tabella. Tutto in una transazione: nel frattempo le scritture attendono.
+    Restituisce il numero di celle.
+    """
+    celle = defaultdict(lambda: {'ordini': 0, 'incasso': Decimal('0'), 'consegnati': 0, 'incasso_consegnato': Decimal('0')})
+    consegnato = Q(status='CONSEGNATO')
+    with transaction.atomic():
+        for modello in (Order, ArchivedOrder):
+            gruppi = (
+                modello.objects.annotate(ora=TruncHour('created_at', tzinfo=dt_timezone.utc))
+                .values('fast_food_id', 'tipo_di_ordine', 'ora')
+                .annotate(
+                    n=Count('id'),
+                    totale=Sum('total_price'),
+                    n_consegnati=Count('id', filter=consegnato),
+                    totale_consegnati=Sum('total_price', filter=consegnato),
+                )
+                .order_by()
+            )
+            for gruppo in gruppi:
+                cella = celle[gruppo['fast_food_id'], gruppo['tipo_di_ordine'], gruppo['ora']]
+                cella['ordini'] += gruppo['n']
+                cella['incasso'] += gruppo['totale'] or 0
+                cella['consegnati'] += gruppo['n_consegnati']
+                cella['incasso_consegnato'] += gruppo['totale_consegnati'] or 0
+        SalesRollup.objects.all().delete()
+        SalesRollup.objects.bulk_create(
+            [
+                SalesRollup(fast_food_id=fast_food_id, tipo_di_ordine=tipo, ora=ora, **valori)
+                for (fast_food_id, tipo, ora), valori in celle.items()
+            ],
+            batch_size=BATCH_SIZE,
+        )
+    return len(celle)
+
+
+def periodo(dal=None, al=None):
+    """
+    Giorni (estremi inclusi) letti dalla dashboard: senza dal, gli ultimi
+    VENDITE_GIORNI_PREDEFINITI giorni fino ad al (o a oggi). Solleva
+    ValueError se il periodo supera VENDITE_GIORNI_MAX giorni.
+    """
+    fine = al or timezone.localdate()
+    if dal is None:
+        dal = fine - timedelta(days=settings.VENDITE_GIORNI_PREDEFINITI - 1)
+    if dal > fine:
+        raise ValueError("La data iniziale segue quella finale.")
+    if (fine - dal).days >= settings.VENDITE_GIORNI_MAX:
+        raise ValueError(f"Il periodo non può superare {settings.VENDITE_GIORNI_MAX} giorni.")
+    return dal, fine
+
+
+def riepilogo(fast_food_id=None, dal=None, al=None, granularita='giorno'):
+    """
+    Ordini e incassi per fast food, periodo e tipo di ordine letti dalle
+    sole celle del rollup. I giorni sono quelli del fuso locale: le celle
+    sono ore UTC, quindi i totali per giorno sono esatti solo se lo scarto
+    del fuso da UTC e' un numero intero di ore (vero per Europe/Rome).
+    """
+    if granularita not in GRANULARITA:
+        raise ValueError(f"Granularità non supportata: {granularita}")
+    celle = SalesRollup.objects.select_related('fast_food').order_by('ora', 'fast_food_id', 'tipo_di_ordine')
+    if fast_food_id:
+        celle = celle.filter(fast_food_id=fast_food_id)
+    inizio, fine = intervallo_date(dal, al)
+    if inizio:
+        celle = celle.filter(ora__gte=inizio)
+    if fine:
+        celle = celle.filter(ora__lt=fine)
+
+    periodi = {}
+    for cella in celle:
+        locale = timezone.localtime(cella.ora)
+        periodo = locale.isoformat() if granularita == 'ora' else locale.date().isoformat()
+        chiave = (periodo, cella.fast_food_id, cella.tipo_di_ordine)
+        riga = periodi.get(chiave)
+        if riga is None:
+            riga = periodi[chiave] = {
+                'periodo': periodo,
+                'fast_food_id': cella.fast_food_id,
+                'fast_food': cella.fast_food.name if cella.fast_food else None,
+                'tipo_di_ordine': cella.tipo_di_ordine,
+                'ordini': 0, 'incasso': Decimal('0'), 'consegnati': 0, 'incasso_consegnato': Decimal('0'),
+            }
+        riga['ordini'] += cella.ordini
+        riga['incasso'] += cella.incasso
+        riga['consegnati'] += cella.consegnati
+        riga['incasso_consegnato'] += cella.incasso_consegnato
+    return [
+        dict(riga, incasso=str(riga['incasso']), incasso_consegnato=str(riga['incasso_consegnato']))
+        for riga in periodi.values()
+    ]
@@ -0,0 +1,51 @@
+// Mette in cima i fast food piu' vicini al cliente, ordinati per distanza;
+// l'elenco completo resta sotto per chi cerca un altro fast food
+const selectFastFood = document.querySelector('select[name="fast_food"]');
+if (selectFastFood && navigator.geolocation) {
+    navigator.geolocation.getCurrentPosition(function(posizione) {
+        const nearby = JSON.parse(document.getElementById('nearby-url').textContent);
+        fetch(nearby.url + '?lat=' + posizione.coords.latitude + '&lng=' + posizione.coords.longitude + '&k=' + nearby.k)
+            .then(function(risposta) { return risposta.json(); })
+            .then(function(dati) {
+                if (!dati.fast_food.length) {
+                    return;
+                }
+                const vicini = document.createElement('optgroup');
+                vicini.label = 'Vicino a te';
+                dati.fast_food.forEach(function(fastFood) {
+                    const opzione = document.createElement('option');
+                    opzione.value = fastFood.id;
+                    opzione.textContent = fastFood.name + ' (' + fastFood.distanza_km.toFixed(1) + ' km)';
+                    vicini.appendChild(opzione);
+                });
+                const tutti = document.createElement('optgroup');
+                tutti.label = 'Tutti i fast food';
+                selectFastFood.querySelectorAll('option:not([value=""])').forEach(function(opzione) {
+                    tutti.appendChild(opzione);
+                });
+                selectFastFood.appendChild(vicini);
+                selectFastFood.appendChild(tutti);
+            });
+    });
+}
+
+document.querySelectorAll('input[name="order_type"]').forEach(radio => {
+    radio.addEventListener('change', function() {
+        const deliveryFields = document.getElementById('delivery-fields');
+        const fastFoodFields = document.getElementById('fast-food-fields');
+        const addressInput = document.querySelector('input[name="address"]');
+        const cityInput = document.querySelector('input[name="city"]');
+
+        if (this.value === 'delivery') {
+            deliveryFields.style.display = 'block'; // Mostra i campi per Delivery
+            fastFoodFields.style.display = 'block'; // Mostra il campo Fast Food
+            addressInput.required = true; // Rendi obbligatorio l'indirizzo
+            cityInput.required = true; // Rendi obbligatoria la città
+        } else if (this.value === 'in_loco') {
+            deliveryFields.style.display = 'none'; // Nascondi i campi per Delivery
+            fastFoodFields.style.display = 'block'; // Mostra il campo Fast Food
+            addressInput.required = false; // Rimuovi obbligatorietà dell'indirizzo
+            cityInput.required = false; // Rimuovi obbligatorietà della città
+        }
+    });
+});